@@ -1,20 +1,45 @@
 # Version: 0.18.0 - 2025-12-18
 """Mail Agent - Huvudlogik med Global Låsning, Sensorstöd och Restore."""
 
-import imaplib
+import asyncio
 import email
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from email.header import decode_header
+from email.parser import BytesParser
 from pathlib import Path
-from datetime import timedelta
 
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant, callback
-from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.debounce import Debouncer
 from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.storage import STORAGE_DIR
 from homeassistant.util import dt as dt_util
 from homeassistant.const import Platform
 
 from .kallelse_processor import KallelseProcessor
+from .rate_limiter import AiRetryableError
+from .prefilter import MailPrefilter
+from .smtp_outbox import SmtpOutbox, outbox_storage_key
+from .notification_digest import digest_storage_key
+from .scheduler import async_get_scheduler
+from .imap_session import ImapSession, ImapBackoffError, ImapIdleUnsupportedError
+from .storage import MailAgentStore
+from .journal import ProcessingJournal
+from .attachment_store import async_get_attachment_store, blob_hash
+from .message_index import async_get_message_index, content_keys, message_id_key
+from .attachment_stream import StreamingDecoder, parse_part_header, write_part_payload
+from .imap_utils import (
+    chunked,
+    fetch_sizes,
+    format_uid_set,
+    iter_body_parts,
+    parse_bodystructure,
+    parse_fetch_response,
+    parse_folder_list,
+)
 
 from .const import (
     DOMAIN,
@@ -24,17 +49,64 @@ from .const import (
     CONF_USERNAME,
     CONF_PASSWORD,
     CONF_FOLDER,
+    JOURNAL_FETCHED,
+    JOURNAL_ANALYSED,
+    JOURNAL_NOTIFIED,
+    JOURNAL_DONE,
+    JOURNAL_RETRY,
+    CONF_SMTP_SERVER,
+    CONF_SMTP_PORT,
+    CONF_SMTP_SENDER_NAME,
     CONF_SCAN_INTERVAL,
+    CONF_SCAN_MODE,
+    CONF_ADAPTIVE_INTERVAL,
+    CONF_MIN_INTERVAL,
+    CONF_MAX_INTERVAL,
+    CONF_TIME_PROFILE,
+    CONF_UPDATE_WINDOW,
+    CONF_FETCH_BATCH_SIZE,
+    CONF_FETCH_MAX_MB,
+    CONF_MAX_PART_MB,
+    CONF_AI_WORKERS,
+    CONF_PREFILTER_ALLOW,
+    CONF_PREFILTER_DENY,
+    CONF_PREFILTER_THRESHOLD,
     CONF_ENABLE_DEBUG,
     CONF_INTERPRETATION_TYPE,
     TYPE_KALLELSE,
+    SCAN_MODE_IDLE,
+    DEFAULT_SMTP_PORT,
+    DEFAULT_SMTP_SENDER_NAME,
     DEFAULT_SCAN_INTERVAL,
+    DEFAULT_SCAN_MODE,
+    DEFAULT_ADAPTIVE_INTERVAL,
+    DEFAULT_MIN_INTERVAL,
+    DEFAULT_MAX_INTERVAL,
+    DEFAULT_TIME_PROFILE,
+    DEFAULT_UPDATE_WINDOW,
+    ADAPTIVE_BACKOFF_FACTOR,
+    ADAPTIVE_PROFILE_DECAY,
+    DEFAULT_FETCH_BATCH_SIZE,
+    DEFAULT_FETCH_MAX_MB,
+    DEFAULT_MAX_PART_MB,
+    DEFAULT_AI_WORKERS,
+    DEFAULT_PREFILTER_THRESHOLD,
     DEFAULT_ENABLE_DEBUG,
+    IMAP_IDLE_REARM,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    RETRY_MAX_ATTEMPTS,
+    IMAP_IDLE_RETRY,
+    ATTACHMENT_CHUNK_BYTES,
+    AI_QUEUE_PER_WORKER,
     SIGNAL_MAIL_AGENT_UPDATE,
 )
 
 PLATFORMS = [Platform.BINARY_SENSOR, Platform.SENSOR]
 
+# Pipeline-markör för mail som inte kunde hämtas (till skillnad från None = medvetet överhoppat)
+_FETCH_FAILED = object()
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Setup."""
     config = entry.data
@@ -46,35 +118,53 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         entry.entry_id
     )
 
-    remove_listener = async_track_time_interval(
-        hass, scanner.check_mail, timedelta(seconds=scanner.scan_interval)
-    )
-
     hass.data.setdefault(DOMAIN, {})
     hass.data[DOMAIN][entry.entry_id] = {
         "scanner": scanner,
-        "remove_listener": remove_listener,
     }
 
+    # Läs in UID-markörer innan första sökningen
+    await scanner.async_load()
+
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
+    # Starta polling-timer eller IDLE-tråd beroende på vald sökmetod
+    scanner.async_start()
+
     entry.async_on_unload(entry.add_update_listener(update_listener))
     return True
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     if entry.entry_id in hass.data[DOMAIN]:
-        hass.data[DOMAIN][entry.entry_id]["remove_listener"]()
+        hass.data[DOMAIN][entry.entry_id]["scanner"].async_stop()
 
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        data = hass.data[DOMAIN].pop(entry.entry_id)
+        # Logga ut den långlivade IMAP-sessionen
+        await hass.async_add_executor_job(data["scanner"].close)
 
     return unload_ok
 
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Rensa sparad synkdata när kontot tas bort."""
+    await MailAgentStore(hass, _sync_storage_key(entry.entry_id)).async_remove()
+    await MailAgentStore(hass, outbox_storage_key(entry.entry_id)).async_remove()
+    await MailAgentStore(hass, digest_storage_key(entry.entry_id)).async_remove()
+    await hass.async_add_executor_job(ProcessingJournal(_journal_path(hass, entry.entry_id)).remove)
+
 async def update_listener(hass: HomeAssistant, entry: ConfigEntry):
     await hass.config_entries.async_reload(entry.entry_id)
 
 
+def _sync_storage_key(entry_id):
+    return f"{DOMAIN}.{entry_id}.sync"
+
+
+def _journal_path(hass, entry_id):
+    return hass.config.path(STORAGE_DIR, f"{DOMAIN}.{entry_id}.journal")
+
+
 class MailAgentScanner:
     def __init__(self, hass, config, entry_id):
         self.hass = hass
@@ -85,29 +175,100 @@ class MailAgentScanner:
         self.port = config.get(CONF_IMAP_PORT)
         self.user = config.get(CONF_USERNAME)
         self.password = config.get(CONF_PASSWORD)
-        self.folder = config.get(CONF_FOLDER)
+        # Mapparna söks i den här ordningen; IDLE bevakar den första
+        self.folders = parse_folder_list(config.get(CONF_FOLDER))
 
         self.scan_interval = config.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL)
+        self.scan_mode = config.get(CONF_SCAN_MODE) or DEFAULT_SCAN_MODE
+        self.adaptive_interval = config.get(CONF_ADAPTIVE_INTERVAL, DEFAULT_ADAPTIVE_INTERVAL)
+        self.min_interval = config.get(CONF_MIN_INTERVAL) or DEFAULT_MIN_INTERVAL
+        self.max_interval = max(config.get(CONF_MAX_INTERVAL) or DEFAULT_MAX_INTERVAL, self.min_interval)
+        self.time_profile = config.get(CONF_TIME_PROFILE, DEFAULT_TIME_PROFILE)
+        # Startar kort i adaptivt läge och glesas sedan ut om inget kommer
+        self._current_interval = self.min_interval if self.adaptive_interval else self.scan_interval
+        self.fetch_batch_size = config.get(CONF_FETCH_BATCH_SIZE) or DEFAULT_FETCH_BATCH_SIZE
+        self.fetch_max_bytes = (config.get(CONF_FETCH_MAX_MB) or DEFAULT_FETCH_MAX_MB) * 1024 * 1024
+        self.max_part_bytes = (config.get(CONF_MAX_PART_MB) or DEFAULT_MAX_PART_MB) * 1024 * 1024
+        self.ai_workers = config.get(CONF_AI_WORKERS) or DEFAULT_AI_WORKERS
         self.enable_debug = config.get(CONF_ENABLE_DEBUG, DEFAULT_ENABLE_DEBUG)
         self.interpretation_type = config.get(CONF_INTERPRETATION_TYPE, TYPE_KALLELSE)
 
+        # Utgående mail skickas från utkorgens egen tråd, inte från sökningen
+        self._outbox = SmtpOutbox(
+            hass,
+            entry_id,
+            config.get(CONF_SMTP_SERVER),
+            config.get(CONF_SMTP_PORT, DEFAULT_SMTP_PORT),
+            self.user,
+            self.password,
+            config.get(CONF_SMTP_SENDER_NAME, DEFAULT_SMTP_SENDER_NAME),
+            self.enable_debug,
+        )
+
         self.processor = None
         if self.interpretation_type == TYPE_KALLELSE:
-            self.processor = KallelseProcessor(hass, config)
+            self.processor = KallelseProcessor(hass, config, self._outbox, entry_id)
         else:
             LOGGER.warning("Okänd tolkningstyp: %s. Fallback till Kallelse.", self.interpretation_type)
-            self.processor = KallelseProcessor(hass, config)
+            self.processor = KallelseProcessor(hass, config, self._outbox, entry_id)
+
+        # Lokal sållning så att uppenbart ointressanta mail inte når Gemini
+        threshold = config.get(CONF_PREFILTER_THRESHOLD)
+        self.prefilter = MailPrefilter(
+            config.get(CONF_PREFILTER_ALLOW),
+            config.get(CONF_PREFILTER_DENY),
+            DEFAULT_PREFILTER_THRESHOLD if threshold is None else threshold,
+        )
+
+        # Gemensam, innehållsadresserad lagring av bilagor (sätts i async_load)
+        self._attachments = None
+        # Gemensamt dubblettindex över alla konton (sätts i async_load)
+        self._message_index = None
+
+        # UIDVALIDITY och senast behandlade UID per mapp
+        self._sync_store = MailAgentStore(hass, _sync_storage_key(entry_id), {"folders": {}})
+
+        # Varje mails bearbetningssteg, så att avbrutet arbete kan återupptas
+        self._journal = ProcessingJournal(_journal_path(hass, entry_id))
+
+        # Långlivad IMAP-anslutning som återanvänds mellan sökningar
+        self._session = ImapSession(
+            self.server, self.port, self.user, self.password, self.enable_debug
+        )
+
+        # AI-analyser körs parallellt; hämtning och åtgärder stannar i sök-tråden
+        self._ai_pool = ThreadPoolExecutor(
+            max_workers=self.ai_workers, thread_name_prefix=f"mail_agent_ai_{entry_id[:8]}"
+        )
+        self._max_in_flight = self.ai_workers * AI_QUEUE_PER_WORKER
+
+        # Gemensam timer och trådpool för alla konton
+        self._scheduler = async_get_scheduler(hass)
 
-        self.storage_dir = Path(hass.config.path("www", "mail_agent_temp"))
-        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        # Sensoruppdateringar slås ihop till högst en per fönster
+        update_window = config.get(CONF_UPDATE_WINDOW)
+        if update_window is None:
+            update_window = DEFAULT_UPDATE_WINDOW
+        self._update_debouncer = None
+        if update_window > 0:
+            self._update_debouncer = Debouncer(
+                hass, LOGGER, cooldown=update_window, immediate=True, function=self._async_dispatch_update
+            )
+        self._update_lock = threading.Lock()
+        self._update_requested = False
 
         # STATE & LOCK
         self._is_scanning = False
+        self._polling = False
+        self._idle_thread = None
+        self._stop_event = threading.Event()
 
         # SENSOR DATA
-        self._is_connected = False
         self._last_scan_success = None  # datetime
         self._emails_processed_count = 0
+        self._prefilter_skipped = 0
+        self._prefilter_analyzed = 0
+        self._duplicates_skipped = 0
         self._last_event_summary = "Ingen händelse än"
 
     @property
@@ -116,7 +277,15 @@ class MailAgentScanner:
 
     @property
     def is_connected(self):
-        return self._is_connected
+        return self._session.is_connected
+
+    @property
+    def current_interval(self):
+        return self._current_interval if self._polling else None
+
+    @property
+    def queue_depth(self):
+        return self._scheduler.queue_depth(self.entry_id)
 
     @property
     def last_scan_success(self):
@@ -130,6 +299,14 @@ class MailAgentScanner:
     def last_event_summary(self):
         return self._last_event_summary
 
+    @property
+    def prefilter_counts(self):
+        return {
+            "skipped": self._prefilter_skipped,
+            "analyzed": self._prefilter_analyzed,
+            "duplicates": self._duplicates_skipped,
+        }
+
     # --- RESTORE METODER (NYTT I v0.19.0) ---
     def restore_email_count(self, count):
         """Återställ räknaren från sensorns minne."""
@@ -141,13 +318,124 @@ class MailAgentScanner:
         """Återställ senaste händelse från sensorns minne."""
         self._last_event_summary = summary
 
+    def restore_prefilter_counts(self, skipped, analyzed, duplicates=0):
+        """Återställ förfiltrets räknare från sensorns attribut."""
+        self._prefilter_skipped = skipped
+        self._prefilter_analyzed = analyzed
+        self._duplicates_skipped = duplicates
+
     def restore_last_scan(self, last_scan_dt):
         """Återställ tid för senaste sökning."""
         self._last_scan_success = last_scan_dt
     # ----------------------------------------
 
+    async def async_load(self):
+        """Läs in sparad synkstatus och koppla in gemensamma lager."""
+        await self._sync_store.async_load()
+        await self.hass.async_add_executor_job(self._journal.load)
+        await self._outbox.async_load()
+        self._attachments = await async_get_attachment_store(self.hass)
+        # Ofullbordade mail i journalen behåller sina bilagor tills de är klara
+        self._attachments.reset_pins(
+            f"{self.entry_id}:",
+            {key: entry.get("attachments", []) for key, entry in self._journal.pending()},
+        )
+        self._message_index = await async_get_message_index(self.hass)
+        await self.processor.async_load()
+
+    def close(self):
+        """Stäng IMAP-sessionen, AI-poolen och utkorgen (körs i executor vid unload)."""
+        # Sökningen avbryts vid nästa mail; sessionens lås väntar in den innan
+        # AI-poolen stängs, så att inga analyser avbryts medan den pågår
+        self._stop_event.set()
+        self._session.close()
+        self._ai_pool.shutdown(wait=False, cancel_futures=True)
+        # Väntande sammanfattning läggs i utkorgen innan den stoppas
+        self.processor.flush_notifications()
+        self._outbox.stop()
+
+    @callback
+    def async_start(self):
+        """Starta bevakning med IDLE (push) eller fast intervall (polling)."""
+        self._outbox.start()
+        if self.scan_mode == SCAN_MODE_IDLE:
+            self._idle_thread = threading.Thread(
+                target=self._idle_loop,
+                name=f"mail_agent_idle_{self.entry_id}",
+                daemon=True,
+            )
+            self._idle_thread.start()
+        else:
+            self._async_start_polling()
+
+    @callback
+    def async_stop(self):
+        """Stoppa timer och IDLE-tråd."""
+        self._stop_event.set()
+        self._session.interrupt_idle()
+        if self._polling:
+            self._scheduler.async_unregister(self.entry_id)
+            self._polling = False
+        if self._update_debouncer is not None:
+            self._update_debouncer.async_shutdown()
+
+    @callback
+    def _async_start_polling(self):
+        if self._stop_event.is_set() or self._polling:
+            return
+        self._scheduler.async_register(self.entry_id, self._current_interval, self.check_mail)
+        self._polling = True
+
+    def _idle_loop(self):
+        """Egen tråd: sök, vänta i IDLE tills servern meddelar nytt mail, upprepa."""
+        need_scan = True
+        while not self._stop_event.is_set():
+            if need_scan:
+                self._run_scan_from_thread()
+                if self._stop_event.is_set():
+                    break
+
+            was_connected = self._session.is_connected
+            try:
+                if len(self.folders) == 1:
+                    need_scan = self._session.idle(self.folders[0], IMAP_IDLE_REARM, self._stop_event)
+                else:
+                    # IDLE täcker bara den valda mappen, så övriga kontrolleras
+                    # med STATUS minst en gång per sökintervall
+                    self._session.idle(
+                        self.folders[0], min(IMAP_IDLE_REARM, self.scan_interval), self._stop_event
+                    )
+                    need_scan = True
+            except ImapIdleUnsupportedError:
+                LOGGER.warning(
+                    "Servern %s stöder inte IDLE. Faller tillbaka till polling var %s s.",
+                    self.server, self.scan_interval,
+                )
+                self.hass.add_job(self._async_start_polling)
+                return
+            except ImapBackoffError:
+                need_scan = True
+                self._stop_event.wait(IMAP_IDLE_RETRY)
+            except Exception as e:
+                LOGGER.error("Fel under IMAP IDLE: %s", e)
+                need_scan = True
+                self._stop_event.wait(IMAP_IDLE_RETRY)
+
+            if was_connected != self._session.is_connected:
+                self._request_update()
+
+    def _run_scan_from_thread(self):
+        """Kör check_mail i event-loopen och vänta tills sökningen är klar."""
+        future = asyncio.run_coroutine_threadsafe(self.check_mail(), self.hass.loop)
+        try:
+            future.result()
+        except Exception as e:
+            LOGGER.error("Sökning från IDLE misslyckades: %s", e)
+
     async def check_mail(self, now=None):
         """Asynkron startpunkt som anropas av timer."""
+        if self._stop_event.is_set():
+            return
         if self._is_scanning:
             if self.enable_debug:
                 LOGGER.debug("Sökning pågår redan.")
@@ -157,104 +445,710 @@ class MailAgentScanner:
         self._notify_update()  # Uppdatera binary_sensor.scanning till On
 
         try:
-            await self.hass.async_add_executor_job(self._check_mail_sync)
+            new_mail = await self._scheduler.async_run(self.entry_id, self._check_mail_sync, self._notify_update)
+            if self.adaptive_interval and self._polling and new_mail is not None:
+                self._adapt_interval(new_mail)
         finally:
             self._is_scanning = False
             self._notify_update()  # Uppdatera binary_sensor.scanning till Off
 
+    @callback
+    def _adapt_interval(self, new_mail):
+        """Kort intervall efter aktivitet, exponentiell backoff när det är tyst."""
+        now = dt_util.now()
+        ceiling = self.max_interval
+        if self.time_profile:
+            ceiling = self._profile_ceiling(now, new_mail)
+
+        if new_mail:
+            interval = self.min_interval
+        else:
+            interval = self._current_interval * ADAPTIVE_BACKOFF_FACTOR
+        interval = round(max(self.min_interval, min(ceiling, interval)))
+
+        if interval != self._current_interval:
+            if self.enable_debug:
+                LOGGER.debug("Nytt sökintervall: %s s (%s nya mail)", interval, new_mail)
+            self._current_interval = interval
+            self._scheduler.async_set_interval(self.entry_id, interval)
+
+    def _profile_ceiling(self, now, new_mail):
+        """Uppdatera dygnsprofilen och ge taket för intervallet den här timmen.
+
+        Profilen är antal mail per timme med daglig avklingning. Timmar där
+        mail brukar komma får ett lägre tak, tysta timmar hela max-intervallet.
+        """
+        today = now.date().isoformat()
+        with self._sync_store.lock:
+            profile = self._sync_store.data.setdefault("profile", {"day": today, "hours": [0.0] * 24})
+            if profile["day"] != today:
+                profile["hours"] = [h * ADAPTIVE_PROFILE_DECAY for h in profile["hours"]]
+                profile["day"] = today
+            if new_mail:
+                profile["hours"][now.hour] += new_mail
+            busiest = max(profile["hours"])
+            share = profile["hours"][now.hour] / busiest if busiest else 0.0
+        if new_mail:
+            self._sync_store.schedule_save()
+        return self.max_interval - (self.max_interval - self.min_interval) * share
+
     @callback
     def _notify_update(self):
+        """Begär att sensorerna uppdateras. Täta anrop slås ihop av debouncern."""
+        with self._update_lock:
+            self._update_requested = False
+        if self._stop_event.is_set():
+            return
+        if self._update_debouncer is None:
+            self._async_dispatch_update()
+        else:
+            self._update_debouncer.async_schedule_call()
+
+    def _request_update(self):
+        """Som `_notify_update` men från en tråd; väcker event-loopen högst en gång per begäran."""
+        with self._update_lock:
+            if self._update_requested:
+                return
+            self._update_requested = True
+        self.hass.loop.call_soon_threadsafe(self._notify_update)
+
+    @callback
+    def _async_dispatch_update(self):
         """Skicka signal till sensorerna att data har ändrats."""
         async_dispatcher_send(self.hass, f"{SIGNAL_MAIL_AGENT_UPDATE}_{self.entry_id}")
 
     def _check_mail_sync(self):
-        """Synkron logik i executor-tråden."""
-        mail_con = None
+        """Synkron logik i sök-tråden. Returnerar antal nya mail, eller None vid fel."""
+        new_mail = None
+        was_connected = self._session.is_connected
         try:
-            mail_con = imaplib.IMAP4_SSL(self.server, self.port)
-            mail_con.login(self.user, self.password)
-            mail_con.select(self.folder)
-
-            # Anslutning lyckades
-            if not self._is_connected:
-                self._is_connected = True
-                self.hass.add_job(self._notify_update)
-
-            status, messages = mail_con.search(None, "UNSEEN")
-            if status != "OK" or not messages[0]:
-                self._last_scan_success = dt_util.now()
-                self.hass.add_job(self._notify_update)
-                return
+            with self._session.connection() as mail_con:
+                # Anslutning lyckades
+                if not was_connected:
+                    self._request_update()
 
-            mail_ids = messages[0].split()
+                new_mail = 0
+                for folder in self.folders:
+                    if self._stop_event.is_set():
+                        break
+                    status = self._session.status(folder)
+                    if status is None:
+                        LOGGER.warning("Mappen %s finns inte på servern, hoppar över den.", folder)
+                        continue
+                    if not self._folder_changed(folder, status):
+                        continue
+                    self._session.select(folder)
+                    new_mail += self._scan_folder(mail_con, folder)
+                    if self._stop_event.is_set():
+                        # Avbruten sökning: mappen ska sökas igen efter omstarten
+                        break
+                    self._save_folder_status(folder, status)
+
+            # Uppdatera timestamp för lyckad scan
+            self._last_scan_success = dt_util.now()
 
+        except ImapBackoffError as e:
             if self.enable_debug:
-                LOGGER.info("Hittade %s nya mail.", len(mail_ids))
+                LOGGER.debug("Hoppar över sökning: %s", e)
+        except Exception as e:
+            LOGGER.error("Fel vid anslutning/sökning: %s", e)
+        finally:
+            # Alltid skicka en sista uppdatering
+            self._request_update()
+        return new_mail
 
-            for mail_id in mail_ids:
-                try:
-                    res, msg_data = mail_con.fetch(mail_id, "(RFC822)")
+    def _folder_changed(self, folder, status):
+        """Avgör utifrån STATUS om mappen behöver sökas igenom.
 
-                    if not msg_data:
-                        LOGGER.warning("Ingen data hämtades för mail ID %s", mail_id)
-                        continue
+        En oförändrad mapp (samma UIDVALIDITY och UIDNEXT som efter förra
+        sökningen, inga förfallna omförsök och inget ofullbordat i journalen)
+        hoppas över utan SELECT.
+        """
+        with self._sync_store.lock:
+            cursor = self._sync_store.data["folders"].get(folder) or {}
+            if status["uidnext"] is None or cursor.get("uidnext") != status["uidnext"]:
+                return True
+            if cursor.get("uidvalidity") != status["uidvalidity"]:
+                return True
+            now = time.time()
+            if any(state["next"] <= now for state in (cursor.get("retry") or {}).values()):
+                return True
+        return bool(self._journal.pending(folder))
 
-                    for response_part in msg_data:
-                        if isinstance(response_part, tuple):
-                            try:
-                                # type: ignore undertrycker VS Code/Pylance-felet
-                                msg = email.message_from_bytes(response_part[1]) # type: ignore
-                                self._process_single_mail(msg)
-                            except Exception as e:
-                                LOGGER.error("Kunde inte parsa mail-innehåll (tuple): %s", e)
+    def _save_folder_status(self, folder, status):
+        """Kom ihåg UIDNEXT från STATUS före sökningen.
 
-                        elif isinstance(response_part, (bytes, str)):
-                            if self.enable_debug:
-                                LOGGER.debug("Ignorerar IMAP-del av typ %s: %s", type(response_part), response_part)
+        Mail som kommer under sökningen får ett högre UID, så mappen söks igen nästa gång.
+        """
+        with self._sync_store.lock:
+            cursor = self._sync_store.data["folders"].get(folder)
+            if cursor is None or cursor.get("uidvalidity") != status["uidvalidity"]:
+                return
+            cursor["uidnext"] = status["uidnext"]
+        self._sync_store.schedule_save()
 
-                        else:
-                            LOGGER.warning("Oväntad datatyp i IMAP-svar: %s. Hoppar över.", type(response_part))
+    def _scan_folder(self, mail_con, folder):
+        """Hämta och bearbeta nya mail i den valda mappen, baserat på UID."""
+        uidvalidity = self._session.uidvalidity
+        with self._sync_store.lock:
+            cursor = dict(self._sync_store.data["folders"].get(folder) or {})
 
-                except Exception as e:
-                    LOGGER.error("Fel vid bearbetning av mail ID %s: %s", mail_id, e)
+        if uidvalidity is None or cursor.get("uidvalidity") != uidvalidity or "last_uid" not in cursor:
+            # Första synken (eller ny UIDVALIDITY): ta olästa som tidigare och
+            # sätt sedan högvattenmärket så att bara nyare UID hämtas framöver.
+            # Utan last_uid avbröts en tidigare initial synk; gör om den.
+            if cursor and self.enable_debug:
+                LOGGER.info("UIDVALIDITY ändrad för %s, gör om initial synk.", folder)
+            uids = self._uid_search(mail_con, "UNSEEN")
+            baseline = max([(self._session.uidnext or 1) - 1] + uids)
+        else:
+            last_uid = cursor.get("last_uid", 0)
+            uids = [uid for uid in self._uid_search(mail_con, "UID", f"{last_uid + 1}:*") if uid > last_uid]
+            baseline = None
 
-            # Uppdatera timestamp för lyckad scan
-            self._last_scan_success = dt_util.now()
+            # Mail vars analys misslyckades tillfälligt och vars väntetid har gått ut
+            now = time.time()
+            retry_uids = [
+                int(uid) for uid, state in (cursor.get("retry") or {}).items() if state["next"] <= now
+            ]
+            if retry_uids:
+                if self.enable_debug:
+                    LOGGER.info("Försöker igen med %s mail i omförsökskön.", len(retry_uids))
+                uids = sorted(set(uids) | set(retry_uids))
 
-        except Exception as e:
-            LOGGER.error("Fel vid anslutning/sökning: %s", e)
-            if self._is_connected:
-                self._is_connected = False
-                self.hass.add_job(self._notify_update)
+        # Mail som avbröts (t.ex. av en omstart) innan de blev klara
+        refetch = self._resume_journal(mail_con, folder, uidvalidity)
+        if refetch:
+            uids = sorted(set(uids) | set(refetch))
+
+        # Redan klara mail vars markör inte hann sparas hoppas över
+        uids = [
+            uid for uid in uids
+            if self._journal.state(self._message_key(folder, uidvalidity, uid)) != JOURNAL_DONE
+        ]
+
+        if uids and self.enable_debug:
+            LOGGER.info("Hittade %s nya mail.", len(uids))
+
+        # (uid, jobb) i UID-ordning; jobbet är None om mailet hoppades över
+        # och _FETCH_FAILED om det inte kunde hämtas
+        pipeline = deque()
+        track_cursor = baseline is None
+
+        try:
+            for batch in chunked(uids, self.fetch_batch_size):
+                if self._stop_event.is_set():
+                    break
+                # Steg 1: struktur och huvuden för hela batchen i en rundresa
+                overview = self._fetch_overview(mail_con, batch)
+                plans = {uid: self._plan_parts(overview[uid]) for uid in batch if uid in overview}
+
+                # Steg 2: bara de delar som faktiskt används (text/plain och PDF)
+                contents = self._fetch_parts(mail_con, plans)
+
+                for uid in batch:
+                    if self._stop_event.is_set():
+                        # Unload: resten hämtas vid nästa start (markören står kvar)
+                        break
+                    job = None
+                    if uid not in plans or (plans[uid]["items"] and uid not in contents):
+                        LOGGER.warning("Ingen data hämtades för mail UID %s", uid)
+                        job = _FETCH_FAILED
+                    else:
+                        try:
+                            message_key = self._message_key(folder, uidvalidity, uid)
+                            job = self._process_fetched(
+                                mail_con, uid, message_key, overview[uid], plans[uid], contents.get(uid, {})
+                            )
+                            if job is not None:
+                                job["key"] = message_key
+                                self._journal.record(
+                                    message_key,
+                                    JOURNAL_FETCHED,
+                                    folder=folder,
+                                    uidvalidity=uidvalidity,
+                                    uid=uid,
+                                    message_id=job["message_id"],
+                                    sender=job["sender"],
+                                    subject=job["subject"],
+                                    attachments=[str(p) for p in job["attachment_paths"]],
+                                )
+                                self._attachments.pin(message_key, job["attachment_paths"])
+                        except (mail_con.abort, OSError):
+                            # Anslutningen är död, låt sessionen återansluta vid nästa sökning
+                            raise
+                        except Exception as e:
+                            LOGGER.error("Fel vid bearbetning av mail UID %s: %s", uid, e)
+                            job = _FETCH_FAILED
+
+                    pipeline.append((uid, job))
+                    # Begränsad kö: vänta in äldsta analysen när för många är i luften
+                    self._drain_pipeline(
+                        mail_con, pipeline, folder, uidvalidity, track_cursor, limit=self._max_in_flight
+                    )
+
+                # Släpp batchens rådata innan nästa hämtas
+                del overview, contents
         finally:
-            if mail_con:
-                try:
-                    mail_con.close()
-                    mail_con.logout()
-                except Exception:
-                    pass
-            # Alltid skicka en sista uppdatering
-            self.hass.add_job(self._notify_update)
+            # Redan hämtade mail appliceras även om anslutningen dör
+            self._drain_pipeline(mail_con, pipeline, folder, uidvalidity, track_cursor, limit=0)
+
+        if baseline is not None and uidvalidity is not None and not self._stop_event.is_set():
+            self._save_cursor(folder, uidvalidity, baseline)
+        return len(uids)
+
+    def _drain_pipeline(self, mail_con, pipeline, folder, uidvalidity, track_cursor, limit):
+        """Applicera färdiga analyser i UID-ordning tills högst `limit` återstår.
+
+        Markören flyttas bara fram efter att ett mail har applicerats, så
+        ordningen och "högst en gång" gäller även med flera AI-arbetare.
+        Mailen markeras som lästa först när de är helt klara. Vid unload
+        avbryts analyser som inte har börjat; de mailen räknas som obehandlade.
+        """
+        finished = []
+        while pipeline:
+            uid, job = pipeline[0]
+            analysing = isinstance(job, dict)
+            if analysing and self._stop_event.is_set():
+                job["future"].cancel()
+            if analysing and not job["future"].done() and len(pipeline) <= limit:
+                break
+            pipeline.popleft()
+            if analysing and job["future"].cancelled():
+                # Inte behandlat: står kvar som hämtat i journalen, olästa och
+                # utan att markören flyttas, och hämtas om vid nästa start
+                continue
+            if job is _FETCH_FAILED:
+                self._fetch_failed(folder, uidvalidity, uid, track_cursor)
+                continue
+            retry = analysing and self._apply_mail(job)
+            # Omförsökskön gäller även under initial synk, så att mailet inte
+            # hamnar bakom högvattenmärket utan att någon tar hand om det
+            queued = self._update_retry(folder, uidvalidity, uid, retry)
+            if track_cursor:
+                self._save_cursor(folder, uidvalidity, uid)
+            if retry and not queued:
+                # Inte i kön (omförsöken gav upp): mailet blev aldrig analyserat.
+                # Hämtas det om gör det nytt anspråk på nycklarna.
+                self._release_dedup_keys(job)
+            if queued:
+                self._journal.record(job["key"], JOURNAL_RETRY)
+                # Omförsöket hämtar mailet på nytt, bilagorna behöver inte hållas kvar
+                self._attachments.unpin(job["key"])
+            elif retry and uidvalidity is None:
+                # Ingen kö utan UIDVALIDITY: mailet ligger kvar som hämtat i journalen och hämtas om
+                continue
+            else:
+                finished.append(uid)
+        self._mark_done(mail_con, folder, uidvalidity, finished)
+
+    def _fetch_failed(self, folder, uidvalidity, uid, track_cursor):
+        """Hantera ett mail som inte kunde hämtas: det lämnas oläst och försöks igen.
+
+        Omförsökskön tar över mailet som vid en tillfälligt misslyckad analys.
+        Ger kön upp avslutas journalen, men mailet markeras aldrig som läst.
+        """
+        key = self._message_key(folder, uidvalidity, uid)
+        if self._update_retry(folder, uidvalidity, uid, True):
+            self._journal.record(key, JOURNAL_RETRY)
+        elif uidvalidity is not None:
+            self._journal.record(key, JOURNAL_DONE)
+        else:
+            # Ingen kö utan UIDVALIDITY: mailet är fortfarande oläst och tas vid nästa initiala synk
+            return
+        self._attachments.unpin(key)
+        if track_cursor:
+            self._save_cursor(folder, uidvalidity, uid)
+
+    def _mark_done(self, mail_con, folder, uidvalidity, uids):
+        """Sätt \\Seen på klara mail och avsluta dem i journalen.
+
+        Misslyckas STORE ligger mailen kvar i journalen och avslutas vid nästa sökning.
+        """
+        if not uids:
+            return
+        try:
+            # BODY.PEEK sätter inte \\Seen, så markera som läst som tidigare
+            mail_con.uid("STORE", format_uid_set(uids), "+FLAGS.SILENT", "(\\Seen)")
+        except Exception as e:
+            LOGGER.warning("Kunde inte markera %s mail som lästa: %s", len(uids), e)
+            return
+        keys = [self._message_key(folder, uidvalidity, uid) for uid in uids]
+        self._journal.record_many(keys, JOURNAL_DONE)
+        for key in keys:
+            self._attachments.unpin(key)
+
+    def _resume_journal(self, mail_con, folder, uidvalidity):
+        """Återuppta mail i mappen som journalen visar inte blev klara.
+
+        Mail som avbröts efter analysen slutförs härifrån utan nytt AI-anrop.
+        Returnerar UID för mail som bara hann hämtas och därför hämtas om.
+        """
+        refetch = []
+        finished = []
+        for key, entry in self._journal.pending(folder):
+            if entry.get("uidvalidity") != uidvalidity:
+                # Mappen har numrerats om, UID:t pekar inte längre på samma mail
+                self._journal.record(key, JOURNAL_DONE)
+                self._attachments.unpin(key)
+                continue
+            uid = entry["uid"]
+            if entry["s"] == JOURNAL_FETCHED:
+                refetch.append(uid)
+                continue
+            if entry["s"] != JOURNAL_NOTIFIED:
+                if self.enable_debug:
+                    LOGGER.info("Återupptar mail UID %s från steget '%s'.", uid, entry["s"])
+                ai_data = dict(entry.get("ai_data") or {})
+                if "calendar" in entry:
+                    ai_data["calendar"] = entry["calendar"]
+                future = Future()
+                future.set_result(ai_data)
+                self._apply_mail({
+                    "key": key,
+                    "sender": entry.get("sender"),
+                    "subject": entry.get("subject"),
+                    "attachment_paths": [Path(p) for p in entry.get("attachments", []) if Path(p).exists()],
+                    "future": future,
+                    "done_steps": (JOURNAL_ANALYSED, entry["s"]),
+                })
+            finished.append(uid)
+        self._mark_done(mail_con, folder, uidvalidity, finished)
+        if refetch and self.enable_debug:
+            LOGGER.info("Hämtar om %s avbrutna mail enligt journalen.", len(refetch))
+        return refetch
+
+    def _message_key(self, folder, uidvalidity, uid):
+        return f"{self.entry_id}:{folder}:{uidvalidity}:{uid}"
+
+    def _fetch_overview(self, mail_con, batch):
+        """Hämta struktur och huvuden för en batch.
+
+        Svarar servern NO/BAD görs ett nytt försök; misslyckas även det avbryts
+        sökningen, så att batchen inte tolkas som tom och markören står kvar.
+        """
+        uid_set = format_uid_set(batch)
+        for _ in range(2):
+            res, data = mail_con.uid("FETCH", uid_set, "(UID RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER])")
+            if res == "OK":
+                return parse_fetch_response(data)
+            LOGGER.warning("FETCH av UID %s misslyckades (%s): %s", uid_set, res, data)
+        raise mail_con.error(f"Kunde inte hämta UID {uid_set}: {data}")
+
+    def _plan_parts(self, overview):
+        """Välj vilka delar som ska hämtas utifrån BODYSTRUCTURE."""
+        structure = parse_bodystructure(overview["meta"])
+        if structure is None:
+            # Okänd struktur: hämta hela meddelandet som förut
+            size = fetch_sizes({0: overview}).get(0, 0)
+            return {"full": True, "text": None, "pdfs": [], "items": ["BODY.PEEK[]"], "bytes": size}
+
+        parts = list(iter_body_parts(structure))
+        is_multipart = not (parts and parts[0]["top_level"])
+        plan = {"full": False, "text": None, "pdfs": [], "items": [], "bytes": 0}
+
+        for part in parts:
+            if part["size"] > self.max_part_bytes:
+                LOGGER.warning(
+                    "Hoppar över del %s (%s, %s byte) som är större än gränsen.",
+                    part["section"], part["type"], part["size"],
+                )
+                continue
+            if part["top_level"]:
+                # Enkelt meddelande: hela kroppen är texten, huvudet har Content-Type
+                plan["text"] = "TEXT"
+                plan["items"].append("BODY.PEEK[TEXT]")
+                plan["bytes"] += part["size"]
+            elif plan["text"] is None and part["type"] == "text/plain":
+                plan["text"] = part["section"]
+                plan["items"] += [f"BODY.PEEK[{part['section']}.MIME]", f"BODY.PEEK[{part['section']}]"]
+                plan["bytes"] += part["size"]
+            elif is_multipart and part["filename"] and "pdf" in part["type"]:
+                # Bara MIME-huvudet här; innehållet strömmas till disk separat
+                plan["pdfs"].append(part["section"])
+                plan["items"].append(f"BODY.PEEK[{part['section']}.MIME]")
+        return plan
+
+    def _fetch_parts(self, mail_con, plans):
+        """Hämta valda delar. Mail med samma delar hämtas i samma FETCH."""
+        groups = {}
+        for uid, plan in plans.items():
+            if plan["items"]:
+                groups.setdefault(tuple(plan["items"]), []).append(uid)
+
+        contents = {}
+        for items, group in groups.items():
+            for chunk in self._split_by_bytes(group, plans):
+                res, data = mail_con.uid("FETCH", format_uid_set(chunk), f"(UID {' '.join(items)})")
+                if res != "OK":
+                    continue
+                for uid, message in parse_fetch_response(data).items():
+                    contents[uid] = message["literals"]
+        return contents
 
-    def _process_single_mail(self, msg):
+    def _split_by_bytes(self, uids, plans):
+        """Dela upp så att varje FETCH håller sig under byte-taket."""
+        chunk, chunk_bytes = [], 0
+        for uid in uids:
+            size = plans[uid]["bytes"]
+            if chunk and chunk_bytes + size > self.fetch_max_bytes:
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(uid)
+            chunk_bytes += size
+        if chunk:
+            yield chunk
+
+    def _process_fetched(self, mail_con, uid, message_key, overview, plan, literals):
+        """Bygg ihop ett delvis hämtat mail och skicka det vidare."""
+        if plan["full"]:
+            raw = literals.get("BODY[]")
+            if raw is None:
+                raise ValueError("Meddelandet kunde inte hämtas")
+            msg = email.message_from_bytes(raw)
+            if self._is_duplicate(message_key, msg, [message_id_key(msg.get("Message-ID"))]):
+                return None
+            body = self._get_mail_body(msg)
+            has_pdf = msg.is_multipart() and any(self._attachment_name(part) for part in msg.walk())
+            if not self._should_analyze(msg, body, has_pdf):
+                return None
+            return self._submit_mail(msg, body, self._save_attachments(msg), message_key)
+
+        header_bytes = overview["literals"].get("BODY[HEADER]", b"")
+        headers = BytesParser().parsebytes(header_bytes, headersonly=True)
+        # Samma Message-ID redan sett (annat konto eller annan mapp): inget mer hämtas
+        if self._is_duplicate(message_key, headers, [message_id_key(headers.get("Message-ID"))]):
+            return None
+
+        body = ""
+        if plan["text"] == "TEXT":
+            body = self._get_mail_body(self._load_part(literals, "TEXT", header_bytes))
+        elif plan["text"]:
+            body = self._get_mail_body(self._load_part(literals, plan["text"]))
+
+        # Sålla innan bilagorna laddas ner
+        if not self._should_analyze(headers, body, bool(plan["pdfs"])):
+            return None
+
+        attachment_paths = []
+        for section in plan["pdfs"]:
+            path = self._stream_attachment(
+                mail_con, uid, section, literals.get(f"BODY[{section}.MIME]", b"")
+            )
+            if path:
+                attachment_paths.append(path)
+
+        return self._submit_mail(headers, body, attachment_paths, message_key)
+
+    def _is_duplicate(self, message_key, headers, keys):
+        """Slå upp (och reservera) nycklarna i det gemensamma dubblettindexet."""
+        owner = self._message_index.claim(keys, message_key)
+        if owner is None:
+            return False
+        self._duplicates_skipped += 1
+        if self.enable_debug:
+            LOGGER.info(
+                "Hoppar över dubblett '%s' (redan behandlad som %s).",
+                self._decode_subject(headers["Subject"]), owner,
+            )
+        return True
+
+    def _should_analyze(self, headers, body, has_pdf):
+        """Kör förfiltret och räkna utfallet."""
+        subject = self._decode_subject(headers["Subject"])
+        analyze, score, reason = self.prefilter.classify(headers, subject, body, has_pdf)
+        if analyze:
+            self._prefilter_analyzed += 1
+        else:
+            self._prefilter_skipped += 1
+        if self.enable_debug:
+            LOGGER.info(
+                "Förfilter: %s '%s' (%s, poäng %s)",
+                "analyserar" if analyze else "hoppar över", subject, reason, score,
+            )
+        return analyze
+
+    def _stream_attachment(self, mail_con, uid, section, mime_header):
+        """Hämta en PDF-del i bitar och avkoda den direkt till fil.
+
+        Högst ATTACHMENT_CHUNK_BYTES av bilagan finns i minnet åt gången.
+        """
+        part = parse_part_header(mime_header)
+        filename = self._attachment_name(part)
+        if filename is None:
+            return None
+
+        item = f"BODY[{section}]"
+        offset = 0
+        with self._attachments.open_blob(filename) as blob:
+            decoder = StreamingDecoder(blob, part.get("Content-Transfer-Encoding"))
+            while True:
+                res, data = mail_con.uid(
+                    "FETCH", str(uid), f"(UID BODY.PEEK[{section}]<{offset}.{ATTACHMENT_CHUNK_BYTES}>)"
+                )
+                if res != "OK":
+                    raise ValueError(f"Kunde inte hämta del {section}: {data}")
+                chunk = parse_fetch_response(data).get(uid, {}).get("literals", {}).get(item)
+                if not chunk:
+                    break
+                decoder.write(chunk)
+                offset += len(chunk)
+                if len(chunk) < ATTACHMENT_CHUNK_BYTES:
+                    break
+            decoder.close()
+        return blob.path
+
+    def _load_part(self, literals, section, mime_header=None):
+        """Skapa ett Message av en dels MIME-huvud och innehåll."""
+        if mime_header is None:
+            mime_header = literals.get(f"BODY[{section}.MIME]", b"")
+        return BytesParser().parsebytes(mime_header + literals.get(f"BODY[{section}]", b""))
+
+    def _uid_search(self, mail_con, *criteria):
+        """UID SEARCH som returnerar en sorterad lista med heltal."""
+        status, data = mail_con.uid("SEARCH", None, *criteria)
+        if status != "OK" or not data or not data[0]:
+            return []
+        return sorted(int(uid) for uid in data[0].split())
+
+    def _folder_cursor(self, folder, uidvalidity):
+        """Mappens markör för `uidvalidity`. Anropas med synklåset taget."""
+        cursor = self._sync_store.data["folders"].setdefault(folder, {})
+        if cursor.get("uidvalidity") != uidvalidity:
+            # Ny UIDVALIDITY: gamla UID (och omförsök) gäller inte längre
+            cursor.clear()
+            cursor["uidvalidity"] = uidvalidity
+        return cursor
+
+    def _save_cursor(self, folder, uidvalidity, last_uid):
+        """Flytta fram högvattenmärket och spara det (fördröjt).
+
+        Markören flyttas aldrig bakåt, så omförsök av äldre UID påverkar den inte.
+        Omförsökskön ligger kvar, och dess UID hämtas oavsett var markören står.
+        """
+        with self._sync_store.lock:
+            cursor = self._folder_cursor(folder, uidvalidity)
+            cursor["last_uid"] = max(last_uid, cursor.get("last_uid", 0))
+        self._sync_store.schedule_save()
+
+    def _update_retry(self, folder, uidvalidity, uid, retry):
+        """Lägg till eller ta bort ett mail i mappens omförsökskö.
+
+        Returnerar True om mailet ligger i kön efteråt.
+        """
+        if uidvalidity is None:
+            return False
+        with self._sync_store.lock:
+            existing = (self._sync_store.data["folders"].get(folder) or {}).get("retry") or {}
+            if not retry and str(uid) not in existing:
+                return False
+            cursor = self._folder_cursor(folder, uidvalidity)
+            queue = cursor.get("retry") or {}
+            state = queue.pop(str(uid), None)
+            queued = False
+            if retry:
+                attempts = (state or {}).get("attempts", 0) + 1
+                if attempts >= RETRY_MAX_ATTEMPTS:
+                    LOGGER.error("Ger upp mail UID %s efter %s försök.", uid, attempts)
+                else:
+                    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+                    queue[str(uid)] = {"attempts": attempts, "next": time.time() + delay}
+                    LOGGER.warning("Mail UID %s läggs i omförsökskön (nytt försök om %s s).", uid, delay)
+                    queued = True
+            if queue:
+                cursor["retry"] = queue
+            else:
+                cursor.pop("retry", None)
+        self._sync_store.schedule_save()
+        return queued
+
+    def _submit_mail(self, msg, body=None, attachment_paths=None, message_key=None):
+        """Lägg ett mail i AI-kön. Vid delhämtning är `msg` bara huvudet.
+
+        Returnerar None om innehållet redan har behandlats via ett annat mail.
+        """
         subject = self._decode_subject(msg["Subject"])
         sender = msg.get("From")
-        body = self._get_mail_body(msg)
-        attachment_paths = self._save_attachments(msg)
+        if body is None:
+            body = self._get_mail_body(msg)
+        if attachment_paths is None:
+            attachment_paths = self._save_attachments(msg)
+
+        dedup_keys = content_keys(subject, body, [blob_hash(p) for p in attachment_paths])
+        if message_key and self._is_duplicate(message_key, msg, dedup_keys):
+            return None
+        dedup_keys.append(message_id_key(msg.get("Message-ID")))
 
         if self.enable_debug:
             LOGGER.info(f"Hämtat mail från {sender}. Processar...")
 
+        return {
+            "message_id": msg.get("Message-ID"),
+            "dedup_keys": dedup_keys,
+            "sender": sender,
+            "subject": subject,
+            "attachment_paths": attachment_paths,
+            "future": self._submit_analysis(subject, body, attachment_paths),
+        }
+
+    def _submit_analysis(self, subject, body, attachment_paths):
+        """Lägg analysen i AI-poolen. Efter unload fås en avbruten future."""
+        try:
+            return self._ai_pool.submit(self.processor.analyze_email, subject, body, attachment_paths)
+        except RuntimeError:
+            # Poolen är stängd; mailet lämnas obehandlat i stället för att räknas som misslyckat
+            future = Future()
+            future.cancel()
+            return future
+
+    def _apply_mail(self, job):
+        """Agera på en färdig analys (kalender, notiser, sensorer).
+
+        Returnerar True om analysen misslyckades tillfälligt och ska göras om.
+        """
+        try:
+            ai_data = job["future"].result()
+        except AiRetryableError as e:
+            LOGGER.warning("AI-analys tillfälligt misslyckad för %s: %s", job["subject"], e)
+            return True
+        except Exception as e:
+            LOGGER.error("AI-analys misslyckades för %s: %s", job["subject"], e)
+            ai_data = None
+
+        if ai_data is None:
+            # Analysen gav inget (processorn fångar själv de flesta fel),
+            # så låt en kopia av mailet få en ny chans
+            self._release_dedup_keys(job)
+
         self._emails_processed_count += 1
 
-        if self.processor:
-            result = self.processor.process_email(sender, subject, body, attachment_paths)
-            if result and result.get("summary"):
+        if ai_data is not None:
+            done_steps = job.get("done_steps", ())
+            if not done_steps:
+                self._journal.record(job["key"], JOURNAL_ANALYSED, ai_data=ai_data)
+            result = self.processor.apply_result(
+                job["sender"],
+                job["subject"],
+                job["attachment_paths"],
+                ai_data,
+                done_steps,
+                lambda step, **data: self._journal.record(job["key"], step, **data),
+            )
+            events = (result or {}).get("events") or []
+            if len(events) > 1:
+                self._last_event_summary = f"{events[0].get('summary')} (+{len(events) - 1} till)"
+            elif result and result.get("summary"):
                 self._last_event_summary = result.get("summary")
             elif result:
-                self._last_event_summary = f"Analys klar (inget event): {subject}"
+                self._last_event_summary = f"Analys klar (inget event): {job['subject']}"
+            if result and (result.get("calendar") or {}).get("errors"):
+                self._last_event_summary = f"{self._last_event_summary} (kalenderfel)"
 
-        self.hass.add_job(self._notify_update)
+        self._request_update()
+        return False
+
+    def _release_dedup_keys(self, job):
+        self._message_index.release(job.get("dedup_keys", ()), job["key"])
 
     def _save_attachments(self, msg):
         saved_paths = []
@@ -262,17 +1156,29 @@ class MailAgentScanner:
             for part in msg.walk():
                 if part.get_content_maintype() == 'multipart':
                     continue
-                filename = part.get_filename()
-                if not filename:
-                    continue
-                if "pdf" in part.get_content_type():
-                    filename = "".join(c for c in filename if c.isalnum() or c in "._- ")
-                    filepath = self.storage_dir / filename
-                    with open(filepath, "wb") as f:
-                        f.write(part.get_payload(decode=True))
+                filepath = self._save_attachment(part)
+                if filepath:
                     saved_paths.append(filepath)
         return saved_paths
 
+    def _save_attachment(self, part):
+        """Spara en PDF-del i bilagelagringen. Returnerar sökvägen eller None."""
+        filename = self._attachment_name(part)
+        if filename is None:
+            return None
+        with self._attachments.open_blob(filename) as blob:
+            write_part_payload(part, blob)
+        return blob.path
+
+    def _attachment_name(self, part):
+        """Säkert filnamn för en PDF-bilaga, eller None om delen inte ska sparas."""
+        filename = part.get_filename()
+        if not filename:
+            return None
+        if "pdf" not in part.get_content_type():
+            return None
+        return "".join(c for c in filename if c.isalnum() or c in "._- ") or "bilaga.pdf"
+
     def _get_mail_body(self, msg):
         body = ""
         if msg.is_multipart():
@@ -0,0 +1,91 @@
+# Fil: custom_components/mail_agent/ai_cache.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Persistent cache för AI-analyser, nycklad på innehållets hash."""
+
+import asyncio
+import copy
+import hashlib
+import json
+import time
+
+from .const import (
+    DOMAIN,
+    DATA_AI_CACHE,
+    AI_CACHE_TTL_HOURS,
+    AI_CACHE_MAX_ENTRIES,
+)
+from .storage import MailAgentStore
+
+
+async def async_get_ai_cache(hass):
+    """Hämta (och vid behov skapa) den gemensamma AI-cachen."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    cache = domain_data.get(DATA_AI_CACHE)
+    if cache is None:
+        cache = domain_data[DATA_AI_CACHE] = AiResultCache(hass)
+    await cache.async_ensure_loaded()
+    return cache
+
+
+def _normalize(text):
+    return " ".join((text or "").split())
+
+
+class AiResultCache:
+    """LRU-cache med TTL för ai_data.
+
+    Nyckeln bygger på modell, dagens datum (relativa datum i prompten), ämne
+    och text i normaliserad form samt bilagornas SHA-256.
+    """
+
+    def __init__(self, hass):
+        self.hass = hass
+        self.ttl = AI_CACHE_TTL_HOURS * 3600
+        self.max_entries = AI_CACHE_MAX_ENTRIES
+        self._store = MailAgentStore(hass, f"{DOMAIN}.ai_cache", {"entries": {}})
+        self._load_lock = None
+        self._loaded = False
+
+    async def async_ensure_loaded(self):
+        if self._loaded:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if not self._loaded:
+                await self._store.async_load()
+                self._loaded = True
+
+    @staticmethod
+    def make_key(model, today, subject, body, attachment_hashes):
+        payload = json.dumps(
+            [model, today, _normalize(subject), _normalize(body), list(attachment_hashes)],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Returnera en kopia av sparad ai_data, eller None."""
+        with self._store.lock:
+            entries = self._store.data["entries"]
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            if entry["created"] + self.ttl < time.time():
+                del entries[key]
+                self._store.schedule_save()
+                return None
+            # Flytta sist så att ordningen motsvarar senaste användning
+            entries[key] = entries.pop(key)
+            return copy.deepcopy(entry["data"])
+
+    def put(self, key, ai_data):
+        now = time.time()
+        with self._store.lock:
+            entries = self._store.data["entries"]
+            entries.pop(key, None)
+            entries[key] = {"created": now, "data": copy.deepcopy(ai_data)}
+            for old_key in [k for k, v in entries.items() if v["created"] + self.ttl < now]:
+                del entries[old_key]
+            while len(entries) > self.max_entries:
+                del entries[next(iter(entries))]
+        self._store.schedule_save()
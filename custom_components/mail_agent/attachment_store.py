@@ -0,0 +1,253 @@
+# Fil: custom_components/mail_agent/attachment_store.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Innehållsadresserad lagring av bilagor med deduplicering och gallring."""
+
+import asyncio
+import hashlib
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+from .const import (
+    DOMAIN,
+    LOGGER,
+    DATA_ATTACHMENT_STORE,
+    ATTACHMENT_STORE_MAX_MB,
+    ATTACHMENT_STORE_MAX_AGE_DAYS,
+)
+from .mime_stream import encoded_path, encoded_sidecar
+from .storage import MailAgentStore
+
+_TMP_PREFIX = ".tmp-"
+
+
+async def async_get_attachment_store(hass):
+    """Hämta (och vid behov skapa) den gemensamma bilagelagringen."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    store = domain_data.get(DATA_ATTACHMENT_STORE)
+    if store is None:
+        store = AttachmentStore(hass, Path(hass.config.path("www", "mail_agent_temp")))
+        domain_data[DATA_ATTACHMENT_STORE] = store
+    await store.async_ensure_loaded()
+    return store
+
+
+def blob_hash(path):
+    """SHA-256 för en blob i lagringen, utan att läsa om filen (katalogens namn)."""
+    return Path(path).parent.name
+
+
+class AttachmentStore:
+    """Bilagor lagras som <sha256>/<filnamn> under mail_agent_temp.
+
+    Identiskt innehåll lagras bara en gång. Ett index i .storage håller
+    storlek och senaste användning per blob. Gamla och minst nyligen använda blobbar gallras bort, utom de som
+    är fästa (pin) av något som fortfarande behöver dem: utkorgen, en
+    väntande sammanfattning eller ett ofullbordat mail i journalen.
+    """
+
+    def __init__(self, hass, root):
+        self.hass = hass
+        self.root = root
+        self.max_bytes = ATTACHMENT_STORE_MAX_MB * 1024 * 1024
+        self.max_age = ATTACHMENT_STORE_MAX_AGE_DAYS * 86400
+        self._index = MailAgentStore(hass, f"{DOMAIN}.attachments", {"blobs": {}, "pins": {}})
+        self._load_lock = None
+        self._loaded = False
+
+    async def async_ensure_loaded(self):
+        if self._loaded:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if self._loaded:
+                return
+            await self._index.async_load()
+            # Äldre versioner sparade även vilka blobbar varje mail hade
+            self._index.data.pop("messages", None)
+            await self.hass.async_add_executor_job(self.sweep)
+            self._loaded = True
+
+    def open_blob(self, filename):
+        """Öppna en skrivare; innehållet hashas medan det skrivs."""
+        return BlobWriter(self, filename)
+
+    def pin(self, owner, paths):
+        """Fäst bilagorna åt `owner` (ersätter tidigare), så att de inte gallras.
+
+        Tom lista släpper ägarens fästen. Fästa blobbar räknas som använda nu.
+        """
+        now = time.time()
+        with self._index.lock:
+            pins = self._index.data.setdefault("pins", {})
+            blobs = self._index.data["blobs"]
+            shas = sorted({blob_hash(path) for path in paths} & blobs.keys())
+            if shas:
+                pins[owner] = shas
+                for sha in shas:
+                    blobs[sha]["last_used"] = now
+            elif pins.pop(owner, None) is None:
+                return
+        self._index.schedule_save()
+
+    def unpin(self, owner):
+        self.pin(owner, [])
+
+    def reset_pins(self, prefix, owners):
+        """Ersätt alla fästen vars ägare börjar med `prefix` med {ägare: sökvägar}.
+
+        Anropas vid start, så att fästen från ägare som försvann vid en krasch släpps.
+        """
+        with self._index.lock:
+            pins = self._index.data.setdefault("pins", {})
+            for owner in [owner for owner in pins if owner.startswith(prefix)]:
+                del pins[owner]
+        for owner, paths in owners.items():
+            self.pin(owner, paths)
+        self._index.schedule_save()
+
+    def encoded_path(self, path):
+        """Base64-kopian av en blob (se mime_stream), medräknad i lagringens storlek."""
+        target = encoded_path(path)
+        size = target.stat().st_size
+        with self._index.lock:
+            info = self._index.data["blobs"].get(blob_hash(path))
+            if info is None or info.get("encoded_size") == size:
+                return target
+            info["encoded_size"] = size
+            self._enforce_limits(keep=blob_hash(path))
+        self._index.schedule_save()
+        return target
+
+    def sweep(self):
+        """Ta bort föräldralösa filer och indexposter. Körs i executor vid start."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        removed = 0
+        with self._index.lock:
+            blobs = self._index.data["blobs"]
+            for entry in self.root.iterdir():
+                info = blobs.get(entry.name)
+                if info is not None and (entry / info["name"]).is_file():
+                    removed += self._sweep_blob_dir(entry, info)
+                    continue
+                # Äldre lösa filer, avbrutna skrivningar och okända mappar
+                _remove(entry)
+                removed += 1
+            for sha in [sha for sha in blobs if not (self.root / sha / blobs[sha]["name"]).is_file()]:
+                self._forget(sha)
+            self._enforce_limits(keep=None)
+        if removed:
+            LOGGER.info("Rensade %s föräldralösa filer i %s.", removed, self.root)
+        self._index.schedule_save()
+
+    def _sweep_blob_dir(self, blob_dir, info):
+        """Behåll bara bloben och dess base64-kopia; räkna om kopians storlek."""
+        blob = blob_dir / info["name"]
+        sidecar = encoded_sidecar(blob)
+        removed = 0
+        for path in blob_dir.iterdir():
+            if path not in (blob, sidecar):
+                # T.ex. en kodning som avbröts av en omstart
+                _remove(path)
+                removed += 1
+        try:
+            info["encoded_size"] = sidecar.stat().st_size
+        except FileNotFoundError:
+            info.pop("encoded_size", None)
+        return removed
+
+    def _commit(self, tmp_path, sha, filename, size):
+        """Flytta in en färdigskriven fil, eller återanvänd befintlig blob."""
+        now = time.time()
+        with self._index.lock:
+            blobs = self._index.data["blobs"]
+            info = blobs.get(sha)
+            if info is not None and (self.root / sha / info["name"]).is_file():
+                tmp_path.unlink(missing_ok=True)
+                info["last_used"] = now
+            else:
+                blob_dir = self.root / sha
+                blob_dir.mkdir(parents=True, exist_ok=True)
+                tmp_path.replace(blob_dir / filename)
+                info = blobs[sha] = {"name": filename, "size": size, "created": now, "last_used": now}
+
+            self._enforce_limits(keep=sha)
+            path = self.root / sha / info["name"]
+        self._index.schedule_save()
+        return path
+
+    def _enforce_limits(self, keep):
+        blobs = self._index.data["blobs"]
+        pinned = {sha for shas in self._index.data.get("pins", {}).values() for sha in shas}
+        if keep is not None:
+            pinned.add(keep)
+        cutoff = time.time() - self.max_age
+        for sha in [sha for sha, info in blobs.items() if info["last_used"] < cutoff and sha not in pinned]:
+            self._evict(sha)
+
+        # Base64-kopian som utkorgen skapar ligger i samma katalog och räknas med
+        total = sum(info["size"] + info.get("encoded_size", 0) for info in blobs.values())
+        for sha in sorted(blobs, key=lambda s: blobs[s]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if sha in pinned:
+                continue
+            total -= blobs[sha]["size"] + blobs[sha].get("encoded_size", 0)
+            self._evict(sha)
+
+    def _evict(self, sha):
+        _remove(self.root / sha)
+        self._forget(sha)
+
+    def _forget(self, sha):
+        self._index.data["blobs"].pop(sha, None)
+        pins = self._index.data.get("pins", {})
+        for owner in list(pins):
+            if sha in pins[owner]:
+                pins[owner].remove(sha)
+                if not pins[owner]:
+                    del pins[owner]
+
+
+class BlobWriter:
+    """Filobjekt som skriver till en temporär fil och hashar samtidigt."""
+
+    def __init__(self, store, filename):
+        self._store = store
+        self._filename = filename
+        self._digest = hashlib.sha256()
+        self._size = 0
+        self._tmp_path = store.root / f"{_TMP_PREFIX}{uuid.uuid4().hex}"
+        self._file = None
+        self.path = None
+
+    def __enter__(self):
+        self._store.root.mkdir(parents=True, exist_ok=True)
+        self._file = open(self._tmp_path, "wb")
+        return self
+
+    def write(self, data):
+        self._digest.update(data)
+        self._size += len(data)
+        return self._file.write(data)
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is not None:
+            self._tmp_path.unlink(missing_ok=True)
+            return False
+        self.path = self._store._commit(
+            self._tmp_path, self._digest.hexdigest(), self._filename, self._size
+        )
+        return False
+
+
+def _remove(path):
+    try:
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink(missing_ok=True)
+    except OSError as e:
+        LOGGER.warning("Kunde inte ta bort %s: %s", path, e)
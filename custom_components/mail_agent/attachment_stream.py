@@ -0,0 +1,71 @@
+# Fil: custom_components/mail_agent/attachment_stream.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Strömmande avkodning av bilagor direkt till disk."""
+
+import binascii
+from email.parser import BytesFeedParser
+
+_WHITESPACE = b" \t\r\n"
+PAYLOAD_SLICE = 64 * 1024  # tecken per bit när en redan parsad del skrivs ut
+
+
+def parse_part_header(mime_header):
+    """Tolka en dels MIME-huvud inkrementellt (utan innehåll)."""
+    parser = BytesFeedParser()
+    parser.feed(mime_header)
+    return parser.close()
+
+
+class StreamingDecoder:
+    """Avkodar Content-Transfer-Encoding bit för bit och skriver till en fil.
+
+    Endast en ofullständig rad/base64-grupp hålls kvar mellan anropen, så
+    minnet begränsas av storleken på varje bit oavsett bilagans storlek.
+    """
+
+    def __init__(self, fileobj, encoding):
+        self._file = fileobj
+        self._encoding = (encoding or "7bit").strip().lower()
+        self._rest = b""
+
+    def write(self, data):
+        if self._encoding == "base64":
+            data = self._rest + data.translate(None, _WHITESPACE)
+            usable = len(data) - len(data) % 4
+            self._rest = data[usable:]
+            if usable:
+                self._file.write(binascii.a2b_base64(data[:usable]))
+        elif self._encoding == "quoted-printable":
+            data = self._rest + data
+            # Avkoda bara hela rader så att mjuka radbrytningar (=\r\n) hålls ihop
+            end = data.rfind(b"\n") + 1
+            self._rest = data[end:]
+            if end:
+                self._file.write(binascii.a2b_qp(data[:end]))
+        else:
+            self._file.write(data)
+
+    def close(self):
+        rest, self._rest = self._rest, b""
+        if not rest:
+            return
+        if self._encoding == "base64":
+            try:
+                self._file.write(binascii.a2b_base64(rest + b"=" * (-len(rest) % 4)))
+            except binascii.Error:
+                pass
+        elif self._encoding == "quoted-printable":
+            self._file.write(binascii.a2b_qp(rest))
+
+
+def write_part_payload(part, fileobj):
+    """Skriv en redan parsad del till fil utan en extra avkodad kopia i minnet."""
+    encoding = str(part.get("Content-Transfer-Encoding", "7bit")).lower()
+    payload = part.get_payload()
+    if encoding not in ("base64", "quoted-printable") or not isinstance(payload, str):
+        fileobj.write(part.get_payload(decode=True) or b"")
+        return
+
+    decoder = StreamingDecoder(fileobj, encoding)
+    for start in range(0, len(payload), PAYLOAD_SLICE):
+        decoder.write(payload[start:start + PAYLOAD_SLICE].encode("ascii", "surrogateescape"))
+    decoder.close()
@@ -28,6 +28,7 @@ class MailAgentBaseBinarySensor(BinarySensorEntity):
     def __init__(self, scanner, entry):
         self._scanner = scanner
         self._entry = entry
+        self._last_written = None
         self._attr_device_info = {
             "identifiers": {(DOMAIN, entry.entry_id)},
             "name": entry.title,
@@ -46,6 +47,11 @@ class MailAgentBaseBinarySensor(BinarySensorEntity):
 
     @callback
     def _update_callback(self):
+        # Skriv bara när värdet (eller attributen) faktiskt har ändrats
+        snapshot = (self.is_on, self.extra_state_attributes)
+        if snapshot == self._last_written:
+            return
+        self._last_written = snapshot
         self.async_write_ha_state()
 
 
@@ -0,0 +1,141 @@
+# Fil: custom_components/mail_agent/body_compactor.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Komprimering av mailtext innan den skickas till AI-modellen."""
+
+import re
+
+from .const import CHARS_PER_TOKEN
+from .prefilter import DATE_PATTERN, TIME_PATTERN
+
+# Rader som inleder citerad historik i ett svar
+_REPLY_MARKERS = re.compile(
+    r"^(?:on .{0,200} wrote:|den .{0,200} skrev .{0,200}:|.{0,200} skrev:"
+    r"|-{2,} ?(?:original message|ursprungligt meddelande) ?-{2,})\s*$"
+)
+# Outlook-stil: "Från:" följt av "Skickat:"/"Sent:" på någon av de närmaste raderna
+_OUTLOOK_FROM = re.compile(r"^(?:från|from):\s")
+_OUTLOOK_SENT = re.compile(r"^(?:skickat|sent|datum|date):\s")
+# Efter en vidarebefordran är det vidarebefordrade innehållet det intressanta
+_FORWARD_MARKER = re.compile(
+    r"^(?:-{2,} ?(?:forwarded message|vidarebefordrat meddelande)|begin forwarded message:)"
+)
+_SIGNATURE_MARKERS = re.compile(r"^(?:-- ?|skickat från min .*|sent from my .*|hämta outlook för .*)$")
+_NOISE_LINE = re.compile(r"^[\s\-_=*#~.|]+$")
+_SPACES = re.compile(r"[ \t\u00a0]+")
+
+# Text före citatet kortare än så här är troligen en vidarebefordran; behåll allt
+_MIN_OWN_TEXT = 40
+_OMITTED = "[...]"
+
+
+def estimate_tokens(text):
+    """Grov uppskattning av antal tokens (ca 4 tecken per token)."""
+    return len(text or "") // CHARS_PER_TOKEN
+
+
+def compact_body(body, token_budget):
+    """Ta bort citat, signatur och brus och korta texten till `token_budget`.
+
+    Vid kortning prioriteras rader med datum eller klockslag; övriga rader
+    fylls på i ordning. Raderna behåller sin ursprungliga ordning.
+    Returnerar (text, sparade tokens). `token_budget` 0 betyder ingen gräns.
+    """
+    if not body:
+        return "", 0
+
+    raw_lines = body.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    lines = _strip_history(raw_lines)
+    if not _has_own_datetime(lines) and _has_datetime(raw_lines):
+        # Bokningen finns bara i historiken (t.ex. ett svar på en kallelse)
+        lines = raw_lines
+
+    # Slå ihop blanksteg och hoppa över rena avdelare och upprepade tomrader
+    cleaned = []
+    for line in lines:
+        line = _SPACES.sub(" ", line).strip()
+        if line and _NOISE_LINE.match(line):
+            continue
+        if not line and (not cleaned or not cleaned[-1]):
+            continue
+        cleaned.append(line)
+    while cleaned and not cleaned[-1]:
+        cleaned.pop()
+
+    text = "\n".join(cleaned)
+    if token_budget and estimate_tokens(text) > token_budget:
+        text = _fit_budget(cleaned, token_budget * CHARS_PER_TOKEN)
+
+    return text, max(0, estimate_tokens(body) - estimate_tokens(text))
+
+
+def _strip_history(lines):
+    """Klipp vid citerad historik och signatur, och släng '>'-rader.
+
+    Från en vidarebefordran och framåt behålls allt.
+    """
+    kept = []
+    own_chars = 0
+    for index, line in enumerate(lines):
+        lowered = line.strip().lower()
+        if _FORWARD_MARKER.match(lowered):
+            return kept + lines[index:]
+        if _SIGNATURE_MARKERS.match(lowered) and own_chars:
+            break
+        if own_chars >= _MIN_OWN_TEXT and (
+            _REPLY_MARKERS.match(lowered)
+            or (
+                _OUTLOOK_FROM.match(lowered)
+                and any(_OUTLOOK_SENT.match(next_line.strip().lower()) for next_line in lines[index + 1:index + 4])
+            )
+        ):
+            break
+        if lowered.startswith(">"):
+            continue
+        kept.append(line)
+        own_chars += len(lowered)
+    return kept
+
+
+def _has_datetime(lines):
+    return any(_is_datetime_line(line) for line in lines)
+
+
+def _has_own_datetime(lines):
+    """Som `_has_datetime`, men svarsrader ("Den 3 maj ... skrev:", "Skickat:") räknas inte."""
+    for line in lines:
+        lowered = line.strip().lower()
+        if _REPLY_MARKERS.match(lowered) or _OUTLOOK_FROM.match(lowered) or _OUTLOOK_SENT.match(lowered):
+            continue
+        if _is_datetime_line(line):
+            return True
+    return False
+
+
+def _is_datetime_line(line):
+    return bool(DATE_PATTERN.search(line.lower()) or TIME_PATTERN.search(line))
+
+
+def _fit_budget(lines, max_chars):
+    """Välj rader inom teckenbudgeten, datum- och tidsrader först."""
+    max_chars -= len(_OMITTED) + 1
+    priority = [i for i, line in enumerate(lines) if _is_datetime_line(line)]
+    prioritized = set(priority)
+    rest = [i for i in range(len(lines)) if i not in prioritized]
+
+    chosen = set()
+    used = 0
+    for i in priority + rest:
+        cost = len(lines[i]) + 1
+        if used + cost > max_chars:
+            if i in prioritized:
+                continue
+            break
+        chosen.add(i)
+        used += cost
+
+    out = []
+    for i, line in enumerate(lines):
+        if i in chosen:
+            out.append(line)
+        elif not out or out[-1] != _OMITTED:
+            out.append(_OMITTED)
+    return "\n".join(out)
@@ -0,0 +1,86 @@
+# Fil: custom_components/mail_agent/calendar_index.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Index över skapade kalenderhändelser för att undvika dubbletter."""
+
+import asyncio
+import re
+import time
+
+from .const import (
+    DOMAIN,
+    DATA_CALENDAR_INDEX,
+    CALENDAR_INDEX_KEEP_DAYS,
+)
+from .storage import MailAgentStore
+
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+async def async_get_calendar_index(hass):
+    """Hämta (och vid behov skapa) det gemensamma kalenderindexet."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    index = domain_data.get(DATA_CALENDAR_INDEX)
+    if index is None:
+        index = domain_data[DATA_CALENDAR_INDEX] = CalendarEventIndex(hass)
+    await index.async_ensure_loaded()
+    return index
+
+
+def _normalize(text):
+    return _NON_WORD.sub(" ", (text or "").lower()).strip()
+
+
+class CalendarEventIndex:
+    """Skapade events per kalender, nycklade på (start, sammanfattning, plats).
+
+    Delas av alla konton så att samma kallelse till flera konton bara bokas
+    en gång per kalender. Poster rensas när starttiden passerats med
+    CALENDAR_INDEX_KEEP_DAYS.
+    """
+
+    def __init__(self, hass):
+        self.hass = hass
+        self._store = MailAgentStore(hass, f"{DOMAIN}.calendar_index", {"calendars": {}})
+        self._load_lock = None
+        self._loaded = False
+
+    async def async_ensure_loaded(self):
+        if self._loaded:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if not self._loaded:
+                await self._store.async_load()
+                self._loaded = True
+
+    @staticmethod
+    def make_key(dt_start, summary, location):
+        return f"{dt_start.isoformat()}|{_normalize(summary)}|{_normalize(location)}"
+
+    def claim(self, calendar_entity, key, start_ts):
+        """Reservera ett event. Returnerar False om det redan finns i kalendern."""
+        with self._store.lock:
+            calendars = self._store.data["calendars"]
+            events = calendars.setdefault(calendar_entity, {})
+            if key in events:
+                return False
+            events[key] = start_ts
+            self._prune(calendars)
+        self._store.schedule_save()
+        return True
+
+    def release(self, calendar_entity, key):
+        """Släpp en reservation när skapandet misslyckades."""
+        with self._store.lock:
+            self._store.data["calendars"].get(calendar_entity, {}).pop(key, None)
+        self._store.schedule_save()
+
+    @staticmethod
+    def _prune(calendars):
+        cutoff = time.time() - CALENDAR_INDEX_KEEP_DAYS * 86400
+        for calendar_entity in list(calendars):
+            events = calendars[calendar_entity]
+            for key in [k for k, start_ts in events.items() if start_ts < cutoff]:
+                del events[key]
+            if not events:
+                del calendars[calendar_entity]
@@ -19,6 +19,7 @@ from homeassistant.helpers.selector import (
     SelectSelectorMode,
 )
 
+from .imap_utils import parse_folder_list, quote_mailbox
 from .const import (
     DOMAIN,
     LOGGER,
@@ -31,39 +32,89 @@ from .const import (
     CONF_SMTP_PORT,
     CONF_SMTP_SENDER_NAME,
     CONF_SCAN_INTERVAL,
+    CONF_SCAN_MODE,
+    CONF_ADAPTIVE_INTERVAL,
+    CONF_MIN_INTERVAL,
+    CONF_MAX_INTERVAL,
+    CONF_TIME_PROFILE,
+    CONF_UPDATE_WINDOW,
+    CONF_FETCH_BATCH_SIZE,
+    CONF_FETCH_MAX_MB,
+    CONF_MAX_PART_MB,
     CONF_ENABLE_DEBUG,
     CONF_GEMINI_API_KEY,
     CONF_GEMINI_MODEL,
+    CONF_AI_WORKERS,
+    CONF_GEMINI_RPM,
+    CONF_GEMINI_TPM,
+    CONF_BODY_TOKEN_BUDGET,
+    CONF_PDF_TEXT_EXTRACTION,
+    CONF_PDF_MAX_PAGES,
     CONF_CALENDAR_1,
     CONF_CALENDAR_2,
     CONF_EMAIL_RECIPIENT_1,
     CONF_EMAIL_RECIPIENT_2,
     CONF_NOTIFY_SERVICE_1,
     CONF_NOTIFY_SERVICE_2,
+    CONF_DIGEST_WINDOW,
+    CONF_DIGEST_MAX_EVENTS,
     CONF_INTERPRETATION_TYPE,
+    CONF_PREFILTER_THRESHOLD,
+    CONF_PREFILTER_ALLOW,
+    CONF_PREFILTER_DENY,
     TYPE_KALLELSE,
+    SCAN_MODE_POLL,
+    SCAN_MODE_IDLE,
     DEFAULT_IMAP_PORT,
     DEFAULT_SMTP_PORT,
     DEFAULT_FOLDER,
     DEFAULT_SCAN_INTERVAL,
+    DEFAULT_SCAN_MODE,
     DEFAULT_ENABLE_DEBUG,
     DEFAULT_GEMINI_MODEL,
     DEFAULT_INTERPRETATION_TYPE,
     DEFAULT_SMTP_SENDER_NAME,
+    DEFAULT_FETCH_BATCH_SIZE,
+    DEFAULT_FETCH_MAX_MB,
+    DEFAULT_MAX_PART_MB,
+    DEFAULT_AI_WORKERS,
+    DEFAULT_GEMINI_RPM,
+    DEFAULT_GEMINI_TPM,
+    DEFAULT_PREFILTER_THRESHOLD,
+    DEFAULT_PREFILTER_ALLOW,
+    DEFAULT_PREFILTER_DENY,
+    DEFAULT_BODY_TOKEN_BUDGET,
+    DEFAULT_PDF_TEXT_EXTRACTION,
+    DEFAULT_PDF_MAX_PAGES,
+    DEFAULT_DIGEST_WINDOW,
+    DEFAULT_DIGEST_MAX_EVENTS,
+    DEFAULT_ADAPTIVE_INTERVAL,
+    DEFAULT_MIN_INTERVAL,
+    DEFAULT_MAX_INTERVAL,
+    DEFAULT_TIME_PROFILE,
+    DEFAULT_UPDATE_WINDOW,
 )
 
+class InvalidFolder(Exception):
+    """Någon av de angivna mapparna finns inte på servern."""
+
+
 async def validate_input(hass: HomeAssistant, data: dict) -> dict:
     """Validera IMAP-anslutning."""
     def _test_imap_login():
         try:
             connection = imaplib.IMAP4_SSL(data[CONF_IMAP_SERVER], data[CONF_IMAP_PORT])
             connection.login(data[CONF_USERNAME], data[CONF_PASSWORD])
-            # Verifiera att mappen faktiskt finns
-            typ, _ = connection.select(data[CONF_FOLDER])
-            if typ != 'OK':
-                raise ValueError(f"Mappen {data[CONF_FOLDER]} finns inte.")
+            # Verifiera att mapparna faktiskt finns (STATUS kräver ingen SELECT)
+            for folder in parse_folder_list(data[CONF_FOLDER]):
+                typ, _ = connection.status(quote_mailbox(folder), "(UIDNEXT)")
+                if typ != 'OK':
+                    LOGGER.error("Mappen %s finns inte.", folder)
+                    raise InvalidFolder(folder)
             connection.logout()
             return True
+        except InvalidFolder:
+            raise
         except imaplib.IMAP4.error:
             raise ValueError("invalid_auth")
         except Exception as e:
@@ -117,16 +168,36 @@ class MailAgentConfigFlow(ConfigFlow, domain=DOMAIN):
                     CONF_SMTP_PORT: user_input.get(CONF_SMTP_PORT),
                     CONF_SMTP_SENDER_NAME: user_input.get(CONF_SMTP_SENDER_NAME),
                     CONF_INTERPRETATION_TYPE: user_input.get(CONF_INTERPRETATION_TYPE),
+                    CONF_PREFILTER_THRESHOLD: user_input.get(CONF_PREFILTER_THRESHOLD),
+                    CONF_PREFILTER_ALLOW: user_input.get(CONF_PREFILTER_ALLOW),
+                    CONF_PREFILTER_DENY: user_input.get(CONF_PREFILTER_DENY),
                     CONF_SCAN_INTERVAL: user_input.get(CONF_SCAN_INTERVAL),
+                    CONF_SCAN_MODE: user_input.get(CONF_SCAN_MODE),
+                    CONF_ADAPTIVE_INTERVAL: user_input.get(CONF_ADAPTIVE_INTERVAL),
+                    CONF_MIN_INTERVAL: user_input.get(CONF_MIN_INTERVAL),
+                    CONF_MAX_INTERVAL: user_input.get(CONF_MAX_INTERVAL),
+                    CONF_TIME_PROFILE: user_input.get(CONF_TIME_PROFILE),
+                    CONF_UPDATE_WINDOW: user_input.get(CONF_UPDATE_WINDOW),
+                    CONF_FETCH_BATCH_SIZE: user_input.get(CONF_FETCH_BATCH_SIZE),
+                    CONF_FETCH_MAX_MB: user_input.get(CONF_FETCH_MAX_MB),
+                    CONF_MAX_PART_MB: user_input.get(CONF_MAX_PART_MB),
                     CONF_ENABLE_DEBUG: user_input.get(CONF_ENABLE_DEBUG),
                     CONF_GEMINI_API_KEY: user_input.get(CONF_GEMINI_API_KEY),
                     CONF_GEMINI_MODEL: user_input.get(CONF_GEMINI_MODEL),
+                    CONF_AI_WORKERS: user_input.get(CONF_AI_WORKERS),
+                    CONF_GEMINI_RPM: user_input.get(CONF_GEMINI_RPM),
+                    CONF_GEMINI_TPM: user_input.get(CONF_GEMINI_TPM),
+                    CONF_BODY_TOKEN_BUDGET: user_input.get(CONF_BODY_TOKEN_BUDGET),
+                    CONF_PDF_TEXT_EXTRACTION: user_input.get(CONF_PDF_TEXT_EXTRACTION),
+                    CONF_PDF_MAX_PAGES: user_input.get(CONF_PDF_MAX_PAGES),
                     CONF_CALENDAR_1: user_input.get(CONF_CALENDAR_1),
                     CONF_CALENDAR_2: user_input.get(CONF_CALENDAR_2),
                     CONF_EMAIL_RECIPIENT_1: user_input.get(CONF_EMAIL_RECIPIENT_1),
                     CONF_EMAIL_RECIPIENT_2: user_input.get(CONF_EMAIL_RECIPIENT_2),
                     CONF_NOTIFY_SERVICE_1: user_input.get(CONF_NOTIFY_SERVICE_1),
                     CONF_NOTIFY_SERVICE_2: user_input.get(CONF_NOTIFY_SERVICE_2),
+                    CONF_DIGEST_WINDOW: user_input.get(CONF_DIGEST_WINDOW),
+                    CONF_DIGEST_MAX_EVENTS: user_input.get(CONF_DIGEST_MAX_EVENTS),
                 }
 
                 return self.async_create_entry(
@@ -135,6 +206,8 @@ class MailAgentConfigFlow(ConfigFlow, domain=DOMAIN):
                     options=options_config
                 )
 
+            except InvalidFolder:
+                errors["base"] = "invalid_folder"
             except ValueError:
                 errors["base"] = "invalid_auth"
             except ConnectionError:
@@ -166,6 +239,17 @@ class MailAgentConfigFlow(ConfigFlow, domain=DOMAIN):
             )
         )
 
+        scan_mode_selector = SelectSelector(
+            SelectSelectorConfig(
+                options=[
+                    {"label": "Polling (fast intervall)", "value": SCAN_MODE_POLL},
+                    {"label": "Push (IMAP IDLE)", "value": SCAN_MODE_IDLE},
+                ],
+                mode=SelectSelectorMode.DROPDOWN,
+                translation_key="scan_mode"
+            )
+        )
+
         # Formulärschema
         schema = vol.Schema({
             # IMAP
@@ -182,11 +266,29 @@ class MailAgentConfigFlow(ConfigFlow, domain=DOMAIN):
 
             # Logic Type
             vol.Optional(CONF_INTERPRETATION_TYPE, default=DEFAULT_INTERPRETATION_TYPE): type_selector,
+            vol.Optional(CONF_PREFILTER_THRESHOLD, default=DEFAULT_PREFILTER_THRESHOLD): vol.All(vol.Coerce(int), vol.Range(min=0, max=20)),
+            vol.Optional(CONF_PREFILTER_ALLOW, default=DEFAULT_PREFILTER_ALLOW): str,
+            vol.Optional(CONF_PREFILTER_DENY, default=DEFAULT_PREFILTER_DENY): str,
 
             # AI
             vol.Required(CONF_GEMINI_API_KEY): str,
             vol.Optional(CONF_GEMINI_MODEL, default=DEFAULT_GEMINI_MODEL): str,
+            vol.Optional(CONF_AI_WORKERS, default=DEFAULT_AI_WORKERS): cv.positive_int,
+            vol.Optional(CONF_GEMINI_RPM, default=DEFAULT_GEMINI_RPM): vol.All(vol.Coerce(int), vol.Range(min=1, max=10000)),
+            vol.Optional(CONF_GEMINI_TPM, default=DEFAULT_GEMINI_TPM): vol.All(vol.Coerce(int), vol.Range(min=1000, max=100000000)),
+            vol.Optional(CONF_BODY_TOKEN_BUDGET, default=DEFAULT_BODY_TOKEN_BUDGET): vol.All(vol.Coerce(int), vol.Range(min=0)),
+            vol.Optional(CONF_PDF_TEXT_EXTRACTION, default=DEFAULT_PDF_TEXT_EXTRACTION): bool,
+            vol.Optional(CONF_PDF_MAX_PAGES, default=DEFAULT_PDF_MAX_PAGES): cv.positive_int,
             vol.Optional(CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL): cv.positive_int,
+            vol.Optional(CONF_SCAN_MODE, default=DEFAULT_SCAN_MODE): scan_mode_selector,
+            vol.Optional(CONF_ADAPTIVE_INTERVAL, default=DEFAULT_ADAPTIVE_INTERVAL): bool,
+            vol.Optional(CONF_MIN_INTERVAL, default=DEFAULT_MIN_INTERVAL): cv.positive_int,
+            vol.Optional(CONF_MAX_INTERVAL, default=DEFAULT_MAX_INTERVAL): cv.positive_int,
+            vol.Optional(CONF_TIME_PROFILE, default=DEFAULT_TIME_PROFILE): bool,
+            vol.Optional(CONF_UPDATE_WINDOW, default=DEFAULT_UPDATE_WINDOW): cv.positive_int,
+            vol.Optional(CONF_FETCH_BATCH_SIZE, default=DEFAULT_FETCH_BATCH_SIZE): cv.positive_int,
+            vol.Optional(CONF_FETCH_MAX_MB, default=DEFAULT_FETCH_MAX_MB): cv.positive_int,
+            vol.Optional(CONF_MAX_PART_MB, default=DEFAULT_MAX_PART_MB): cv.positive_int,
             vol.Optional(CONF_ENABLE_DEBUG, default=DEFAULT_ENABLE_DEBUG): bool,
 
             # Integrations
@@ -194,6 +296,8 @@ class MailAgentConfigFlow(ConfigFlow, domain=DOMAIN):
             vol.Optional(CONF_CALENDAR_2): calendar_selector,
             vol.Optional(CONF_NOTIFY_SERVICE_1): notify_selector,
             vol.Optional(CONF_NOTIFY_SERVICE_2): notify_selector,
+            vol.Optional(CONF_DIGEST_WINDOW, default=DEFAULT_DIGEST_WINDOW): vol.All(vol.Coerce(int), vol.Range(min=0, max=1440)),
+            vol.Optional(CONF_DIGEST_MAX_EVENTS, default=DEFAULT_DIGEST_MAX_EVENTS): cv.positive_int,
             vol.Optional(CONF_EMAIL_RECIPIENT_1): str,
             vol.Optional(CONF_EMAIL_RECIPIENT_2): str,
         })
@@ -217,16 +321,36 @@ class MailAgentOptionsFlowHandler(OptionsFlow):
                 CONF_SMTP_PORT: user_input.get(CONF_SMTP_PORT),
                 CONF_SMTP_SENDER_NAME: user_input.get(CONF_SMTP_SENDER_NAME),
                 CONF_INTERPRETATION_TYPE: user_input.get(CONF_INTERPRETATION_TYPE),
+                CONF_PREFILTER_THRESHOLD: user_input.get(CONF_PREFILTER_THRESHOLD),
+                CONF_PREFILTER_ALLOW: user_input.get(CONF_PREFILTER_ALLOW),
+                CONF_PREFILTER_DENY: user_input.get(CONF_PREFILTER_DENY),
                 CONF_SCAN_INTERVAL: user_input.get(CONF_SCAN_INTERVAL),
+                CONF_SCAN_MODE: user_input.get(CONF_SCAN_MODE),
+                CONF_ADAPTIVE_INTERVAL: user_input.get(CONF_ADAPTIVE_INTERVAL),
+                CONF_MIN_INTERVAL: user_input.get(CONF_MIN_INTERVAL),
+                CONF_MAX_INTERVAL: user_input.get(CONF_MAX_INTERVAL),
+                CONF_TIME_PROFILE: user_input.get(CONF_TIME_PROFILE),
+                CONF_UPDATE_WINDOW: user_input.get(CONF_UPDATE_WINDOW),
+                CONF_FETCH_BATCH_SIZE: user_input.get(CONF_FETCH_BATCH_SIZE),
+                CONF_FETCH_MAX_MB: user_input.get(CONF_FETCH_MAX_MB),
+                CONF_MAX_PART_MB: user_input.get(CONF_MAX_PART_MB),
                 CONF_ENABLE_DEBUG: user_input.get(CONF_ENABLE_DEBUG),
                 CONF_GEMINI_API_KEY: user_input.get(CONF_GEMINI_API_KEY),
                 CONF_GEMINI_MODEL: user_input.get(CONF_GEMINI_MODEL),
+                CONF_AI_WORKERS: user_input.get(CONF_AI_WORKERS),
+                CONF_GEMINI_RPM: user_input.get(CONF_GEMINI_RPM),
+                CONF_GEMINI_TPM: user_input.get(CONF_GEMINI_TPM),
+                CONF_BODY_TOKEN_BUDGET: user_input.get(CONF_BODY_TOKEN_BUDGET),
+                CONF_PDF_TEXT_EXTRACTION: user_input.get(CONF_PDF_TEXT_EXTRACTION),
+                CONF_PDF_MAX_PAGES: user_input.get(CONF_PDF_MAX_PAGES),
                 CONF_CALENDAR_1: user_input.get(CONF_CALENDAR_1),
                 CONF_CALENDAR_2: user_input.get(CONF_CALENDAR_2),
                 CONF_EMAIL_RECIPIENT_1: user_input.get(CONF_EMAIL_RECIPIENT_1),
                 CONF_EMAIL_RECIPIENT_2: user_input.get(CONF_EMAIL_RECIPIENT_2),
                 CONF_NOTIFY_SERVICE_1: user_input.get(CONF_NOTIFY_SERVICE_1),
                 CONF_NOTIFY_SERVICE_2: user_input.get(CONF_NOTIFY_SERVICE_2),
+                CONF_DIGEST_WINDOW: user_input.get(CONF_DIGEST_WINDOW),
+                CONF_DIGEST_MAX_EVENTS: user_input.get(CONF_DIGEST_MAX_EVENTS),
             }
 
             self.hass.config_entries.async_update_entry(self.config_entry, data=connection_data)
@@ -265,6 +389,17 @@ class MailAgentOptionsFlowHandler(OptionsFlow):
             )
         )
 
+        scan_mode_selector = SelectSelector(
+            SelectSelectorConfig(
+                options=[
+                    {"label": "Polling (fast intervall)", "value": SCAN_MODE_POLL},
+                    {"label": "Push (IMAP IDLE)", "value": SCAN_MODE_IDLE},
+                ],
+                mode=SelectSelectorMode.DROPDOWN,
+                translation_key="scan_mode"
+            )
+        )
+
         options_schema = vol.Schema({
             vol.Required(CONF_IMAP_SERVER, default=config.get(CONF_IMAP_SERVER)): str,
             vol.Required(CONF_USERNAME, default=config.get(CONF_USERNAME)): str,
@@ -277,10 +412,28 @@ class MailAgentOptionsFlowHandler(OptionsFlow):
             vol.Optional(CONF_SMTP_SENDER_NAME, default=options.get(CONF_SMTP_SENDER_NAME, DEFAULT_SMTP_SENDER_NAME)): str,
 
             vol.Optional(CONF_INTERPRETATION_TYPE, default=options.get(CONF_INTERPRETATION_TYPE, DEFAULT_INTERPRETATION_TYPE)): type_selector,
+            vol.Optional(CONF_PREFILTER_THRESHOLD, default=options.get(CONF_PREFILTER_THRESHOLD, DEFAULT_PREFILTER_THRESHOLD)): vol.All(vol.Coerce(int), vol.Range(min=0, max=20)),
+            vol.Optional(CONF_PREFILTER_ALLOW, default=options.get(CONF_PREFILTER_ALLOW, DEFAULT_PREFILTER_ALLOW)): str,
+            vol.Optional(CONF_PREFILTER_DENY, default=options.get(CONF_PREFILTER_DENY, DEFAULT_PREFILTER_DENY)): str,
             vol.Optional(CONF_SCAN_INTERVAL, default=options.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL)): cv.positive_int,
+            vol.Optional(CONF_SCAN_MODE, default=options.get(CONF_SCAN_MODE, DEFAULT_SCAN_MODE)): scan_mode_selector,
+            vol.Optional(CONF_ADAPTIVE_INTERVAL, default=options.get(CONF_ADAPTIVE_INTERVAL, DEFAULT_ADAPTIVE_INTERVAL)): bool,
+            vol.Optional(CONF_MIN_INTERVAL, default=options.get(CONF_MIN_INTERVAL, DEFAULT_MIN_INTERVAL)): cv.positive_int,
+            vol.Optional(CONF_MAX_INTERVAL, default=options.get(CONF_MAX_INTERVAL, DEFAULT_MAX_INTERVAL)): cv.positive_int,
+            vol.Optional(CONF_TIME_PROFILE, default=options.get(CONF_TIME_PROFILE, DEFAULT_TIME_PROFILE)): bool,
+            vol.Optional(CONF_UPDATE_WINDOW, default=options.get(CONF_UPDATE_WINDOW, DEFAULT_UPDATE_WINDOW)): cv.positive_int,
+            vol.Optional(CONF_FETCH_BATCH_SIZE, default=options.get(CONF_FETCH_BATCH_SIZE, DEFAULT_FETCH_BATCH_SIZE)): cv.positive_int,
+            vol.Optional(CONF_FETCH_MAX_MB, default=options.get(CONF_FETCH_MAX_MB, DEFAULT_FETCH_MAX_MB)): cv.positive_int,
+            vol.Optional(CONF_MAX_PART_MB, default=options.get(CONF_MAX_PART_MB, DEFAULT_MAX_PART_MB)): cv.positive_int,
             vol.Optional(CONF_ENABLE_DEBUG, default=options.get(CONF_ENABLE_DEBUG, DEFAULT_ENABLE_DEBUG)): bool,
             vol.Optional(CONF_GEMINI_API_KEY, default=options.get(CONF_GEMINI_API_KEY, "")): str,
             vol.Optional(CONF_GEMINI_MODEL, default=options.get(CONF_GEMINI_MODEL, DEFAULT_GEMINI_MODEL)): str,
+            vol.Optional(CONF_AI_WORKERS, default=options.get(CONF_AI_WORKERS, DEFAULT_AI_WORKERS)): cv.positive_int,
+            vol.Optional(CONF_GEMINI_RPM, default=options.get(CONF_GEMINI_RPM, DEFAULT_GEMINI_RPM)): vol.All(vol.Coerce(int), vol.Range(min=1, max=10000)),
+            vol.Optional(CONF_GEMINI_TPM, default=options.get(CONF_GEMINI_TPM, DEFAULT_GEMINI_TPM)): vol.All(vol.Coerce(int), vol.Range(min=1000, max=100000000)),
+            vol.Optional(CONF_BODY_TOKEN_BUDGET, default=options.get(CONF_BODY_TOKEN_BUDGET, DEFAULT_BODY_TOKEN_BUDGET)): vol.All(vol.Coerce(int), vol.Range(min=0)),
+            vol.Optional(CONF_PDF_TEXT_EXTRACTION, default=options.get(CONF_PDF_TEXT_EXTRACTION, DEFAULT_PDF_TEXT_EXTRACTION)): bool,
+            vol.Optional(CONF_PDF_MAX_PAGES, default=options.get(CONF_PDF_MAX_PAGES, DEFAULT_PDF_MAX_PAGES)): cv.positive_int,
 
             vol.Optional(CONF_CALENDAR_1, description={"suggested_value": options.get(CONF_CALENDAR_1)}): calendar_selector,
             vol.Optional(CONF_CALENDAR_2, description={"suggested_value": options.get(CONF_CALENDAR_2)}): calendar_selector,
@@ -290,6 +443,8 @@ class MailAgentOptionsFlowHandler(OptionsFlow):
 
             vol.Optional(CONF_NOTIFY_SERVICE_1, description={"suggested_value": options.get(CONF_NOTIFY_SERVICE_1)}): notify_selector,
             vol.Optional(CONF_NOTIFY_SERVICE_2, description={"suggested_value": options.get(CONF_NOTIFY_SERVICE_2)}): notify_selector,
+            vol.Optional(CONF_DIGEST_WINDOW, default=options.get(CONF_DIGEST_WINDOW, DEFAULT_DIGEST_WINDOW)): vol.All(vol.Coerce(int), vol.Range(min=0, max=1440)),
+            vol.Optional(CONF_DIGEST_MAX_EVENTS, default=options.get(CONF_DIGEST_MAX_EVENTS, DEFAULT_DIGEST_MAX_EVENTS)): cv.positive_int,
         })
 
         return self.async_show_form(step_id="init", data_schema=options_schema)
\ No newline at end of file
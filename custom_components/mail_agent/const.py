@@ -7,6 +7,14 @@ DOMAIN = "mail_agent"
 # Signals
 SIGNAL_MAIL_AGENT_UPDATE = "mail_agent_update"
 
+# Gemensamma objekt i hass.data[DOMAIN] (övriga nycklar är entry_id)
+DATA_ATTACHMENT_STORE = "attachment_store"
+DATA_AI_CACHE = "ai_cache"
+DATA_RATE_LIMITERS = "rate_limiters"
+DATA_CALENDAR_INDEX = "calendar_index"
+DATA_SCHEDULER = "scheduler"
+DATA_MESSAGE_INDEX = "message_index"
+
 # Connection
 CONF_IMAP_SERVER = "imap_server"
 CONF_IMAP_PORT = "imap_port"
@@ -25,6 +33,28 @@ TYPE_KALLELSE = "kallelse"
 
 # Options / Gemini
 CONF_SCAN_INTERVAL = "scan_interval"
+CONF_SCAN_MODE = "scan_mode"
+CONF_ADAPTIVE_INTERVAL = "adaptive_interval"
+CONF_MIN_INTERVAL = "min_interval"
+CONF_MAX_INTERVAL = "max_interval"
+CONF_TIME_PROFILE = "time_profile"
+CONF_UPDATE_WINDOW = "update_window"
+CONF_FETCH_BATCH_SIZE = "fetch_batch_size"
+CONF_FETCH_MAX_MB = "fetch_max_mb"
+CONF_MAX_PART_MB = "max_part_mb"
+CONF_AI_WORKERS = "ai_workers"
+CONF_GEMINI_RPM = "gemini_rpm"
+CONF_GEMINI_TPM = "gemini_tpm"
+CONF_BODY_TOKEN_BUDGET = "body_token_budget"
+CONF_PDF_TEXT_EXTRACTION = "pdf_text_extraction"
+CONF_PDF_MAX_PAGES = "pdf_max_pages"
+CONF_DIGEST_WINDOW = "digest_window"
+CONF_DIGEST_MAX_EVENTS = "digest_max_events"
+CONF_PREFILTER_ALLOW = "prefilter_allow_senders"
+CONF_PREFILTER_DENY = "prefilter_deny_senders"
+CONF_PREFILTER_THRESHOLD = "prefilter_threshold"
+SCAN_MODE_POLL = "poll"
+SCAN_MODE_IDLE = "idle"
 CONF_ENABLE_DEBUG = "enable_debug"
 CONF_GEMINI_API_KEY = "gemini_api_key"
 CONF_GEMINI_MODEL = "gemini_model"
@@ -44,9 +74,121 @@ DEFAULT_IMAP_PORT = 993
 DEFAULT_SMTP_PORT = 587
 DEFAULT_FOLDER = "INBOX"
 DEFAULT_SCAN_INTERVAL = 60
+DEFAULT_ADAPTIVE_INTERVAL = False
+DEFAULT_MIN_INTERVAL = 30
+DEFAULT_MAX_INTERVAL = 1800
+DEFAULT_TIME_PROFILE = False
+DEFAULT_UPDATE_WINDOW = 2  # sekunder mellan sensoruppdateringar (0 = varje ändring)
+DEFAULT_SCAN_MODE = SCAN_MODE_POLL
+DEFAULT_FETCH_BATCH_SIZE = 50
+DEFAULT_FETCH_MAX_MB = 20
+DEFAULT_MAX_PART_MB = 25
+DEFAULT_AI_WORKERS = 2
+DEFAULT_GEMINI_RPM = 10
+DEFAULT_GEMINI_TPM = 250000
+DEFAULT_BODY_TOKEN_BUDGET = 1500  # 0 = ingen gräns
+DEFAULT_PDF_TEXT_EXTRACTION = True
+DEFAULT_PDF_MAX_PAGES = 10
+DEFAULT_DIGEST_WINDOW = 0  # minuter, 0 = skicka direkt
+DEFAULT_DIGEST_MAX_EVENTS = 20
+DEFAULT_PREFILTER_ALLOW = ""
+DEFAULT_PREFILTER_DENY = ""
+DEFAULT_PREFILTER_THRESHOLD = 2  # 0 = analysera alla mail
 DEFAULT_ENABLE_DEBUG = False
 DEFAULT_GEMINI_MODEL = "gemini-3-pro-preview"
 DEFAULT_INTERPRETATION_TYPE = TYPE_KALLELSE
 DEFAULT_SMTP_SENDER_NAME = "Mail Agent"
 
+# Bilagor
+ATTACHMENT_CHUNK_BYTES = 1024 * 1024  # bytes per delhämtning när en PDF strömmas till disk
+ATTACHMENT_STORE_MAX_MB = 500  # total storlek innan de minst nyligen använda gallras
+ATTACHMENT_STORE_MAX_AGE_DAYS = 30  # oanvända bilagor äldre än så tas bort
+
+# AI-cache
+AI_CACHE_TTL_HOURS = 24 * 7
+AI_CACHE_MAX_ENTRIES = 500
+
+# Dubblettindex över mail (Message-ID och innehåll), delas av alla konton
+MESSAGE_INDEX_TTL_DAYS = 14
+MESSAGE_INDEX_MAX_ENTRIES = 5000
+MESSAGE_FP_MIN_CHARS = 200  # kortare text utan bilagor är för generisk för ett innehållsavtryck
+
+# AI-kö
+AI_QUEUE_PER_WORKER = 2  # max antal mail i luften per AI-arbetare
+
+# Fält per event i AI-svaret
+EVENT_FIELDS = ("summary", "description", "start_time", "location", "type")
+
+# Kalender: index över skapade events och väntetid på tjänsteanrop
+CALENDAR_INDEX_KEEP_DAYS = 30  # efter starttiden
+CALENDAR_CALL_TIMEOUT = 60  # sekunder för en hel batch
+
+# Förfilter: hur mycket av texten som poängsätts
+PREFILTER_SCAN_CHARS = 5000
+
+# Gemini-anrop: omförsök och uppskattning av tokens
+GEMINI_MAX_ATTEMPTS = 4  # försök per mail och sökning innan det läggs i omförsökskön
+GEMINI_BACKOFF_BASE = 2  # sekunder
+GEMINI_BACKOFF_MAX = 60  # sekunder
+CHARS_PER_TOKEN = 4
+GEMINI_TOKENS_PER_PDF = 2000  # grov uppskattning innan det faktiska utfallet är känt
+GEMINI_PROMPT_OVERHEAD_TOKENS = 300
+
+# Omförsökskö för mail vars analys misslyckades tillfälligt
+RETRY_BASE_DELAY = 60  # sekunder, fördubblas per försök
+RETRY_MAX_DELAY = 6 * 3600
+RETRY_MAX_ATTEMPTS = 6
+
+# Bearbetningsjournal (append-only i .storage)
+JOURNAL_FETCHED = "fetched"
+JOURNAL_ANALYSED = "analysed"
+JOURNAL_CALENDAR = "calendar"
+JOURNAL_NOTIFIED = "notified"
+JOURNAL_DONE = "done"
+JOURNAL_RETRY = "retry"  # omförsökskön har tagit över mailet
+JOURNAL_KEEP_DONE = 2000  # klara mail som minns för att undvika dubbelbearbetning
+JOURNAL_COMPACT_LINES = 5000
+
+# Lokal PDF-text: under så här många tecken per sida räknas PDF:en som inskannad
+PDF_MIN_CHARS_PER_PAGE = 50
+PDF_TEXT_MAX_CHARS = 40000
+
+# Gemini Files API
+GEMINI_FILE_TTL_HOURS = 48  # om servern inte anger expiration_time
+GEMINI_FILE_EXPIRY_MARGIN = 600  # sekunder; återanvänd inte filer precis innan de löper ut
+
+# Sammanfattade notiser: skicka direkt när bilagorna når så här mycket
+DIGEST_MAX_BYTES = 15 * 1024 * 1024
+
+# SMTP-utkorg
+SMTP_TIMEOUT = 30
+SMTP_IDLE_TIMEOUT = 60  # sekunder innan en ledig anslutning stängs
+SMTP_BACKOFF_BASE = 30
+SMTP_BACKOFF_MAX = 3600
+SMTP_MAX_ATTEMPTS = 8
+
+# Strömmad MIME: 57 byte blir exakt en base64-rad på 76 tecken
+MIME_ENCODE_CHUNK = 57 * 1024
+MIME_STREAM_CHUNK = 64 * 1024
+
+# Lagring (.storage)
+STORAGE_VERSION = 1
+STORAGE_SAVE_DELAY = 5  # sekunder, slår ihop täta sparningar
+STORAGE_SAVE_TIMEOUT = 30  # sekunder att vänta på en direkt sparning
+
+# Adaptivt sökintervall
+ADAPTIVE_BACKOFF_FACTOR = 2
+ADAPTIVE_PROFILE_DECAY = 0.9  # per dygn
+
+# Gemensam schemaläggare för sökningar
+SCHEDULER_WORKERS = 3  # samtidiga sökningar över alla konton
+SCHEDULER_TICK = 1  # sekunder mellan kontroller av vilka konton som ska sökas
+
+# IMAP-session
+IMAP_TIMEOUT = 30  # sekunder per socket-operation
+IMAP_BACKOFF_BASE = 5  # sekunder efter första misslyckade anslutningen
+IMAP_BACKOFF_MAX = 900  # tak för exponentiell backoff
+IMAP_IDLE_REARM = 29 * 60  # RFC 2177: förnya IDLE minst var 29:e minut
+IMAP_IDLE_RETRY = 5  # sekunder mellan IDLE-försök efter fel
+
 LOGGER = logging.getLogger(__package__)
\ No newline at end of file
@@ -0,0 +1,304 @@
+# Fil: custom_components/mail_agent/imap_session.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Långlivad IMAP-session med hälsokontroll och återanslutning."""
+
+import imaplib
+import re
+import select
+import socket
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+
+from .imap_utils import quote_mailbox
+from .const import (
+    LOGGER,
+    IMAP_TIMEOUT,
+    IMAP_BACKOFF_BASE,
+    IMAP_BACKOFF_MAX,
+)
+
+
+class ImapBackoffError(ConnectionError):
+    """Kastas när en återanslutning inte är tillåten ännu (backoff)."""
+
+
+class ImapIdleUnsupportedError(Exception):
+    """Kastas när servern saknar IDLE (RFC 2177)."""
+
+
+class ImapSession:
+    """En IMAP-anslutning per config entry som återanvänds mellan sökningar.
+
+    Anslutningen hälsokontrolleras med NOOP innan den används. Vid fel kastas
+    den och en ny anslutning görs vid nästa användning, med exponentiell
+    backoff mellan misslyckade försök.
+    """
+
+    def __init__(self, server, port, user, password, enable_debug=False):
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.enable_debug = enable_debug
+
+        self._conn = None
+        self._selected_folder = None
+        self._uidvalidity = None
+        self._uidnext = None
+        self._capabilities = ()
+        self._failures = 0
+        self._next_attempt = 0.0
+        self._lock = threading.RLock()
+
+        # Väckningspar för att avbryta en pågående IDLE från en annan tråd
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+
+    @property
+    def is_connected(self):
+        return self._conn is not None
+
+    @property
+    def uidvalidity(self):
+        """UIDVALIDITY för den valda mappen (None om okänd)."""
+        return self._uidvalidity
+
+    @property
+    def uidnext(self):
+        """UIDNEXT när mappen valdes (None om servern inte skickade den)."""
+        return self._uidnext
+
+    @contextmanager
+    def connection(self, folder=None):
+        """Ge en frisk anslutning, med `folder` vald om den anges.
+
+        Låset hålls under hela blocket så att sökning och stängning aldrig
+        använder anslutningen samtidigt. Fel i blocket gör sessionen ogiltig.
+        """
+        with self._lock:
+            conn = self._ensure_connected()
+            try:
+                if folder is not None:
+                    self._ensure_selected(conn, folder)
+                yield conn
+            except Exception:
+                self._invalidate()
+                raise
+
+    def idle(self, folder, timeout, stop_event):
+        """Vänta i IDLE tills mappen ändras, `timeout` löper ut eller stopp begärs.
+
+        Returnerar True om servern rapporterade nya meddelanden.
+        """
+        with self.connection(folder) as conn:
+            if "IDLE" not in self._capabilities:
+                raise ImapIdleUnsupportedError(self.server)
+
+            # Svar som kom in med NOOP innan IDLE behöver inte vänta på servern
+            if conn.untagged_responses.pop("EXISTS", None) or conn.untagged_responses.pop("RECENT", None):
+                return True
+
+            self._drain_wakeup()
+            tag = conn._new_tag()
+            conn.send(tag + b" IDLE\r\n")
+            line = conn.readline()
+            if not line.startswith(b"+"):
+                raise imaplib.IMAP4.error(f"IDLE nekades: {line!r}")
+
+            changed = False
+            deadline = time.monotonic() + timeout
+            try:
+                while not stop_event.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    # select ser bara socketen; rader som redan ligger i imaplibs
+                    # buffert (t.ex. EXISTS i samma segment som "+ idling") läses direkt
+                    if not _has_buffered_data(conn):
+                        readable, _, _ = select.select([conn.sock, self._wakeup_r], [], [], remaining)
+                        if not readable or conn.sock not in readable:
+                            continue
+                    line = conn.readline()
+                    if not line:
+                        raise imaplib.IMAP4.abort("Anslutningen stängdes under IDLE")
+                    if self.enable_debug:
+                        LOGGER.debug("IDLE-svar: %s", line.strip())
+                    if line.startswith(b"* ") and (b"EXISTS" in line or b"RECENT" in line):
+                        changed = True
+                        break
+            finally:
+                conn.send(b"DONE\r\n")
+                while True:
+                    line = conn.readline()
+                    if not line:
+                        raise imaplib.IMAP4.abort("Anslutningen stängdes efter IDLE")
+                    if line.startswith(tag):
+                        break
+                # Svaret lästes för hand, så imaplib städar inte bort taggen själv
+                conn.tagged_commands.pop(tag, None)
+            return changed
+
+    def select(self, folder):
+        """Byt vald mapp. Anropas inuti ett `connection()`-block."""
+        with self._lock:
+            self._ensure_selected(self._conn, folder)
+
+    def status(self, folder):
+        """UIDVALIDITY och UIDNEXT via STATUS, utan att välja mappen.
+
+        Anropas inuti ett `connection()`-block. Returnerar None om mappen saknas.
+        """
+        with self._lock:
+            typ, data = self._conn.status(quote_mailbox(folder), "(UIDVALIDITY UIDNEXT)")
+        if typ != "OK" or not data or not data[0]:
+            return None
+        return {
+            "uidvalidity": _status_value(data[0], b"UIDVALIDITY"),
+            "uidnext": _status_value(data[0], b"UIDNEXT"),
+        }
+
+    def interrupt_idle(self):
+        """Väck en pågående IDLE (trådsäkert)."""
+        try:
+            self._wakeup_w.send(b"x")
+        except OSError:
+            pass
+
+    def close(self):
+        """Stäng anslutningen snyggt (anropas vid unload)."""
+        self.interrupt_idle()
+        with self._lock:
+            conn = self._conn
+            self._conn = None
+            if conn is None:
+                return
+            try:
+                if self._selected_folder is not None:
+                    conn.close()
+                conn.logout()
+            except Exception:
+                pass
+            finally:
+                self._selected_folder = None
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(64):
+                pass
+        except OSError:
+            pass
+
+    def _ensure_connected(self):
+        if self._conn is not None:
+            try:
+                # Hälsokontroll/keepalive. Ger även servern chans att skicka EXISTS,
+                # så gamla ändringsnotiser rensas först.
+                self._conn.untagged_responses.pop("EXISTS", None)
+                self._conn.untagged_responses.pop("RECENT", None)
+                typ, _ = self._conn.noop()
+                if typ == "OK":
+                    return self._conn
+            except Exception as e:
+                if self.enable_debug:
+                    LOGGER.debug("NOOP misslyckades, återansluter: %s", e)
+            self._invalidate()
+
+        now = time.monotonic()
+        if now < self._next_attempt:
+            raise ImapBackoffError(
+                f"Väntar {self._next_attempt - now:.0f} s innan nytt anslutningsförsök"
+            )
+
+        conn = None
+        try:
+            conn = imaplib.IMAP4_SSL(self.server, self.port, timeout=IMAP_TIMEOUT)
+            conn.login(self.user, self.password)
+            # Många servrar annonserar fler förmågor (t.ex. IDLE) först efter inloggning
+            typ, data = conn.capability()
+            if typ == "OK" and data and data[0]:
+                conn.capabilities = tuple(data[0].decode().upper().split())
+        except Exception:
+            if conn is not None:
+                try:
+                    conn.shutdown()
+                except Exception:
+                    pass
+            self._register_failure()
+            raise
+
+        self._conn = conn
+        self._selected_folder = None
+        self._capabilities = conn.capabilities
+        self._failures = 0
+        self._next_attempt = 0.0
+        if self.enable_debug:
+            LOGGER.debug("Ny IMAP-session mot %s uppkopplad.", self.server)
+        return conn
+
+    def _ensure_selected(self, conn, folder):
+        # Mappen ligger kvar vald mellan sökningar; NOOP ovan räcker för att
+        # få nya meddelanden, så SELECT görs bara när mappen byts.
+        if self._selected_folder == folder:
+            return
+        typ, data = conn.select(quote_mailbox(folder))
+        if typ != "OK":
+            raise imaplib.IMAP4.error(f"Kunde inte välja mappen {folder}: {data}")
+        self._uidvalidity = _first_int(conn.untagged_responses.pop("UIDVALIDITY", None))
+        self._uidnext = _first_int(conn.untagged_responses.pop("UIDNEXT", None))
+        if self._uidvalidity is None:
+            typ, data = conn.status(quote_mailbox(folder), "(UIDVALIDITY UIDNEXT)")
+            if typ == "OK" and data and data[0]:
+                self._uidvalidity = _status_value(data[0], b"UIDVALIDITY")
+                self._uidnext = _status_value(data[0], b"UIDNEXT")
+        self._selected_folder = folder
+
+    def _invalidate(self):
+        conn = self._conn
+        self._conn = None
+        self._selected_folder = None
+        if conn is not None:
+            try:
+                conn.shutdown()
+            except Exception:
+                pass
+
+    def _register_failure(self):
+        self._failures += 1
+        delay = min(IMAP_BACKOFF_MAX, IMAP_BACKOFF_BASE * 2 ** (self._failures - 1))
+        self._next_attempt = time.monotonic() + delay
+
+
+def _has_buffered_data(conn):
+    """Finns data som redan lästs in i imaplibs BufferedReader eller i SSL-lagret?
+
+    `peek` returnerar bufferten utan att läsa om den inte är tom; annars görs
+    ett icke-blockerande läsförsök mot socketen.
+    """
+    sock = conn.sock
+    if isinstance(sock, ssl.SSLSocket) and sock.pending():
+        return True
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return bool(conn.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+def _first_int(values):
+    """Plocka första heltalet ur en lista med untagged-svar."""
+    if not values:
+        return None
+    try:
+        return int(values[0])
+    except (TypeError, ValueError):
+        return None
+
+
+def _status_value(line, name):
+    """Läs ut t.ex. UIDNEXT ur ett STATUS-svar."""
+    match = re.search(rb"%s (\d+)" % name, line)
+    return int(match.group(1)) if match else None
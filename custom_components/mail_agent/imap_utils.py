@@ -0,0 +1,284 @@
+# Fil: custom_components/mail_agent/imap_utils.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Hjälpfunktioner för att bygga IMAP-kommandon och tolka FETCH-svar."""
+
+import base64
+import re
+from email.utils import decode_rfc2231
+from urllib.parse import unquote_to_bytes
+
+_FETCH_START = re.compile(rb"^(\d+) \(")
+_UID = re.compile(rb"UID (\d+)")
+_SIZE = re.compile(rb"RFC822\.SIZE (\d+)")
+_LITERAL_SUFFIX = re.compile(rb" ?\{(\d+)\}$")
+_TOKEN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+_UNESCAPE = re.compile(rb"\\(.)")
+# Parameternamn enligt RFC 2231: name, name*, name*0, name*0*
+_PARAM_NAME = re.compile(r"^(.*?)(?:\*(\d+))?(\*)?$")
+
+
+def format_uid_set(uids):
+    """Gör om en lista UID till en kompakt message-set, t.ex. '1:5,7,9:10'."""
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+
+def parse_folder_list(value, default="INBOX"):
+    """Kommaseparerade mappar i prioritetsordning, utan dubbletter."""
+    folders = []
+    for name in (value or "").split(","):
+        name = name.strip()
+        if name and name not in folders:
+            folders.append(name)
+    return folders or [default]
+
+
+def quote_mailbox(name):
+    """Mappnamn som IMAP-argument: modifierad UTF-7 (RFC 3501) inom citattecken."""
+    encoded = []
+    run = []
+
+    def flush():
+        if run:
+            b64 = base64.b64encode("".join(run).encode("utf-16-be")).decode("ascii")
+            encoded.append("&" + b64.rstrip("=").replace("/", ",") + "-")
+            run.clear()
+
+    for char in name:
+        if 0x20 <= ord(char) <= 0x7E:
+            flush()
+            encoded.append("&-" if char == "&" else char)
+        else:
+            run.append(char)
+    flush()
+    text = "".join(encoded).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
+
+
+def chunked(items, size):
+    """Dela upp en lista i bitar om högst `size` element."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def parse_fetch_response(data):
+    """Gruppera ett (UID) FETCH-svar från imaplib per meddelande.
+
+    Returnerar {uid: {"meta": bytes, "literals": {namn: bytes}}} där `meta`
+    är svaret utan literaler (t.ex. UID, RFC822.SIZE, BODYSTRUCTURE) och
+    `literals` innehåller t.ex. "RFC822" eller "BODY[1]".
+    """
+    messages = []
+    for item in data or []:
+        if item is None:
+            continue
+        head = item[0] if isinstance(item, tuple) else item
+        if isinstance(head, str):
+            head = head.encode()
+        if _FETCH_START.match(head) or not messages:
+            messages.append({"meta": b"", "literals": {}})
+        current = messages[-1]
+
+        if not isinstance(item, tuple):
+            current["meta"] += head
+            continue
+
+        literal = item[1]
+        name = _literal_name(head)
+        if name.startswith((b"BODY", b"RFC822", b"BINARY")):
+            current["meta"] += _LITERAL_SUFFIX.sub(b"", head) + b" NIL"
+            current["literals"][name.decode()] = literal
+        else:
+            # Literal inuti t.ex. BODYSTRUCTURE: lägg in den som en vanlig sträng
+            escaped = literal.replace(b"\\", b"\\\\").replace(b'"', b'\\"')
+            current["meta"] += _LITERAL_SUFFIX.sub(b"", head) + b' "' + escaped + b'"'
+
+    result = {}
+    for message in messages:
+        match = _UID.search(message["meta"])
+        if match:
+            result[int(match.group(1))] = message
+    return result
+
+
+def fetch_sizes(parsed):
+    """Plocka RFC822.SIZE per UID ur ett tolkat FETCH-svar."""
+    sizes = {}
+    for uid, message in parsed.items():
+        match = _SIZE.search(message["meta"])
+        if match:
+            sizes[uid] = int(match.group(1))
+    return sizes
+
+
+def parse_bodystructure(meta):
+    """Tolka BODYSTRUCTURE ur ett FETCH-svar till nästlade listor (None om saknas)."""
+    start = meta.find(b"BODYSTRUCTURE (")
+    if start < 0:
+        return None
+    tokens = _tokenize(meta[start + len(b"BODYSTRUCTURE "):])
+    try:
+        return _parse_list(tokens)
+    except (StopIteration, ValueError):
+        return None
+
+
+def iter_body_parts(structure):
+    """Gå igenom alla lövdelar i en BODYSTRUCTURE i samma ordning som Message.walk().
+
+    Ger dictar med section, type, params, encoding, size, filename och
+    top_level (True när meddelandet inte är multipart).
+    """
+    if structure and isinstance(structure[0], list):
+        yield from _walk_multipart(structure, "")
+    else:
+        yield from _walk_leaf(structure, "1", top_level=True)
+
+
+def _walk_multipart(node, prefix):
+    for index, child in enumerate(node, start=1):
+        if not isinstance(child, list):
+            # Efter delarna kommer subtyp och tilläggsfält
+            break
+        section = f"{prefix}.{index}" if prefix else str(index)
+        if child and isinstance(child[0], list):
+            yield from _walk_multipart(child, section)
+        else:
+            yield from _walk_leaf(child, section)
+
+
+def _walk_leaf(node, section, top_level=False):
+    ctype = f"{_text(node[0])}/{_text(node[1])}".lower()
+    params = _pairs(node[2])
+    if ctype == "message/rfc822" and len(node) > 8 and isinstance(node[8], list):
+        # Vidarebefordrat mail: gå ner i det inbäddade meddelandets delar
+        nested = node[8]
+        if nested and isinstance(nested[0], list):
+            yield from _walk_multipart(nested, section)
+        else:
+            yield from _walk_leaf(nested, f"{section}.1")
+        return
+
+    ext = 8 if ctype.startswith("text/") else 7
+    disposition = node[ext + 1] if len(node) > ext + 1 else None
+    disposition_params = _pairs(disposition[1]) if isinstance(disposition, list) and len(disposition) > 1 else {}
+    try:
+        size = int(node[6])
+    except (TypeError, ValueError, IndexError):
+        size = 0
+
+    yield {
+        "section": section,
+        "type": ctype,
+        "params": params,
+        "encoding": _text(node[5]).lower() if len(node) > 5 else "",
+        "size": size,
+        "filename": disposition_params.get("filename") or params.get("name"),
+        "top_level": top_level,
+    }
+
+
+_OPEN = object()
+_CLOSE = object()
+
+
+def _tokenize(data):
+    for match in _TOKEN.finditer(data):
+        if match.group(1):
+            yield _OPEN
+        elif match.group(2):
+            yield _CLOSE
+        elif match.group(3) is not None:
+            yield _UNESCAPE.sub(rb"\1", match.group(3)).decode("utf-8", errors="replace")
+        else:
+            atom = match.group(4).decode("ascii", errors="replace")
+            yield None if atom.upper() == "NIL" else atom
+
+
+def _parse_list(tokens):
+    if next(tokens) is not _OPEN:
+        raise ValueError("BODYSTRUCTURE börjar inte med (")
+    return _parse_items(tokens)
+
+
+def _parse_items(tokens):
+    result = []
+    for token in tokens:
+        if token is _CLOSE:
+            return result
+        result.append(_parse_items(tokens) if token is _OPEN else token)
+    raise ValueError("Oavslutad BODYSTRUCTURE")
+
+
+def _text(value):
+    return value if isinstance(value, str) else ""
+
+
+def _pairs(values):
+    """Gör om ("name" "x.pdf" "charset" "utf-8") till en dict med gemena nycklar.
+
+    Parametrar enligt RFC 2231 (filename*=utf-8''..., filename*0*=, filename*1=)
+    sätts ihop och avkodas, och går före en vanlig parameter med samma namn.
+    """
+    if not isinstance(values, list):
+        return {}
+    result = {}
+    sections = {}
+    for i in range(0, len(values) - 1, 2):
+        if not isinstance(values[i], str):
+            continue
+        name, number, extended = _PARAM_NAME.match(values[i].lower()).groups()
+        if number is None and not extended:
+            result[name] = values[i + 1]
+        else:
+            sections.setdefault(name, []).append((int(number or 0), bool(extended), values[i + 1] or ""))
+    for name, parts in sections.items():
+        result[name] = _join_rfc2231(sorted(parts, key=lambda part: part[0]))
+    return result
+
+
+def _join_rfc2231(parts):
+    """Sätt ihop fortsättningar; delar markerade med * är %-kodade i parameterns teckenkodning."""
+    charset = "utf-8"
+    raw = b""
+    for index, (_, extended, value) in enumerate(parts):
+        if not extended:
+            raw += value.encode("utf-8")
+            continue
+        if index == 0:
+            # Första delen börjar med charset'språk'
+            value_charset, _, value = decode_rfc2231(value)
+            charset = value_charset or charset
+        raw += unquote_to_bytes(value)
+    try:
+        return raw.decode(charset, errors="replace")
+    except LookupError:
+        return raw.decode("utf-8", errors="replace")
+
+
+def _literal_name(head):
+    """Namnet på FETCH-attributet som literalen hör till, t.ex. b'BODY[1.MIME]'."""
+    text = _LITERAL_SUFFIX.sub(b"", head).rstrip()
+    if text.endswith(b">"):
+        # Delhämtning, t.ex. BODY[2]<0>
+        text = text[:text.rfind(b"<")]
+    if text.endswith(b"]"):
+        start = text.rfind(b"[")
+        # Namnet kan innehålla mellanslag, t.ex. BODY[HEADER.FIELDS (FROM)]
+        depth = 0
+        for i in range(len(text) - 1, -1, -1):
+            if text[i:i + 1] == b"]":
+                depth += 1
+            elif text[i:i + 1] == b"[":
+                depth -= 1
+                if depth == 0:
+                    start = i
+                    break
+        prefix = text[:start].split()
+        return (prefix[-1].lstrip(b"(") if prefix else b"") + text[start:]
+    parts = text.split()
+    return parts[-1].lstrip(b"(") if parts else b""
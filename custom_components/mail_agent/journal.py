@@ -0,0 +1,142 @@
+# Fil: custom_components/mail_agent/journal.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Write-ahead-journal över bearbetningen av varje mail.
+
+Varje steg (hämtat, analyserat, kalender, notis, klart) skrivs som en
+kompakt JSON-rad och synkas till disk innan nästa steg påbörjas. Vid start
+läses journalen in, och mail som inte hann bli klara återupptas från sitt
+senast sparade steg i stället för att köras om från början.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from .const import (
+    LOGGER,
+    JOURNAL_FETCHED,
+    JOURNAL_ANALYSED,
+    JOURNAL_CALENDAR,
+    JOURNAL_NOTIFIED,
+    JOURNAL_DONE,
+    JOURNAL_RETRY,
+    JOURNAL_KEEP_DONE,
+    JOURNAL_COMPACT_LINES,
+)
+
+_PENDING_STATES = (JOURNAL_FETCHED, JOURNAL_ANALYSED, JOURNAL_CALENDAR, JOURNAL_NOTIFIED)
+
+
+class ProcessingJournal:
+    """Append-only journal per config entry, nycklad på meddelandenyckeln.
+
+    En post slås ihop av alla rader för samma nyckel, så ett steg behöver
+    bara skriva det som är nytt. Klara mail minns en tid så att en markör
+    som inte hann sparas före en krasch inte leder till dubbelbearbetning.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._lines = 0
+
+    def load(self):
+        """Läs in och komprimera journalen (blockerande, körs i executor)."""
+        entries = OrderedDict()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        key = record.pop("k")
+                    except (ValueError, KeyError, AttributeError):
+                        # Avhuggen sista rad efter ett strömavbrott
+                        continue
+                    entry = entries.pop(key, {})
+                    if record.get("s") in (JOURNAL_DONE, JOURNAL_RETRY):
+                        entry = {}
+                    entry.update(record)
+                    entries[key] = entry
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            self._entries = entries
+            self._compact()
+
+        pending = sum(1 for e in entries.values() if e["s"] in _PENDING_STATES)
+        if pending:
+            LOGGER.info("Journalen innehåller %s ofullbordade mail som återupptas.", pending)
+
+    def record(self, key, state, **data):
+        """Spara ett steg för ett mail. Returnerar när raden ligger på disk."""
+        self.record_many([key], state, **data)
+
+    def record_many(self, keys, state, **data):
+        """Spara samma steg för flera mail med en enda diskskrivning."""
+        if not keys:
+            return
+        lines = "".join(
+            json.dumps({"k": key, "s": state, **data}, ensure_ascii=False, separators=(",", ":")) + "\n"
+            for key in keys
+        )
+        with self._lock:
+            for key in keys:
+                entry = self._entries.pop(key, {})
+                if state in (JOURNAL_DONE, JOURNAL_RETRY):
+                    # Färdiga poster behöver bara sitt tillstånd
+                    entry = {}
+                entry.update(data)
+                entry["s"] = state
+                self._entries[key] = entry
+
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self._lines += len(keys)
+            if self._lines > JOURNAL_COMPACT_LINES:
+                self._compact()
+
+    def state(self, key):
+        """Senast sparade steg för ett mail (None om det är okänt)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry["s"] if entry else None
+
+    def pending(self, folder=None):
+        """Ofullbordade mail (i en mapp, eller alla) som (nyckel, post), äldst först."""
+        with self._lock:
+            return [
+                (key, dict(entry)) for key, entry in self._entries.items()
+                if entry["s"] in _PENDING_STATES and folder in (None, entry.get("folder"))
+            ]
+
+    def remove(self):
+        """Ta bort journalfilen (när kontot tas bort)."""
+        for path in (self.path, self.path + ".tmp"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _compact(self):
+        """Skriv om filen med en rad per post. Anropas med låset taget."""
+        # Omförsök ägs av synkstatusens kö; av de klara sparas bara de senaste
+        done = [key for key, entry in self._entries.items() if entry["s"] in (JOURNAL_DONE, JOURNAL_RETRY)]
+        for key in done[:max(0, len(done) - JOURNAL_KEEP_DONE)]:
+            del self._entries[key]
+        for key in done:
+            if self._entries.get(key, {}).get("s") == JOURNAL_RETRY:
+                del self._entries[key]
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for key, entry in self._entries.items():
+                f.write(json.dumps({"k": key, **entry}, ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._lines = len(self._entries)
@@ -1,40 +1,73 @@
 # Version: 0.18.0 - 2025-12-18
 """Processor för att tolka kallelser och bokningar."""
 
+import asyncio
 import json
-import smtplib
-import mimetypes
+import os
+import threading
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
-from email.utils import formataddr
 
 from google import genai
 
 from homeassistant.util import dt as dt_util
-from .const import LOGGER
+from .const import (
+    LOGGER,
+    GEMINI_FILE_TTL_HOURS,
+    GEMINI_FILE_EXPIRY_MARGIN,
+    GEMINI_TOKENS_PER_PDF,
+    GEMINI_PROMPT_OVERHEAD_TOKENS,
+    CONF_GEMINI_RPM,
+    CONF_GEMINI_TPM,
+    CONF_BODY_TOKEN_BUDGET,
+    CONF_PDF_TEXT_EXTRACTION,
+    CONF_PDF_MAX_PAGES,
+    EVENT_FIELDS,
+    CALENDAR_CALL_TIMEOUT,
+    CONF_DIGEST_WINDOW,
+    CONF_DIGEST_MAX_EVENTS,
+    DEFAULT_DIGEST_WINDOW,
+    DEFAULT_DIGEST_MAX_EVENTS,
+    DIGEST_MAX_BYTES,
+    DEFAULT_GEMINI_RPM,
+    DEFAULT_GEMINI_TPM,
+    DEFAULT_BODY_TOKEN_BUDGET,
+    DEFAULT_PDF_TEXT_EXTRACTION,
+    DEFAULT_PDF_MAX_PAGES,
+    JOURNAL_CALENDAR,
+    JOURNAL_NOTIFIED,
+)
+from .ai_cache import AiResultCache, async_get_ai_cache
+from .attachment_store import async_get_attachment_store, blob_hash
+from .rate_limiter import AiRetryableError, get_rate_limiter
+from .body_compactor import compact_body, estimate_tokens
+from .pdf_text import extract_pdf_text
+from .notification_digest import NotificationDigest, digest_storage_key
+from .storage import MailAgentStore
+from .calendar_index import CalendarEventIndex, async_get_calendar_index
 
 class KallelseProcessor:
     """Hanterar logiken för 'Tolka kallelse'."""
 
-    def __init__(self, hass, config):
+    def __init__(self, hass, config, outbox=None, entry_id=None):
         self.hass = hass
+        # SmtpOutbox som skickar mailen i bakgrunden
+        self.outbox = outbox
         self.gemini_api_key = config.get("gemini_api_key")
         self.gemini_model = config.get("gemini_model")
         self.enable_debug = config.get("enable_debug")
+        budget = config.get(CONF_BODY_TOKEN_BUDGET)
+        self.body_token_budget = DEFAULT_BODY_TOKEN_BUDGET if budget is None else budget
+        extraction = config.get(CONF_PDF_TEXT_EXTRACTION)
+        self.pdf_text_extraction = DEFAULT_PDF_TEXT_EXTRACTION if extraction is None else extraction
+        self.pdf_max_pages = config.get(CONF_PDF_MAX_PAGES) or DEFAULT_PDF_MAX_PAGES
 
         self.cal1 = config.get("calendar_entity_1")
         self.cal2 = config.get("calendar_entity_2")
 
+        # Själva sändningen (port, inloggning, avsändarnamn) sköts av utkorgen
         self.smtp_server = config.get("smtp_server")
-        self.smtp_port = config.get("smtp_port", 587)
-        self.smtp_user = config.get("username")
-        self.smtp_password = config.get("password")
-
-        self.smtp_sender_name = config.get("smtp_sender_name", "Mail Agent")
 
         self.email_recipients = [
             r for r in [config.get("email_recipient_1"), config.get("email_recipient_2")] if r
@@ -43,10 +76,62 @@ class KallelseProcessor:
             s for s in [config.get("notify_service_1"), config.get("notify_service_2")] if s
         ]
 
-    def process_email(self, sender, subject, body, attachment_paths):
+        # Sammanfattningsläge: notiser inom fönstret skickas som en push och ett mail
+        self.digest = None
+        digest_window = config.get(CONF_DIGEST_WINDOW) or DEFAULT_DIGEST_WINDOW
+        if digest_window > 0:
+            self.digest = NotificationDigest(
+                digest_window * 60,
+                config.get(CONF_DIGEST_MAX_EVENTS) or DEFAULT_DIGEST_MAX_EVENTS,
+                DIGEST_MAX_BYTES,
+                self._deliver_notifications,
+                # Sparad buffert: journalen räknar notisen som skickad när add() returnerar
+                MailAgentStore(hass, digest_storage_key(entry_id), {"entries": [], "started": None})
+                if entry_id else None,
+                self._pin_digest_attachments,
+            )
+        self._digest_pin_owner = f"digest:{entry_id}"
+
+        self.ai_cache = None
+        self.calendar_index = None
+        self.attachments = None
+
+        # Summa tokens som sparats genom att komprimera mailtexter
+        self.tokens_saved = 0
+        self._stats_lock = threading.Lock()
+        self.rate_limiter = get_rate_limiter(
+            hass,
+            self.gemini_api_key,
+            config.get(CONF_GEMINI_RPM, DEFAULT_GEMINI_RPM),
+            config.get(CONF_GEMINI_TPM, DEFAULT_GEMINI_TPM),
+        )
+
+        # En klient per processor så att HTTP-anslutningen återanvänds
+        self._client = None
+        self._client_lock = threading.Lock()
+
+        # Uppladdade filer per SHA-256: (fil-handtag, utgångstid)
+        self._uploads = {}
+        self._uploads_lock = threading.Lock()
+
+    def flush_notifications(self):
+        """Skicka notiser som väntar i sammanfattningen (vid unload)."""
+        if self.digest is not None:
+            self.digest.flush()
+
+    async def async_load(self):
+        """Koppla in den gemensamma AI-cachen och kalenderindexet."""
+        self.ai_cache = await async_get_ai_cache(self.hass)
+        self.calendar_index = await async_get_calendar_index(self.hass)
+        self.attachments = await async_get_attachment_store(self.hass)
+        if self.digest is not None:
+            await self.digest.async_load()
+
+    def analyze_email(self, subject, body, attachment_paths):
         """
-        Huvudmetod som anropas från MailAgentScanner.
+        Steg 1: AI-analys. Trådsäker och kan köras parallellt från MailAgentScanner.
         Returnerar ai_data (dict) om framgångsrik, annars None.
+        Kastar AiRetryableError om Gemini tillfälligt inte svarar (kvot, 5xx).
         """
 
         if not self.gemini_api_key:
@@ -55,34 +140,68 @@ class KallelseProcessor:
             return None
 
         try:
-            # 1. Anropa AI
-            ai_data = self._call_gemini(attachment_paths, subject, body)
+            # Citat, signaturer och brus tas bort innan cache-nyckel och prompt
+            body, saved = compact_body(body, self.body_token_budget)
+            if saved:
+                with self._stats_lock:
+                    self.tokens_saved += saved
+                if self.enable_debug:
+                    LOGGER.debug("Mailtexten komprimerad, ca %s tokens sparade: %s", saved, subject)
+
+            # Anropa AI (eller återanvänd en tidigare identisk analys)
+            ai_data = self._analyze(attachment_paths, subject, body)
+
+            # Ett eller flera events, i en och samma form
+            return self._normalize_result(ai_data)
+
+        except AiRetryableError:
+            raise
+        except Exception as e:
+            LOGGER.error("Fel i KallelseProcessor: %s", e)
+            return None
 
-            # Hantera lista från AI
-            if isinstance(ai_data, list):
-                if len(ai_data) > 0:
-                    ai_data = ai_data[0]
-                else:
-                    ai_data = {}
+    def apply_result(self, sender, subject, attachment_paths, ai_data, done_steps=(), on_step=None):
+        """
+        Steg 2: event, kalender och notiser. Anropas i mailens ordning.
+        Returnerar ai_data (dict) om framgångsrik, annars None.
 
-            # Fire event
-            self.hass.bus.fire("mail_agent.scanned_document", {
-                "type": "kallelse",
-                "sender": sender,
-                "subject": subject,
-                "ai_data": ai_data,
-                "attachments": [str(p) for p in attachment_paths]
-            })
+        `done_steps` är steg som redan gjorts enligt journalen (vid återupptagning)
+        och `on_step(steg, **data)` anropas efter varje genomfört steg.
+        """
+        try:
+            if not done_steps:
+                # Fire event
+                self.hass.bus.fire("mail_agent.scanned_document", {
+                    "type": "kallelse",
+                    "sender": sender,
+                    "subject": subject,
+                    "ai_data": ai_data,
+                    "attachments": [str(p) for p in attachment_paths]
+                })
 
             if self.enable_debug:
                 LOGGER.info("AI RESULTAT (Kallelse):\n%s", json.dumps(ai_data, indent=2, ensure_ascii=False))
 
-            # 2. Agera på resultatet
+            # Agera på resultatet: alla events bokas, och en samlad notis skickas
             if ai_data.get("event_found") is True:
-                if ai_data.get("start_time"):
-                    self._create_calendar_events(ai_data)
+                calendar = ai_data.get("calendar")
+                if JOURNAL_CALENDAR not in done_steps:
+                    events = [e for e in ai_data.get("events", []) if e.get("start_time")]
+                    calendar = None
+                    if events:
+                        calendar = ai_data["calendar"] = self._create_calendar_events(events)
+                    if on_step:
+                        on_step(JOURNAL_CALENDAR, calendar=calendar)
+
+                if calendar and calendar["duplicates"] and not calendar["created"] and not calendar["errors"]:
+                    # Allt fanns redan (t.ex. ett ombearbetat mail), notifiera inte igen
+                    if self.enable_debug:
+                        LOGGER.info("Alla events fanns redan i kalendern, hoppar över notiser: %s", subject)
+                else:
+                    self._send_notifications(ai_data, subject, attachment_paths)
 
-                self._send_notifications(ai_data, subject, attachment_paths)
+            if on_step:
+                on_step(JOURNAL_NOTIFIED)
 
             # Returnera data så att sensorn kan uppdateras
             return ai_data
@@ -91,11 +210,129 @@ class KallelseProcessor:
             LOGGER.error("Fel i KallelseProcessor: %s", e)
             return None
 
-    def _call_gemini(self, file_paths, subject, body):
-        client = genai.Client(api_key=self.gemini_api_key)
-        uploaded_files = []
-        for path in file_paths:
-            uploaded_files.append(client.files.upload(file=path, config={'mime_type': 'application/pdf'}))
+    @staticmethod
+    def _normalize_result(ai_data):
+        """Gör om AI-svaret till en dict med en deduplicerad lista `events`.
+
+        Svaret kan vara det nya formatet ({"events": [...]}), det gamla med ett
+        event direkt i dicten, eller en lista. Fälten för första eventet
+        ligger kvar på toppnivå för bakåtkompatibilitet.
+        """
+        if isinstance(ai_data, list):
+            items = [item for item in ai_data if isinstance(item, dict)]
+            result = {"suggested_filename": next(
+                (i["suggested_filename"] for i in items if i.get("suggested_filename")), None
+            )}
+        elif isinstance(ai_data, dict):
+            result = {k: v for k, v in ai_data.items() if k != "events"}
+            items = ai_data.get("events")
+            if not isinstance(items, list):
+                items = [ai_data] if ai_data.get("event_found") else []
+            items = [item for item in items if isinstance(item, dict)]
+        else:
+            return {"event_found": False, "events": []}
+
+        events = []
+        seen = set()
+        for item in items:
+            if item.get("event_found") is False:
+                continue
+            event = {field: item.get(field) for field in EVENT_FIELDS}
+            key = (
+                event.get("start_time") or "",
+                (event.get("summary") or "").strip().lower(),
+                (event.get("location") or "").strip().lower(),
+            )
+            if key in seen:
+                continue
+            seen.add(key)
+            events.append(event)
+
+        result["events"] = events
+        result["event_found"] = bool(events)
+        if events:
+            for field in EVENT_FIELDS:
+                result[field] = events[0].get(field)
+        return result
+
+    def _analyze(self, file_paths, subject, body):
+        """Hämta ai_data från cachen, annars från Gemini."""
+        # Bilagorna ligger i den innehållsadresserade lagringen, så hashen är redan känd
+        file_hashes = [blob_hash(path) for path in file_paths]
+        if self.ai_cache is None:
+            return self._limited_call(file_paths, subject, body, file_hashes)
+
+        key = AiResultCache.make_key(
+            self.gemini_model,
+            dt_util.now().strftime('%Y-%m-%d'),
+            subject,
+            body,
+            file_hashes,
+        )
+        ai_data = self.ai_cache.get(key)
+        if ai_data is not None:
+            if self.enable_debug:
+                LOGGER.info("AI-cache träff, hoppar över Gemini-anrop: %s", subject)
+            return ai_data
+
+        ai_data = self._limited_call(file_paths, subject, body, file_hashes)
+        self.ai_cache.put(key, ai_data)
+        return ai_data
+
+    def _limited_call(self, file_paths, subject, body, file_hashes):
+        """Anropa Gemini inom den gemensamma kvoten, med omförsök."""
+        estimated = self._estimate_tokens(subject, body, file_paths)
+        return self.rate_limiter.call(
+            self._call_gemini, estimated, file_paths, subject, body, file_hashes, estimated
+        )
+
+    @staticmethod
+    def _estimate_tokens(subject, body, file_paths):
+        """Grov uppskattning innan svaret är känt."""
+        text_tokens = estimate_tokens(subject) + estimate_tokens(body)
+        return GEMINI_PROMPT_OVERHEAD_TOKENS + text_tokens + GEMINI_TOKENS_PER_PDF * len(file_paths)
+
+    def _get_client(self):
+        with self._client_lock:
+            if self._client is None:
+                self._client = genai.Client(api_key=self.gemini_api_key)
+            return self._client
+
+    def _upload_file(self, client, path, file_hash):
+        """Ladda upp en PDF, eller återanvänd en tidigare uppladdning av samma innehåll."""
+        now = time.time()
+        with self._uploads_lock:
+            for key in [k for k, (_, expires) in self._uploads.items() if expires <= now]:
+                del self._uploads[key]
+            cached = self._uploads.get(file_hash)
+        if cached is not None:
+            if self.enable_debug:
+                LOGGER.debug("Återanvänder uppladdad fil %s", cached[0].name)
+            return cached[0]
+
+        uploaded = client.files.upload(file=path, config={'mime_type': 'application/pdf'})
+        expiration = getattr(uploaded, "expiration_time", None)
+        expires = expiration.timestamp() if expiration else now + GEMINI_FILE_TTL_HOURS * 3600
+        with self._uploads_lock:
+            self._uploads[file_hash] = (uploaded, expires - GEMINI_FILE_EXPIRY_MARGIN)
+        return uploaded
+
+    def _call_gemini(self, file_paths, subject, body, file_hashes=None, estimated_tokens=None):
+        client = self._get_client()
+        if file_hashes is None:
+            file_hashes = [blob_hash(path) for path in file_paths]
+        # PDF:er med textlager skickas som text; bara inskannade laddas upp
+        attachment_parts = []
+        for path, file_hash in zip(file_paths, file_hashes):
+            text = None
+            if self.pdf_text_extraction:
+                text = extract_pdf_text(path, file_hash, self.pdf_max_pages)
+            if text is not None:
+                if self.enable_debug:
+                    LOGGER.debug("Använder lokal text från %s (%s tecken)", Path(path).name, len(text))
+                attachment_parts.append(f"Bilaga ({Path(path).name}):\n{text}")
+            else:
+                attachment_parts.append(self._upload_file(client, path, file_hash))
 
         now_str = dt_util.now().strftime('%Y-%m-%d %H:%M')
 
@@ -104,6 +341,7 @@ class KallelseProcessor:
         Idag är det: {now_str}
 
         Din uppgift är att hitta bokningar, kallelser eller möten i detta mail/bilaga.
+        Innehåller det flera tillfällen (t.ex. en serie behandlingar), ta med ett event per tillfälle.
 
         OM DET FINNS BILAGOR: Föreslå ett kort, beskrivande filnamn (slutar på .pdf) baserat på innehållet (t.ex. "Tandläkare_2025-05-10.pdf").
 
@@ -118,70 +356,168 @@ class KallelseProcessor:
         Svara strikt med JSON:
         {{
             "event_found": boolean,
-            "summary": "Kort beskrivning",
-            "description": "Sammanfattning av detaljer",
-            "start_time": "YYYY-MM-DD HH:MM:SS (eller null)",
-            "location": "Plats",
-            "type": "Typ",
+            "events": [
+                {{
+                    "summary": "Kort beskrivning",
+                    "description": "Sammanfattning av detaljer",
+                    "start_time": "YYYY-MM-DD HH:MM:SS (eller null)",
+                    "location": "Plats",
+                    "type": "Typ"
+                }}
+            ],
             "suggested_filename": "Nytt_Filnamn.pdf"
         }}
         """
 
-        contents = uploaded_files + [prompt]
-        response = client.models.generate_content(
-            model=self.gemini_model, contents=contents, config={'response_mime_type': 'application/json'}
-        )
-
-        for f in uploaded_files:
-            try:
-                client.files.delete(name=f.name)
-            except Exception:
-                pass
-
+        contents = attachment_parts + [prompt]
+        try:
+            response = client.models.generate_content(
+                model=self.gemini_model, contents=contents, config={'response_mime_type': 'application/json'}
+            )
+        except Exception:
+            # Filerna kan ha försvunnit på serversidan; ladda upp på nytt nästa gång
+            with self._uploads_lock:
+                for file_hash in file_hashes:
+                    self._uploads.pop(file_hash, None)
+            raise
+
+        usage = getattr(response, "usage_metadata", None)
+        actual = getattr(usage, "total_token_count", None)
+        if estimated_tokens is not None and actual:
+            self.rate_limiter.adjust_tokens(actual - estimated_tokens)
+
+        # Filerna ligger kvar tills de löper ut på servern så att dubbletter
+        # och nya försök slipper ladda upp igen.
         return json.loads(response.text)
 
-    def _create_calendar_events(self, ai_data):
+    def _create_calendar_events(self, events):
+        """Skapa events i valda kalendrar i en batch och vänta in resultatet.
+
+        Dubbletter (redan skapade events) filtreras bort via kalenderindexet.
+        Returnerar {"created": int, "duplicates": int, "errors": [str]}.
+        """
+        result = {"created": 0, "duplicates": 0, "errors": []}
         calendars = [c for c in [self.cal1, self.cal2] if c]
         if not calendars:
-            return
+            return result
 
-        start_str = ai_data.get("start_time")
+        batch = []
+        for event in events:
+            start_str = event.get("start_time")
+            try:
+                dt_start = dt_util.as_local(datetime.strptime(start_str, "%Y-%m-%d %H:%M:%S"))
+                dt_end = dt_start + timedelta(hours=1)
+            except (ValueError, TypeError):
+                continue
+
+            summary = event.get("summary") or "Bokat Event"
+            description = f"{event.get('description') or ''}\n\n[Auto-skapat av Mail Agent]"
+            location = event.get("location") or ""
+            key = CalendarEventIndex.make_key(dt_start, summary, location)
+
+            for calendar_entity in calendars:
+                if self.calendar_index is not None and not self.calendar_index.claim(
+                    calendar_entity, key, dt_start.timestamp()
+                ):
+                    result["duplicates"] += 1
+                    if self.enable_debug:
+                        LOGGER.info(f"Finns redan i {calendar_entity}: {summary} {start_str}")
+                    continue
+                if self.enable_debug:
+                    LOGGER.info(f"Bokar i {calendar_entity}: {summary} {start_str}")
+                batch.append((calendar_entity, key, {
+                    "entity_id": calendar_entity,
+                    "summary": summary,
+                    "description": description,
+                    "start_date_time": dt_start.isoformat(),
+                    "end_date_time": dt_end.isoformat(),
+                    "location": location,
+                }))
+
+        if not batch:
+            return result
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._async_create_events([data for _, _, data in batch]), self.hass.loop
+        )
         try:
-            dt_start = dt_util.as_local(datetime.strptime(start_str, "%Y-%m-%d %H:%M:%S"))
-            dt_end = dt_start + timedelta(hours=1)
-        except (ValueError, TypeError):
-            return
-
-        summary = ai_data.get("summary", "Bokat Event")
-        description = f"{ai_data.get('description', '')}\n\n[Auto-skapat av Mail Agent]"
-        location = ai_data.get("location", "")
-
-        for calendar_entity in calendars:
-            if self.enable_debug:
-                LOGGER.info(f"Bokar i {calendar_entity}")
-            self.hass.add_job(
-                self.hass.services.async_call(
-                    "calendar", "create_event",
-                    {
-                        "entity_id": calendar_entity,
-                        "summary": summary,
-                        "description": description,
-                        "start_date_time": dt_start.isoformat(),
-                        "end_date_time": dt_end.isoformat(),
-                        "location": location,
-                    }
-                )
-            )
+            outcomes = future.result(CALENDAR_CALL_TIMEOUT)
+        except Exception as e:
+            # Okänt utfall (t.ex. timeout): behåll reservationerna hellre än att riskera dubbletter
+            future.cancel()
+            LOGGER.error("Kalenderanrop gav inget svar: %s", e)
+            result["errors"].append(f"timeout: {e}")
+            return result
+
+        for (calendar_entity, key, data), outcome in zip(batch, outcomes):
+            if isinstance(outcome, Exception):
+                if self.calendar_index is not None:
+                    self.calendar_index.release(calendar_entity, key)
+                LOGGER.error("Kunde inte skapa '%s' i %s: %s", data["summary"], calendar_entity, outcome)
+                result["errors"].append(f"{calendar_entity}: {outcome}")
+            else:
+                result["created"] += 1
+        return result
+
+    async def _async_create_events(self, batch):
+        """Kör alla create_event parallellt och samla in utfallen."""
+        return await asyncio.gather(
+            *(
+                self.hass.services.async_call("calendar", "create_event", data, blocking=True)
+                for data in batch
+            ),
+            return_exceptions=True,
+        )
 
     def _send_notifications(self, ai_data, original_subject, attachment_paths):
-        summary = ai_data.get("summary", "Okänd händelse")
-        start_time = ai_data.get("start_time", "okänd tid")
-        location = ai_data.get("location", "")
-        description = ai_data.get("description", "")
-        suggested_filename = ai_data.get("suggested_filename")
+        entry = {
+            "subject": original_subject,
+            "events": ai_data.get("events") or [ai_data],
+            "attachments": self._named_attachments(attachment_paths, ai_data.get("suggested_filename")),
+        }
+        if self.digest is not None:
+            self.digest.add(entry)
+        else:
+            self._deliver_notifications([entry])
+
+    def _pin_digest_attachments(self, paths):
+        """Håll sammanfattningens bilagor kvar i lagringen tills den har skickats."""
+        if self.attachments is not None:
+            self.attachments.pin(self._digest_pin_owner, paths)
+
+    def _named_attachments(self, files, suggested_filename):
+        """Bilagor med filnamn från AI:ns förslag (numrerade om de är flera)."""
+        attachments = []
+        for index, file_path in enumerate(files, start=1):
+            path = Path(file_path)
+            filename = path.name
+            if suggested_filename:
+                filename = suggested_filename
+                if len(files) > 1:
+                    suggested = Path(suggested_filename)
+                    filename = f"{suggested.stem}_{index}{suggested.suffix}"
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            attachments.append({"path": str(path), "filename": filename, "size": size})
+        return attachments
+
+    def _deliver_notifications(self, entries):
+        """En push per tjänst och ett mail för en eller flera notiser."""
+        events = [event for entry in entries for event in entry["events"]]
+        first = events[0]
+        summary = first.get("summary") or "Okänd händelse"
 
         if self.notify_services:
-            mobile_message = f"Ny bokning: {summary}\nTid: {start_time}"
+            if len(events) == 1:
+                mobile_message = f"Ny bokning: {summary}\nTid: {first.get('start_time') or 'okänd tid'}"
+            else:
+                lines = [
+                    f"- {e.get('summary') or 'Okänd händelse'}: {e.get('start_time') or 'okänd tid'}"
+                    for e in events
+                ]
+                mobile_message = f"{len(events)} nya bokningar:\n" + "\n".join(lines)
             for service in self.notify_services:
                 domain = "notify"
                 service_name = service.replace("notify.", "")
@@ -197,62 +533,50 @@ class KallelseProcessor:
                 )
 
         if self.smtp_server and self.email_recipients:
+            event_html = "<hr>".join(
+                f"""
+            <p><b>Händelse:</b> {e.get('summary') or 'Okänd händelse'}</p>
+            <p><b>Tid:</b> {e.get('start_time') or 'okänd tid'}</p>
+            <p><b>Plats:</b> {e.get('location') or ''}</p>
+            <p><b>Detaljer:</b><br>{e.get('description') or ''}</p>
+            """
+                for e in events
+            )
+            heading = "Ny händelse" if len(events) == 1 else f"{len(events)} nya händelser"
+            subjects = ", ".join(entry["subject"] for entry in entries)
             email_body = f"""
-            <h3>Mail Agent: Ny händelse</h3>
-            <p><b>Händelse:</b> {summary}</p>
-            <p><b>Tid:</b> {start_time}</p>
-            <p><b>Plats:</b> {location}</p>
+            <h3>Mail Agent: {heading}</h3>
+            {event_html}
             <hr>
-            <p><b>Detaljer:</b><br>{description}</p>
-            <hr>
-            <p><small>Originalämne: {original_subject}</small></p>
+            <p><small>Originalämne: {subjects}</small></p>
             """
+            email_subject = f"Ny kallelse: {summary}"
+            if len(events) > 1:
+                email_subject = f"{len(events)} nya kallelser: {summary} m.fl."
+
+            # Unika filnamn i det samlade mailet
+            attachments = []
+            used = set()
+            for attachment in (a for entry in entries for a in entry["attachments"]):
+                name = Path(attachment["filename"])
+                filename, counter = name.name, 2
+                while filename.lower() in used:
+                    filename = f"{name.stem}_{counter}{name.suffix}"
+                    counter += 1
+                used.add(filename.lower())
+                attachments.append({"path": attachment["path"], "filename": filename})
+
             try:
-                self._send_smtp_email(f"Ny kallelse: {summary}", email_body, attachment_paths, suggested_filename)
+                self._send_smtp_email(email_subject, email_body, attachments)
             except Exception as e:
                 LOGGER.error(f"Kunde inte skicka SMTP-mail: {e}")
 
-    def _send_smtp_email(self, subject, html_body, files, suggested_filename=None):
-        if not files:
-            msg = MIMEText(html_body, 'html')
-        else:
-            msg = MIMEMultipart()
-            msg.attach(MIMEText(html_body, 'html'))
-            for file_path in files:
-                try:
-                    path = Path(file_path)
-                    ctype, encoding = mimetypes.guess_type(path)
-                    if ctype is None or encoding is not None:
-                        ctype = 'application/octet-stream'
-                    maintype, subtype = ctype.split('/', 1)
-                    with open(path, 'rb') as f:
-                        file_data = f.read()
-                    part = MIMEBase(maintype, subtype)
-                    part.set_payload(file_data)
-                    encoders.encode_base64(part)
-
-                    if suggested_filename and len(files) == 1:
-                        filename = suggested_filename
-                    else:
-                        filename = path.name
-
-                    part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
-                    msg.attach(part)
-                except Exception as e:
-                    LOGGER.error(f"Kunde inte bifoga fil {file_path}: {e}")
-
-        msg['From'] = formataddr((self.smtp_sender_name, self.smtp_user))
-        msg['To'] = ", ".join(self.email_recipients)
-        msg['Subject'] = subject
-
-        if self.smtp_port == 465:
-            server = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port)
-        else:
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
+    def _send_smtp_email(self, subject, html_body, attachments):
+        """Lägg mailet i utkorgen; det skickas av utkorgens egen tråd."""
+        if self.outbox is None:
+            LOGGER.warning("Ingen SMTP-utkorg, mailet skickas inte: %s", subject)
+            return
 
-        server.login(self.smtp_user, self.smtp_password)
-        server.sendmail(self.smtp_user, self.email_recipients, msg.as_string())
-        server.quit()
+        self.outbox.enqueue(self.email_recipients, subject, html_body, attachments)
         if self.enable_debug:
-            LOGGER.info("SMTP mail skickat framgångsrikt (Kallelse).")
\ No newline at end of file
+            LOGGER.info("SMTP mail lagt i utkorgen (Kallelse).")
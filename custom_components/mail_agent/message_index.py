@@ -0,0 +1,147 @@
+# Fil: custom_components/mail_agent/message_index.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Gemensamt dubblettindex över mail, så att samma kallelse bara analyseras en gång."""
+
+import asyncio
+import hashlib
+import json
+import re
+import time
+
+from .const import (
+    DOMAIN,
+    DATA_MESSAGE_INDEX,
+    MESSAGE_INDEX_TTL_DAYS,
+    MESSAGE_INDEX_MAX_ENTRIES,
+    MESSAGE_FP_MIN_CHARS,
+)
+from .storage import MailAgentStore
+
+# Re:/Fwd:/SV:/VB: m.fl., även upprepade
+_SUBJECT_PREFIX = re.compile(r"^(?:\s*(?:re|sv|aw|fw|fwd|vb|vs|wg)\s*(?:\[\d+\])?\s*:)+", re.I)
+# Rader som en vidarebefordran eller ett svar lägger till
+_HEADER_LINE = re.compile(
+    r"^(?:from|från|to|till|cc|date|datum|sent|skickat|subject|ämne)\s*:", re.I
+)
+_MARKER_LINE = re.compile(
+    r"^-{2,}|forwarded message|vidarebefordrat meddelande|original message|ursprungligt meddelande", re.I
+)
+
+
+async def async_get_message_index(hass):
+    """Hämta (och vid behov skapa) det gemensamma dubblettindexet."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    index = domain_data.get(DATA_MESSAGE_INDEX)
+    if index is None:
+        index = domain_data[DATA_MESSAGE_INDEX] = MessageIndex(hass)
+    await index.async_ensure_loaded()
+    return index
+
+
+def _digest(*parts):
+    payload = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _normalize_subject(subject):
+    return " ".join(_SUBJECT_PREFIX.sub("", subject or "").lower().split())
+
+
+def _normalize_body(body):
+    """Texten utan citattecken, vidarebefordringshuvuden och blanktecken."""
+    words = []
+    for line in (body or "").splitlines():
+        line = line.lstrip("> \t")
+        if not line or _HEADER_LINE.match(line) or _MARKER_LINE.search(line):
+            continue
+        words.extend(line.lower().split())
+    return " ".join(words)
+
+
+def message_id_key(message_id):
+    """Nyckel för ett Message-ID, eller None om mailet saknar ett."""
+    message_id = (message_id or "").strip().strip("<>").strip().lower()
+    return f"mid:{message_id}" if message_id else None
+
+
+def content_keys(subject, body, attachment_hashes):
+    """Innehållsavtryck som känner igen samma kallelse i en kopia eller vidarebefordran.
+
+    Med bilagor räcker ämnet och bilagornas hash (följetexten skiljer ofta).
+    Utan bilagor används den normaliserade texten, om den är lång nog.
+    """
+    subject = _normalize_subject(subject)
+    if attachment_hashes:
+        return [f"att:{_digest(subject, sorted(attachment_hashes))}"]
+    body = _normalize_body(body)
+    if len(body) < MESSAGE_FP_MIN_CHARS:
+        return []
+    return [f"txt:{_digest(subject, body)}"]
+
+
+class MessageIndex:
+    """LRU-index med TTL från Message-ID och innehållsavtryck till det mail som äger dem.
+
+    Delas av alla konton och mappar. Det mail som först gör anspråk på en
+    nyckel äger den, och samma mail kan göra anspråk igen (t.ex. vid omförsök).
+    """
+
+    def __init__(self, hass):
+        self.hass = hass
+        self.ttl = MESSAGE_INDEX_TTL_DAYS * 86400
+        self.max_entries = MESSAGE_INDEX_MAX_ENTRIES
+        self._store = MailAgentStore(hass, f"{DOMAIN}.message_index", {"entries": {}})
+        self._load_lock = None
+        self._loaded = False
+
+    async def async_ensure_loaded(self):
+        if self._loaded:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if not self._loaded:
+                await self._store.async_load()
+                self._loaded = True
+
+    def claim(self, keys, owner):
+        """Gör anspråk på nycklarna åt `owner`.
+
+        Returnerar ägaren om någon nyckel redan tillhör ett annat mail (dubblett),
+        annars None efter att alla nycklar har reserverats.
+        """
+        keys = [key for key in keys if key]
+        if not keys:
+            return None
+        now = time.time()
+        with self._store.lock:
+            entries = self._store.data["entries"]
+            for key in keys:
+                entry = entries.get(key)
+                if entry is not None and entry["seen"] + self.ttl >= now and entry["owner"] != owner:
+                    # Flytta sist så att ordningen motsvarar senaste användning
+                    entries[key] = entries.pop(key)
+                    entry["seen"] = now
+                    self._store.schedule_save()
+                    return entry["owner"]
+
+            for key in keys:
+                entries.pop(key, None)
+                entries[key] = {"owner": owner, "seen": now}
+            self._prune(entries, now)
+        self._store.schedule_save()
+        return None
+
+    def release(self, keys, owner):
+        """Släpp nycklar som `owner` äger (när analysen misslyckades)."""
+        with self._store.lock:
+            entries = self._store.data["entries"]
+            for key in keys:
+                if key and (entries.get(key) or {}).get("owner") == owner:
+                    del entries[key]
+        self._store.schedule_save()
+
+    def _prune(self, entries, now):
+        for key in [k for k, v in entries.items() if v["seen"] + self.ttl < now]:
+            del entries[key]
+        while len(entries) > self.max_entries:
+            del entries[next(iter(entries))]
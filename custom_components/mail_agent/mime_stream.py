@@ -0,0 +1,145 @@
+# Fil: custom_components/mail_agent/mime_stream.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Strömmad MIME-serialisering och SMTP-sändning med cachade base64-bilagor."""
+
+import base64
+import mimetypes
+import smtplib
+import uuid
+from email.message import EmailMessage
+from email.policy import SMTP as SMTP_POLICY
+from pathlib import Path
+
+from .const import LOGGER, MIME_ENCODE_CHUNK, MIME_STREAM_CHUNK
+
+CRLF = b"\r\n"
+
+
+def encoded_sidecar(path):
+    """Sökvägen där den base64-kodade kopian av `path` ligger."""
+    path = Path(path)
+    return path.with_name(f".{path.name}.b64")
+
+
+def encoded_path(path):
+    """Base64-kodad kopia av filen (76 tecken per rad, CRLF), skapas vid behov.
+
+    Kopian ligger bredvid filen. Bilagelagringen är innehållsadresserad
+    (<sha256>/<namn>), så kopian är i praktiken nycklad på innehållets hash,
+    kodas bara en gång och försvinner när bloben rensas bort. Lagringen
+    räknar in kopian i sin storlek via `AttachmentStore.encoded_path`.
+    """
+    path = Path(path)
+    target = encoded_sidecar(path)
+    source_mtime = path.stat().st_mtime
+    try:
+        if target.stat().st_mtime >= source_mtime:
+            return target
+    except FileNotFoundError:
+        pass
+
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(path, "rb") as src, open(tmp, "wb") as dst:
+            while chunk := src.read(MIME_ENCODE_CHUNK):
+                dst.write(base64.encodebytes(chunk).replace(b"\n", CRLF))
+        tmp.replace(target)
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        raise
+    return target
+
+
+def prepare_attachments(attachments, encode=None):
+    """Koda (eller hitta cachad kodning av) bilagorna innan sändningen börjar.
+
+    Returnerar [(delhuvud, sökväg till kodad fil)]. Bilagor som inte kan
+    läsas loggas och hoppas över, som tidigare. `encode` ersätter
+    `encoded_path` (t.ex. bilagelagringens variant).
+    """
+    encode = encode or encoded_path
+    prepared = []
+    for attachment in attachments or []:
+        try:
+            path = Path(attachment["path"])
+            ctype, encoding = mimetypes.guess_type(path)
+            if ctype is None or encoding is not None:
+                ctype = "application/octet-stream"
+            part = EmailMessage(policy=SMTP_POLICY)
+            part["Content-Type"] = ctype
+            part["Content-Transfer-Encoding"] = "base64"
+            part.add_header("Content-Disposition", "attachment", filename=attachment.get("filename") or path.name)
+            prepared.append((_header_bytes(part), encode(path)))
+        except Exception as e:
+            LOGGER.error(f"Kunde inte bifoga fil {attachment.get('path')}: {e}")
+    return prepared
+
+
+def iter_message(sender, recipients, subject, html_body, prepared):
+    """Generera meddelandet i bitar; bilagorna läses från disk under tiden.
+
+    Alla kroppar är base64, så ingen rad börjar med "." och SMTP-punktfyllning
+    behövs inte.
+    """
+    boundary = f"=_mail_agent_{uuid.uuid4().hex}".encode()
+
+    head = EmailMessage(policy=SMTP_POLICY)
+    head["From"] = sender
+    head["To"] = ", ".join(recipients)
+    head["Subject"] = subject
+    head["MIME-Version"] = "1.0"
+    head["Content-Type"] = f'multipart/mixed; boundary="{boundary.decode()}"'
+    yield _header_bytes(head)
+
+    html = EmailMessage(policy=SMTP_POLICY)
+    html["Content-Type"] = 'text/html; charset="utf-8"'
+    html["Content-Transfer-Encoding"] = "base64"
+    yield b"--" + boundary + CRLF + _header_bytes(html)
+    yield base64.encodebytes(html_body.encode("utf-8")).replace(b"\n", CRLF)
+
+    for part_header, encoded in prepared:
+        yield b"--" + boundary + CRLF + part_header
+        with open(encoded, "rb") as f:
+            while chunk := f.read(MIME_STREAM_CHUNK):
+                yield chunk
+
+    yield b"--" + boundary + b"--" + CRLF
+
+
+def _header_bytes(msg):
+    """Bara huvudet (vikt enligt SMTP-policyn) följt av en tomrad."""
+    return b"".join(SMTP_POLICY.fold_binary(name, value) for name, value in msg.items()) + CRLF
+
+
+def send_streamed(conn, from_addr, recipients, chunks):
+    """Skicka ett meddelande med MAIL/RCPT/DATA utan att bygga det i minnet.
+
+    Returnerar avvisade mottagare som smtplib.sendmail gör.
+    """
+    conn.ehlo_or_helo_if_needed()
+    code, resp = conn.mail(from_addr)
+    if code != 250:
+        conn.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+    refused = {}
+    for recipient in recipients:
+        code, resp = conn.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, resp)
+    if len(refused) == len(recipients):
+        conn.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    conn.putcmd("data")
+    code, resp = conn.getreply()
+    if code != 354:
+        conn.rset()
+        raise smtplib.SMTPDataError(code, resp)
+
+    for chunk in chunks:
+        conn.send(chunk)
+    conn.send(b"." + CRLF)
+    code, resp = conn.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
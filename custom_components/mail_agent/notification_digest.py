@@ -0,0 +1,120 @@
+# Fil: custom_components/mail_agent/notification_digest.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Samlar notiser under ett tidsfönster och skickar dem som en sammanfattning."""
+
+import threading
+import time
+
+from .const import DOMAIN, LOGGER
+
+
+def digest_storage_key(entry_id):
+    return f"{DOMAIN}.{entry_id}.digest"
+
+
+class NotificationDigest:
+    """Buffrar notiser och levererar dem samlat.
+
+    Första notisen startar fönstret. När det löper ut, eller när antalet
+    events eller bilagornas storlek når taket, levereras allt som en enda
+    omgång via `deliver(entries)`. Med en `store` sparas bufferten direkt
+    vid varje ny notis och tas upp igen efter en omstart. `pin(paths)` får
+    bufferns alla bilagor varje gång den ändras.
+    """
+
+    def __init__(self, window, max_events, max_bytes, deliver, store=None, pin=None):
+        self.window = window
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self._deliver = deliver
+        self._store = store
+        self._pin = pin
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        self._entries = []
+        self._events = 0
+        self._bytes = 0
+        self._started = None
+        self._timer = None
+
+    async def async_load(self):
+        """Ta upp notiser som låg i bufferten vid förra avslutet."""
+        if self._store is None:
+            return
+        data = await self._store.async_load()
+        entries = data.get("entries") or []
+        if self._pin is not None:
+            self._pin([a["path"] for entry in entries for a in entry["attachments"]])
+        if not entries:
+            return
+        with self._lock:
+            self._entries = list(entries)
+            self._events = sum(len(entry["events"]) for entry in entries)
+            self._bytes = sum(a.get("size", 0) for entry in entries for a in entry["attachments"])
+            self._started = data.get("started") or time.time()
+            # Fönstret fortsätter där det var; har det redan gått ut skickas allt direkt
+            self._start_timer(max(0.0, self._started + self.window - time.time()))
+        LOGGER.info("Återställde %s notiser i väntande sammanfattning.", len(entries))
+
+    def add(self, entry):
+        """Lägg till en notis: {"subject", "events", "attachments": [{path, filename, size}]}.
+
+        Returnerar först när notisen är sparad (om en store används).
+        """
+        with self._lock:
+            self._entries.append(entry)
+            self._events += len(entry["events"])
+            self._bytes += sum(a.get("size", 0) for a in entry["attachments"])
+            if self._events >= self.max_events or self._bytes >= self.max_bytes:
+                entries = self._take()
+            else:
+                entries = None
+                if self._timer is None:
+                    self._started = time.time()
+                    self._start_timer(self.window)
+        if entries:
+            self._safe_deliver(entries)
+        self._persist()
+
+    def flush(self):
+        """Leverera det som ligger i bufferten nu (vid fönstrets slut och vid unload)."""
+        with self._lock:
+            entries = self._take()
+        if entries:
+            self._safe_deliver(entries)
+            self._persist()
+
+    def _start_timer(self, delay):
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _take(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        entries = self._entries
+        self._entries = []
+        self._events = 0
+        self._bytes = 0
+        self._started = None
+        return entries
+
+    def _persist(self):
+        """Spara bufferten direkt. Levererade notiser tas bort först efter leveransen."""
+        # Seriellt, så att en äldre ögonblicksbild aldrig skriver över en nyare
+        with self._persist_lock:
+            with self._lock:
+                data = {"entries": list(self._entries), "started": self._started}
+            if self._pin is not None:
+                self._pin([a["path"] for entry in data["entries"] for a in entry["attachments"]])
+            if self._store is None:
+                return
+            with self._store.lock:
+                self._store.data = data
+            self._store.save()
+
+    def _safe_deliver(self, entries):
+        try:
+            self._deliver(entries)
+        except Exception as e:
+            LOGGER.error("Kunde inte skicka sammanfattade notiser: %s", e)
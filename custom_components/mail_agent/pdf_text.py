@@ -0,0 +1,53 @@
+# Fil: custom_components/mail_agent/pdf_text.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Lokal utläsning av textlagret i PDF-bilagor."""
+
+from functools import lru_cache
+
+from .const import LOGGER, PDF_MIN_CHARS_PER_PAGE, PDF_TEXT_MAX_CHARS
+
+_pypdf_missing = False
+
+
+def extract_pdf_text(path, file_hash, max_pages):
+    """Läs textlagret från de första `max_pages` sidorna.
+
+    Returnerar texten, eller None om PDF:en saknar användbart textlager
+    (inskannad/bild) eller inte kan läsas. Då ska filen laddas upp i stället.
+    """
+    return _extract_cached(str(path), file_hash, max_pages)
+
+
+@lru_cache(maxsize=32)
+def _extract_cached(path, file_hash, max_pages):
+    global _pypdf_missing
+    if _pypdf_missing:
+        return None
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        _pypdf_missing = True
+        LOGGER.warning("pypdf saknas, PDF-bilagor laddas upp till Gemini i stället.")
+        return None
+
+    try:
+        reader = PdfReader(path)
+        if reader.is_encrypted and not reader.decrypt(""):
+            return None
+        total_pages = len(reader.pages)
+        pages = min(total_pages, max_pages)
+        texts = []
+        for index in range(pages):
+            texts.append((reader.pages[index].extract_text() or "").strip())
+    except Exception as e:
+        LOGGER.debug("Kunde inte läsa text ur %s: %s", path, e)
+        return None
+
+    text = "\n\n".join(t for t in texts if t)
+    # Nästan ingen text per sida tyder på en inskannad PDF
+    if pages == 0 or len(text) < PDF_MIN_CHARS_PER_PAGE * pages:
+        return None
+
+    text = text[:PDF_TEXT_MAX_CHARS]
+    if total_pages > pages:
+        text += f"\n\n[Endast de första {pages} av {total_pages} sidorna]"
+    return text
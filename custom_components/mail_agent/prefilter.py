@@ -0,0 +1,103 @@
+# Fil: custom_components/mail_agent/prefilter.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Snabb lokal förfiltrering av mail innan AI-analys."""
+
+import re
+from email.utils import parseaddr
+
+from .const import PREFILTER_SCAN_CHARS
+
+# (mönster, poäng i ämnet, poäng i texten). Texten gemenas innan matchning.
+_KEYWORDS = [
+    (re.compile(r"\b(?:kallelse|kallas\b|kallad\b)"), 4, 3),
+    (re.compile(r"\b(?:bokning|bokad\b|bokat\b|ombokning|avbokning)"), 3, 2),
+    (re.compile(r"\b(?:(?:din|er|ny|bokad|reserverad) tid\b|tid hos\b|tidsbokning)"), 3, 2),
+    (re.compile(r"\b(?:möte\b|mötesinbjudan|inbjudan\b|besök\b|samtal\b)"), 2, 1),
+    (re.compile(r"\b(?:tandläkare|vårdcentral|läkare|mottagning|frisör|besiktning)"), 1, 1),
+    (re.compile(r"\b(?:appointment|booking|invitation|meeting)\b"), 2, 1),
+]
+DATE_PATTERN = re.compile(
+    r"\b(?:\d{4}-\d{2}-\d{2}\b|\d{1,2}/\d{1,2}\b|"
+    r"\d{1,2}(?::e)? (?:jan|feb|mar|apr|maj|jun|jul|aug|sep|okt|nov|dec)|"
+    r"(?:mån|tis|ons|tors|fre|lör|sön)dag)"
+)
+TIME_PATTERN = re.compile(r"\b\d{1,2}[:.]\d{2}\b")
+_BULK_PRECEDENCE = {"bulk", "list", "junk"}
+
+SCORE_DATE = 1
+SCORE_TIME = 1
+SCORE_PDF = 2
+SCORE_LIST_UNSUBSCRIBE = -3
+SCORE_BULK = -3
+SCORE_AUTO_SUBMITTED = -1
+
+
+def parse_sender_list(value):
+    """Kommaseparerad lista med adresser eller domäner till en mängd."""
+    return {item.strip().lower().lstrip("@") for item in (value or "").split(",") if item.strip()}
+
+
+def _sender_matches(address, patterns):
+    if not address or not patterns:
+        return False
+    if address in patterns:
+        return True
+    domain = address.rpartition("@")[2]
+    # Domänen matchar även underdomäner (skola.stad.se matchar stad.se)
+    parts = domain.split(".")
+    return any(".".join(parts[i:]) in patterns for i in range(len(parts) - 1))
+
+
+class MailPrefilter:
+    """Avgör lokalt om ett mail är värt en AI-analys.
+
+    Tillåtna avsändare analyseras alltid och nekade aldrig. Övriga får en
+    poäng av bokningsord, datum/tider, PDF-bilagor och huvuden som tyder på
+    massutskick. Med tröskeln 0 analyseras allt som inte är nekat.
+    """
+
+    def __init__(self, allow_senders, deny_senders, threshold):
+        self.allow = parse_sender_list(allow_senders)
+        self.deny = parse_sender_list(deny_senders)
+        self.threshold = threshold
+
+    def classify(self, headers, subject, body, has_pdf):
+        """Returnera (analysera, poäng, orsak)."""
+        address = parseaddr(headers.get("From", ""))[1].lower()
+        if _sender_matches(address, self.allow):
+            return True, None, "tillåten avsändare"
+        if _sender_matches(address, self.deny):
+            return False, None, "nekad avsändare"
+        if self.threshold <= 0:
+            return True, None, "filter avstängt"
+
+        score = self.score(headers, subject, body, has_pdf)
+        if score >= self.threshold:
+            return True, score, "poäng över tröskeln"
+        return False, score, "poäng under tröskeln"
+
+    @staticmethod
+    def score(headers, subject, body, has_pdf):
+        subject = (subject or "").lower()
+        text = (body or "")[:PREFILTER_SCAN_CHARS].lower()
+
+        score = 0
+        for pattern, subject_points, body_points in _KEYWORDS:
+            if pattern.search(subject):
+                score += subject_points
+            elif pattern.search(text):
+                score += body_points
+        if DATE_PATTERN.search(subject) or DATE_PATTERN.search(text):
+            score += SCORE_DATE
+        if TIME_PATTERN.search(subject) or TIME_PATTERN.search(text):
+            score += SCORE_TIME
+        if has_pdf:
+            score += SCORE_PDF
+
+        if headers.get("List-Unsubscribe") or headers.get("List-Id"):
+            score += SCORE_LIST_UNSUBSCRIBE
+        if (headers.get("Precedence") or "").strip().lower() in _BULK_PRECEDENCE:
+            score += SCORE_BULK
+        auto = (headers.get("Auto-Submitted") or "").strip().lower()
+        if auto and auto != "no":
+            score += SCORE_AUTO_SUBMITTED
+        return score
@@ -0,0 +1,161 @@
+# Fil: custom_components/mail_agent/rate_limiter.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Gemensam hastighetsbegränsning och omförsök för Gemini-anrop."""
+
+import hashlib
+import random
+import re
+import threading
+import time
+
+import httpx
+from google.genai import errors as genai_errors
+
+from .const import (
+    DOMAIN,
+    LOGGER,
+    DATA_RATE_LIMITERS,
+    GEMINI_MAX_ATTEMPTS,
+    GEMINI_BACKOFF_BASE,
+    GEMINI_BACKOFF_MAX,
+)
+
+_RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+# Nätverksfel utan HTTP-status. google-genai går via httpx, vars fel inte
+# ärver från de inbyggda ConnectionError/TimeoutError.
+_TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    httpx.TransportError,
+    httpx.TimeoutException,
+    genai_errors.ServerError,
+)
+_RETRY_DELAY = re.compile(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s")
+
+
+class AiRetryableError(Exception):
+    """AI-anropet misslyckades tillfälligt; mailet ska försökas igen senare."""
+
+
+def get_rate_limiter(hass, api_key, rpm, tpm):
+    """Hämta begränsaren för en API-nyckel (delas av alla konton med samma nyckel)."""
+    limiters = hass.data.setdefault(DOMAIN, {}).setdefault(DATA_RATE_LIMITERS, {})
+    key = hashlib.sha256((api_key or "").encode()).hexdigest()
+    limiter = limiters.get(key)
+    if limiter is None:
+        limiter = limiters[key] = GeminiRateLimiter(rpm, tpm)
+    else:
+        limiter.set_limits(rpm, tpm)
+    return limiter
+
+
+class TokenBucket:
+    """Klassisk token bucket. Kan gå minus för att reservera framtida kapacitet."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Sekunder tills `amount` finns (0 om det finns nu)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= amount
+
+
+class GeminiRateLimiter:
+    """Begränsar anrop per minut och tokens per minut, och gör omförsök.
+
+    Omförsök sker med exponentiell backoff med jitter. Om servern anger
+    Retry-After/retryDelay pausas alla anrop mot samma nyckel så länge.
+    """
+
+    def __init__(self, rpm, tpm):
+        self._lock = threading.Lock()
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._paused_until = 0.0
+
+    def set_limits(self, rpm, tpm):
+        with self._lock:
+            if self._requests.capacity != rpm:
+                self._requests = TokenBucket(rpm)
+            if self._tokens.capacity != tpm:
+                self._tokens = TokenBucket(tpm)
+
+    def acquire(self, tokens):
+        """Blockera tills ett anrop med uppskattningsvis `tokens` tokens får göras."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = max(
+                    self._paused_until - now,
+                    self._requests.wait_time(1, now),
+                    self._tokens.wait_time(tokens, now),
+                )
+                if wait <= 0:
+                    self._requests.take(1)
+                    self._tokens.take(tokens)
+                    return
+            time.sleep(wait)
+
+    def adjust_tokens(self, delta):
+        """Rätta token-budgeten när den faktiska förbrukningen är känd."""
+        with self._lock:
+            self._tokens.take(delta)
+
+    def call(self, func, estimated_tokens, *args):
+        """Kör `func(*args)` inom budgeten, med omförsök vid tillfälliga fel."""
+        for attempt in range(1, GEMINI_MAX_ATTEMPTS + 1):
+            self.acquire(estimated_tokens)
+            try:
+                return func(*args)
+            except Exception as e:
+                if not _is_retryable(e):
+                    raise
+                retry_after = _retry_after(e)
+                delay = retry_after if retry_after is not None else random.uniform(
+                    0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** (attempt - 1))
+                )
+                if retry_after is not None:
+                    with self._lock:
+                        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                if attempt == GEMINI_MAX_ATTEMPTS:
+                    raise AiRetryableError(str(e)) from e
+                LOGGER.warning(
+                    "Gemini-fel (försök %s av %s), väntar %.1f s: %s",
+                    attempt, GEMINI_MAX_ATTEMPTS, delay, e,
+                )
+                time.sleep(delay)
+        raise AiRetryableError("Inga försök kvar")
+
+
+def _is_retryable(exc):
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if isinstance(code, int):
+        return code in _RETRYABLE_CODES
+    return isinstance(exc, _TRANSIENT_ERRORS)
+
+
+def _retry_after(exc):
+    """Läs Retry-After-huvudet eller RetryInfo.retryDelay ur felet, om det finns."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+    match = _RETRY_DELAY.search(str(getattr(exc, "details", "") or exc))
+    return float(match.group(1)) if match else None
@@ -0,0 +1,116 @@
+# Fil: custom_components/mail_agent/scheduler.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Gemensam schemaläggare för sökningar i alla konton."""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_track_time_interval
+
+from .const import (
+    DOMAIN,
+    LOGGER,
+    DATA_SCHEDULER,
+    SCHEDULER_WORKERS,
+    SCHEDULER_TICK,
+)
+
+
+@callback
+def async_get_scheduler(hass):
+    """Hämta (och vid behov skapa) den gemensamma schemaläggaren."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    scheduler = domain_data.get(DATA_SCHEDULER)
+    if scheduler is None:
+        scheduler = domain_data[DATA_SCHEDULER] = ScanScheduler(hass)
+    return scheduler
+
+
+class ScanScheduler:
+    """En timer och en begränsad trådpool för alla konton.
+
+    Konton med polling fördelas jämnt över intervallet i stället för att
+    starta samtidigt. Alla sökningar (även från IDLE) körs i den egna
+    poolen så att HA:s gemensamma executor inte belastas.
+    """
+
+    def __init__(self, hass):
+        self.hass = hass
+        self._pool = ThreadPoolExecutor(max_workers=SCHEDULER_WORKERS, thread_name_prefix="mail_agent_scan")
+        # entry_id -> {"interval", "next_run", "action"}
+        self._accounts = {}
+        self._depth = {}
+        self._remove_tick = None
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, self._async_shutdown)
+
+    def queue_depth(self, entry_id):
+        """Antal sökningar för kontot som väntar i eller körs i poolen."""
+        return self._depth.get(entry_id, 0)
+
+    @callback
+    def async_register(self, entry_id, interval, action):
+        """Kör `action()` (en coroutine-funktion) var `interval` sekund."""
+        self._accounts[entry_id] = {"interval": interval, "next_run": 0.0, "action": action}
+        self._restagger()
+        if self._remove_tick is None:
+            self._remove_tick = async_track_time_interval(
+                self.hass, self._async_tick, timedelta(seconds=SCHEDULER_TICK)
+            )
+
+    @callback
+    def async_unregister(self, entry_id):
+        if self._accounts.pop(entry_id, None) is None:
+            return
+        if not self._accounts and self._remove_tick is not None:
+            self._remove_tick()
+            self._remove_tick = None
+
+    @callback
+    def async_set_interval(self, entry_id, interval):
+        """Byt intervall för ett konto; nästa körning räknas från nu."""
+        account = self._accounts.get(entry_id)
+        if account is None:
+            return
+        account["interval"] = interval
+        account["next_run"] = time.monotonic() + interval
+
+    async def async_run(self, entry_id, func, on_change=None):
+        """Kör `func` i poolen och räkna kontots ködjup under tiden."""
+        self._change_depth(entry_id, 1, on_change)
+        try:
+            return await asyncio.wrap_future(self._pool.submit(func))
+        finally:
+            self._change_depth(entry_id, -1, on_change)
+
+    def _change_depth(self, entry_id, delta, on_change):
+        self._depth[entry_id] = max(0, self._depth.get(entry_id, 0) + delta)
+        if on_change is not None:
+            on_change()
+
+    def _restagger(self):
+        """Sprid kontonas nästa körning jämnt över det kortaste intervallet."""
+        now = time.monotonic()
+        step = min(a["interval"] for a in self._accounts.values()) / len(self._accounts)
+        for index, account in enumerate(self._accounts.values(), start=1):
+            account["next_run"] = now + step * index
+
+    @callback
+    def _async_tick(self, _now=None):
+        now = time.monotonic()
+        for entry_id, account in self._accounts.items():
+            if account["next_run"] > now:
+                continue
+            # Behåll fasen så att kontona förblir utspridda
+            account["next_run"] = max(account["next_run"] + account["interval"], now)
+            self.hass.async_create_task(account["action"](), f"{DOMAIN} scan {entry_id}")
+
+    @callback
+    def _async_shutdown(self, _event):
+        LOGGER.debug("Stänger söktrådarna.")
+        if self._remove_tick is not None:
+            self._remove_tick()
+            self._remove_tick = None
+        self._pool.shutdown(wait=False, cancel_futures=True)
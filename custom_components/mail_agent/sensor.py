@@ -8,6 +8,7 @@ from homeassistant.components.sensor import (
 from homeassistant.helpers.restore_state import RestoreEntity
 from homeassistant.core import callback
 from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.const import UnitOfTime
 from homeassistant.util import dt as dt_util
 from .const import DOMAIN, SIGNAL_MAIL_AGENT_UPDATE
 
@@ -20,6 +21,8 @@ async def async_setup_entry(hass, entry, async_add_entities):
         MailAgentLastScanSensor(scanner, entry),
         MailAgentProcessedSensor(scanner, entry),
         MailAgentLastEventSensor(scanner, entry),
+        MailAgentQueueDepthSensor(scanner, entry),
+        MailAgentIntervalSensor(scanner, entry),
     ]
     async_add_entities(entities)
 
@@ -32,6 +35,7 @@ class MailAgentBaseSensor(SensorEntity):
     def __init__(self, scanner, entry):
         self._scanner = scanner
         self._entry = entry
+        self._last_written = None
         self._attr_device_info = {
             "identifiers": {(DOMAIN, entry.entry_id)},
             "name": entry.title,
@@ -50,6 +54,11 @@ class MailAgentBaseSensor(SensorEntity):
 
     @callback
     def _update_callback(self):
+        # Skriv bara när värdet (eller attributen) faktiskt har ändrats
+        snapshot = (self.native_value, self.extra_state_attributes)
+        if snapshot == self._last_written:
+            return
+        self._last_written = snapshot
         self.async_write_ha_state()
 
 
@@ -96,6 +105,16 @@ class MailAgentProcessedSensor(MailAgentBaseSensor, RestoreEntity):
     def native_value(self):
         return self._scanner.emails_processed_count
 
+    @property
+    def extra_state_attributes(self):
+        counts = self._scanner.prefilter_counts
+        return {
+            "prefilter_skipped": counts["skipped"],
+            "prefilter_analyzed": counts["analyzed"],
+            "duplicates_skipped": counts["duplicates"],
+            "prompt_tokens_saved": self._scanner.processor.tokens_saved,
+        }
+
     async def async_added_to_hass(self):
         """Återställ senaste värde vid omstart."""
         await super().async_added_to_hass()
@@ -106,6 +125,14 @@ class MailAgentProcessedSensor(MailAgentBaseSensor, RestoreEntity):
                 self._scanner.restore_email_count(val)
             except ValueError:
                 pass
+            try:
+                self._scanner.restore_prefilter_counts(
+                    int(last_state.attributes.get("prefilter_skipped", 0)),
+                    int(last_state.attributes.get("prefilter_analyzed", 0)),
+                    int(last_state.attributes.get("duplicates_skipped", 0)),
+                )
+            except (TypeError, ValueError):
+                pass
 
 
 class MailAgentLastEventSensor(MailAgentBaseSensor, RestoreEntity):
@@ -127,4 +154,37 @@ class MailAgentLastEventSensor(MailAgentBaseSensor, RestoreEntity):
         await super().async_added_to_hass()
         last_state = await self.async_get_last_state()
         if last_state and last_state.state not in ("unknown", "unavailable"):
-            self._scanner.restore_last_event(last_state.state)
\ No newline at end of file
+            self._scanner.restore_last_event(last_state.state)
+
+
+class MailAgentQueueDepthSensor(MailAgentBaseSensor):
+    """Antal sökningar för kontot som väntar i eller körs i den gemensamma poolen."""
+
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_name = "Scan Queue"
+    _attr_icon = "mdi:tray-full"
+
+    @property
+    def unique_id(self):
+        return f"{self._entry.entry_id}_scan_queue"
+
+    @property
+    def native_value(self):
+        return self._scanner.queue_depth
+
+
+class MailAgentIntervalSensor(MailAgentBaseSensor):
+    """Aktuellt sökintervall (ändras i adaptivt läge, okänt vid IDLE)."""
+
+    _attr_device_class = SensorDeviceClass.DURATION
+    _attr_native_unit_of_measurement = UnitOfTime.SECONDS
+    _attr_name = "Scan Interval"
+    _attr_icon = "mdi:timer-sync-outline"
+
+    @property
+    def unique_id(self):
+        return f"{self._entry.entry_id}_scan_interval"
+
+    @property
+    def native_value(self):
+        return self._scanner.current_interval
@@ -0,0 +1,221 @@
+# Fil: custom_components/mail_agent/smtp_outbox.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Utkorg för SMTP: kö som överlever omstart, egen arbetstråd och omförsök."""
+
+import smtplib
+import threading
+import time
+import uuid
+from email.utils import formataddr
+
+from .const import (
+    DOMAIN,
+    LOGGER,
+    SMTP_TIMEOUT,
+    SMTP_IDLE_TIMEOUT,
+    SMTP_BACKOFF_BASE,
+    SMTP_BACKOFF_MAX,
+    SMTP_MAX_ATTEMPTS,
+)
+from .attachment_store import async_get_attachment_store
+from .mime_stream import iter_message, prepare_attachments, send_streamed
+from .storage import MailAgentStore
+
+# Fel där ett nytt försök inte hjälper
+_PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
+
+
+def outbox_storage_key(entry_id):
+    return f"{DOMAIN}.{entry_id}.outbox"
+
+
+class SmtpOutbox:
+    """Skickar mail från en egen tråd så att sökningen bara behöver lägga i kö.
+
+    Kön sparas i .storage. En inloggad SMTP-anslutning återanvänds mellan
+    mail och stängs efter SMTP_IDLE_TIMEOUT utan trafik. Misslyckade mail
+    försöks igen med exponentiell backoff.
+    """
+
+    def __init__(self, hass, entry_id, server, port, user, password, sender_name, enable_debug=False):
+        self.hass = hass
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.sender = formataddr((sender_name, user))
+        self.enable_debug = enable_debug
+
+        self._store = MailAgentStore(hass, outbox_storage_key(entry_id), {"queue": []})
+        # Bilagor i kön fästs så att lagringen inte gallrar dem före sändning
+        self._attachments = None
+        self._pin_prefix = f"outbox:{entry_id}:"
+        self._wakeup = threading.Condition(self._store.lock)
+        self._stopping = False
+        self._thread = None
+        self._thread_name = f"mail_agent_smtp_{entry_id[:8]}"
+
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        self._last_used = 0.0
+
+    async def async_load(self):
+        await self._store.async_load()
+        self._attachments = await async_get_attachment_store(self.hass)
+        with self._store.lock:
+            owners = {
+                self._pin_prefix + item["id"]: [a["path"] for a in item["attachments"]]
+                for item in self._store.data["queue"]
+            }
+        self._attachments.reset_pins(self._pin_prefix, owners)
+
+    def start(self):
+        if self._thread is not None or not self.server:
+            return
+        self._thread = threading.Thread(target=self._run, name=self._thread_name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stoppa arbetstråden och logga ut (anropas i executor vid unload)."""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        if self._thread is not None:
+            self._thread.join(SMTP_TIMEOUT)
+        self._disconnect()
+
+    def enqueue(self, recipients, subject, html_body, attachments=None):
+        """Lägg ett mail i kön. Trådsäkert och returnerar direkt."""
+        item = {
+            "id": uuid.uuid4().hex,
+            "recipients": list(recipients),
+            "subject": subject,
+            "html": html_body,
+            "attachments": [dict(a) for a in attachments or []],
+            "attempts": 0,
+            "next_attempt": 0.0,
+        }
+        if self._attachments is not None:
+            self._attachments.pin(self._pin_prefix + item["id"], [a["path"] for a in item["attachments"]])
+        with self._wakeup:
+            self._store.data["queue"].append(item)
+            self._wakeup.notify()
+        # Sparas direkt: journalen räknar mailet som notifierat när detta returnerar
+        self._store.save()
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if self._stopping:
+                    return
+                item, wait = self._next_due()
+                if item is None:
+                    # Stäng en ledig anslutning när den inte längre behövs
+                    if self._conn is not None:
+                        idle_left = self._last_used + SMTP_IDLE_TIMEOUT - time.monotonic()
+                        if idle_left <= 0:
+                            self._disconnect()
+                        else:
+                            wait = idle_left if wait is None else min(wait, idle_left)
+                    self._wakeup.wait(wait)
+                    continue
+            self._deliver(item)
+
+    def _next_due(self):
+        """Första mail vars väntetid har gått ut, annars (None, sekunder till nästa)."""
+        now = time.time()
+        wait = None
+        for item in self._store.data["queue"]:
+            if item["next_attempt"] <= now:
+                return item, None
+            delay = item["next_attempt"] - now
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _deliver(self, item):
+        try:
+            self._send(item)
+        except Exception as e:
+            self._failed(item, e)
+            return
+
+        with self._store.lock:
+            self._remove(item)
+        self._store.schedule_save()
+        if self.enable_debug:
+            LOGGER.info("SMTP mail skickat framgångsrikt: %s", item["subject"])
+
+    def _failed(self, item, error):
+        with self._store.lock:
+            item["attempts"] += 1
+            if isinstance(error, _PERMANENT_ERRORS) or item["attempts"] >= SMTP_MAX_ATTEMPTS:
+                LOGGER.error(
+                    "Kunde inte skicka SMTP-mail '%s' efter %s försök: %s", item["subject"], item["attempts"], error
+                )
+                self._remove(item)
+            else:
+                delay = min(SMTP_BACKOFF_MAX, SMTP_BACKOFF_BASE * 2 ** (item["attempts"] - 1))
+                item["next_attempt"] = time.time() + delay
+                LOGGER.warning(
+                    "SMTP-fel för '%s', nytt försök om %s s: %s", item["subject"], delay, error
+                )
+        self._store.schedule_save()
+
+    def _remove(self, item):
+        if self._attachments is not None:
+            self._attachments.unpin(self._pin_prefix + item["id"])
+        queue = self._store.data["queue"]
+        self._store.data["queue"] = [i for i in queue if i["id"] != item["id"]]
+
+    def _send(self, item):
+        # Bilagorna kodas (eller hämtas kodade) innan anslutningen används
+        prepared = prepare_attachments(
+            item["attachments"], self._attachments.encoded_path if self._attachments is not None else None
+        )
+        with self._conn_lock:
+            try:
+                conn = self._connection()
+                chunks = iter_message(self.sender, item["recipients"], item["subject"], item["html"], prepared)
+                send_streamed(conn, self.user, item["recipients"], chunks)
+            except Exception:
+                self._close_connection()
+                raise
+            self._last_used = time.monotonic()
+
+    def _connection(self):
+        """Återanvänd den inloggade anslutningen om den lever, annars koppla upp."""
+        if self._conn is not None:
+            try:
+                if self._conn.noop()[0] == 250:
+                    return self._conn
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._close_connection()
+
+        if self.port == 465:
+            conn = smtplib.SMTP_SSL(self.server, self.port, timeout=SMTP_TIMEOUT)
+        else:
+            conn = smtplib.SMTP(self.server, self.port, timeout=SMTP_TIMEOUT)
+            conn.starttls()
+        try:
+            conn.login(self.user, self.password)
+        except Exception:
+            conn.close()
+            raise
+        self._conn = conn
+        return conn
+
+    def _disconnect(self):
+        with self._conn_lock:
+            self._close_connection()
+
+    def _close_connection(self):
+        conn = self._conn
+        self._conn = None
+        if conn is None:
+            return
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
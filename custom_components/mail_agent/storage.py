@@ -0,0 +1,59 @@
+# Fil: custom_components/mail_agent/storage.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Persistent lagring i Home Assistants .storage för Mail Agent."""
+
+import asyncio
+import copy
+import threading
+
+from homeassistant.core import callback
+from homeassistant.helpers.storage import Store
+
+from .const import LOGGER, STORAGE_VERSION, STORAGE_SAVE_DELAY, STORAGE_SAVE_TIMEOUT
+
+
+class MailAgentStore:
+    """Tunt lager ovanpå HA:s Store som kan ändras och sparas från executor-trådar.
+
+    All ändring av `data` ska ske under `lock`. Sparning sker fördröjt i
+    event-loopen, så täta uppdateringar slås ihop till en skrivning.
+    """
+
+    def __init__(self, hass, key, default=None, delay=STORAGE_SAVE_DELAY):
+        self.hass = hass
+        self.lock = threading.RLock()
+        self.data = default if default is not None else {}
+        self._delay = delay
+        self._store = Store(hass, STORAGE_VERSION, key)
+
+    async def async_load(self):
+        """Läs in sparad data (anropas en gång vid setup)."""
+        stored = await self._store.async_load()
+        if stored is not None:
+            with self.lock:
+                self.data = stored
+        return self.data
+
+    def schedule_save(self):
+        """Begär en fördröjd sparning. Trådsäker."""
+        self.hass.loop.call_soon_threadsafe(self.async_schedule_save)
+
+    def save(self):
+        """Spara direkt och vänta tills datan ligger på disk. Får inte anropas från event-loopen."""
+        future = asyncio.run_coroutine_threadsafe(self._store.async_save(self._data_to_save()), self.hass.loop)
+        try:
+            future.result(STORAGE_SAVE_TIMEOUT)
+        except Exception as e:
+            LOGGER.warning("Kunde inte spara %s direkt, sparar fördröjt: %s", self._store.key, e)
+            self.schedule_save()
+
+    @callback
+    def async_schedule_save(self):
+        self._store.async_delay_save(self._data_to_save, self._delay)
+
+    async def async_remove(self):
+        await self._store.async_remove()
+
+    def _data_to_save(self):
+        # Kopia så att serialiseringen inte krockar med skrivande trådar
+        with self.lock:
+            return copy.deepcopy(self.data)
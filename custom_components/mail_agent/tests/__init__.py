@@ -0,0 +1 @@
+"""Tester för Mail Agent."""
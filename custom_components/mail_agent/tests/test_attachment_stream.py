@@ -0,0 +1,74 @@
+# Fil: custom_components/mail_agent/tests/test_attachment_stream.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Tester för den strömmande avkodningen av bilagor."""
+
+import base64
+import io
+import quopri
+from email.message import EmailMessage
+
+import pytest
+
+from custom_components.mail_agent.attachment_stream import (
+    StreamingDecoder,
+    parse_part_header,
+    write_part_payload,
+)
+
+PAYLOAD = bytes(range(256)) * 40 + b"%PDF-slut"
+
+
+def _decode(encoding, encoded, chunk_size):
+    out = io.BytesIO()
+    decoder = StreamingDecoder(out, encoding)
+    for start in range(0, len(encoded), chunk_size):
+        decoder.write(encoded[start:start + chunk_size])
+    decoder.close()
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 77, 1000, 100000])
+def test_base64_in_arbitrary_chunks(chunk_size):
+    # Radbrytningar (CRLF) och grupper på fyra tecken hamnar mitt i bitarna
+    encoded = base64.encodebytes(PAYLOAD).replace(b"\n", b"\r\n")
+    assert _decode("base64", encoded, chunk_size) == PAYLOAD
+
+
+def test_base64_missing_padding():
+    encoded = base64.b64encode(b"abcde").rstrip(b"=")
+    assert _decode("BASE64 ", encoded, 3) == b"abcde"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 76, 100000])
+def test_quoted_printable_soft_breaks_across_chunks(chunk_size):
+    text = ("Tid: måndag 3 maj kl. 08.30 = välkommen! " * 20).encode("utf-8")
+    encoded = quopri.encodestring(text).replace(b"\n", b"\r\n")
+    assert b"=\r\n" in encoded
+    assert _decode("quoted-printable", encoded, chunk_size) == text
+
+
+@pytest.mark.parametrize("encoding", [None, "7bit", "8bit", "binary"])
+def test_passthrough(encoding):
+    assert _decode(encoding, PAYLOAD, 100) == PAYLOAD
+
+
+def test_parse_part_header():
+    part = parse_part_header(
+        b"Content-Type: application/pdf\r\n"
+        b"Content-Transfer-Encoding: base64\r\n"
+        b"Content-Disposition: attachment; filename*=utf-8''Kallelse_tandl%C3%A4kare.pdf\r\n\r\n"
+    )
+    assert part.get_content_type() == "application/pdf"
+    assert part["Content-Transfer-Encoding"] == "base64"
+    assert part.get_filename() == "Kallelse_tandläkare.pdf"
+
+
+@pytest.mark.parametrize("cte", ["base64", "quoted-printable", "7bit"])
+def test_write_part_payload(cte):
+    data = PAYLOAD if cte != "7bit" else b"bara text\n"
+    part = EmailMessage()
+    part.set_content(data, maintype="application", subtype="pdf", cte=cte)
+    parsed = parse_part_header(part.as_bytes())
+
+    out = io.BytesIO()
+    write_part_payload(parsed, out)
+    assert out.getvalue() == parsed.get_payload(decode=True)
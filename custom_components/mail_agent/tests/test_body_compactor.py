@@ -0,0 +1,135 @@
+# Fil: custom_components/mail_agent/tests/test_body_compactor.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Tester för komprimeringen av mailtext och förfiltret."""
+
+import pytest
+
+from custom_components.mail_agent.body_compactor import compact_body, estimate_tokens
+from custom_components.mail_agent.prefilter import MailPrefilter, parse_sender_list
+
+OWN_TEXT = "Hej! Jag kan tyvärr inte komma på den tiden, går det att boka om?"
+
+
+def _lines(*lines):
+    return "\n".join(lines)
+
+
+def test_empty_body():
+    assert compact_body("", 100) == ("", 0)
+    assert compact_body(None, 100) == ("", 0)
+
+
+def test_strips_quoted_reply_and_signature():
+    body = _lines(
+        "Hej, din tid hos tandläkaren är bokad till tisdag 14.30.",
+        "Välkommen!",
+        "--",
+        "Folktandvården",
+        "Telefon 010-123 45 67",
+        "",
+        "Den 2 maj 2026 skrev Anna <anna@example.se>:",
+        "> Kan jag få en ny tid?",
+    )
+    text, saved = compact_body(body, 0)
+
+    assert text == "Hej, din tid hos tandläkaren är bokad till tisdag 14.30.\nVälkommen!"
+    assert saved > 0
+
+
+def test_strips_outlook_history():
+    body = _lines(
+        OWN_TEXT + " Tisdag 10.00 passar bra.",
+        "",
+        "Från: Mottagningen <info@vc.se>",
+        "Skickat: den 2 maj 2026 09:12",
+        "Ämne: Kallelse",
+        "Du är kallad till mottagningen.",
+    )
+    text, _ = compact_body(body, 0)
+    assert text == OWN_TEXT + " Tisdag 10.00 passar bra."
+
+
+def test_keeps_forwarded_content():
+    body = _lines(
+        "Se nedan.",
+        "---------- Forwarded message ---------",
+        "From: Skolan <info@skola.se>",
+        "Utvecklingssamtal 2026-05-12 kl. 15.00",
+    )
+    text, _ = compact_body(body, 0)
+    assert "Utvecklingssamtal 2026-05-12 kl. 15.00" in text
+    assert text.startswith("Se nedan.")
+
+
+def test_booking_only_in_history_is_kept():
+    # Svaret saknar egen tid; svarsraden med datum får inte räknas som bokningen
+    body = _lines(
+        OWN_TEXT,
+        "",
+        "Den 2 maj 2026 kl. 09:12 skrev Vårdcentralen <info@vc.se>:",
+        "> Du har en bokad tid torsdag 7 maj kl. 08.30.",
+    )
+    text, _ = compact_body(body, 0)
+    assert "torsdag 7 maj kl. 08.30" in text
+
+
+def test_own_datetime_drops_history():
+    body = _lines(
+        OWN_TEXT + " Fredag 13.00 fungerar.",
+        "Den 2 maj 2026 kl. 09:12 skrev Vårdcentralen <info@vc.se>:",
+        "> Du har en bokad tid torsdag 7 maj kl. 08.30.",
+    )
+    text, _ = compact_body(body, 0)
+    assert "08.30" not in text
+    assert "13.00" in text
+
+
+def test_collapses_whitespace_and_noise():
+    body = "Rad  ett\t med   blanksteg\n\n\n\n=====\n----\nRad två\n\n"
+    text, _ = compact_body(body, 0)
+    assert text == "Rad ett med blanksteg\n\nRad två"
+
+
+def test_budget_prioritizes_datetime_lines():
+    filler = [f"Allmän information nummer {i} om parkering och hitta hit." for i in range(40)]
+    body = "\n".join(filler[:20] + ["Din tid: 2026-05-12 kl. 15.00"] + filler[20:])
+    text, saved = compact_body(body, 40)
+
+    assert "Din tid: 2026-05-12 kl. 15.00" in text
+    assert "[...]" in text
+    assert estimate_tokens(text) <= 40
+    assert saved > 0
+
+
+def test_parse_sender_list():
+    assert parse_sender_list(" Info@VC.se, @skola.se,,") == {"info@vc.se", "skola.se"}
+
+
+@pytest.mark.parametrize(
+    ("sender", "subject", "body", "has_pdf", "analyze", "reason"),
+    [
+        ("info@vc.se", "Nyhetsbrev", "", False, True, "tillåten avsändare"),
+        ("nyheter@butik.se", "Kallelse", "", True, False, "nekad avsändare"),
+        ("noreply@sub.butik.se", "Kallelse", "", True, False, "nekad avsändare"),
+        ("x@example.se", "Kallelse till besök", "Tid: 2026-05-12 kl. 15.00", True, True, "poäng över tröskeln"),
+        ("x@example.se", "Veckans erbjudanden", "Handla nu!", False, False, "poäng under tröskeln"),
+    ],
+)
+def test_prefilter_classify(sender, subject, body, has_pdf, analyze, reason):
+    prefilter = MailPrefilter("info@vc.se", "butik.se", 3)
+    result = prefilter.classify({"From": f"Avsändare <{sender}>"}, subject, body, has_pdf)
+    assert result[0] is analyze
+    assert result[2] == reason
+
+
+def test_prefilter_threshold_zero_analyzes_everything():
+    prefilter = MailPrefilter("", "", 0)
+    assert prefilter.classify({"From": "a@b.se"}, "Hej", "", False)[:2] == (True, None)
+
+
+def test_prefilter_bulk_headers_lower_score():
+    plain = MailPrefilter.score({}, "Bokning", "", False)
+    bulk = MailPrefilter.score(
+        {"List-Unsubscribe": "<mailto:x@y.se>", "Precedence": "bulk", "Auto-Submitted": "auto-generated"},
+        "Bokning", "", False,
+    )
+    assert bulk < plain
@@ -0,0 +1,198 @@
+# Fil: custom_components/mail_agent/tests/test_imap_utils.py | Version: 0.19.0 | Datum: 2026-10-17
+"""Tester för tolkningen av IMAP-svar (FETCH, BODYSTRUCTURE) och kommandon."""
+
+import pytest
+
+from custom_components.mail_agent.imap_utils import (
+    _literal_name,
+    format_uid_set,
+    iter_body_parts,
+    parse_bodystructure,
+    parse_fetch_response,
+    parse_folder_list,
+    quote_mailbox,
+)
+
+# Riktiga svar i den form imaplib lämnar dem: literaler som (huvud, data), resten som bytes
+HEADER_1 = b"From: Vardcentralen <info@vc.se>\r\nSubject: Kallelse\r\n\r\n"
+HEADER_2 = b"From: Skolan <info@skola.se>\r\nSubject: Info\r\n\r\n"
+FETCH_OVERVIEW = [
+    (
+        b'1 (UID 101 RFC822.SIZE 5123 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL '
+        b'"QUOTED-PRINTABLE" 120 4 NIL NIL NIL NIL)("APPLICATION" "PDF" ("NAME" "kallelse.pdf") NIL NIL '
+        b'"BASE64" 4000 NIL ("ATTACHMENT" ("FILENAME" "kallelse.pdf")) NIL NIL) "MIXED" '
+        b'("BOUNDARY" "b1") NIL NIL NIL) BODY[HEADER] {%d}' % len(HEADER_1),
+        HEADER_1,
+    ),
+    b")",
+    (
+        b'2 (UID 102 RFC822.SIZE 800 BODYSTRUCTURE ("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" '
+        b"300 10 NIL NIL NIL NIL) BODY[HEADER] {%d}" % len(HEADER_2),
+        HEADER_2,
+    ),
+    b")",
+]
+
+
+def _parts(bodystructure):
+    meta = b"1 (UID 1 BODYSTRUCTURE " + bodystructure + b")"
+    return list(iter_body_parts(parse_bodystructure(meta)))
+
+
+@pytest.mark.parametrize(
+    ("uids", "expected"),
+    [
+        ([], ""),
+        ([7], "7"),
+        ([1, 2, 3, 4, 5], "1:5"),
+        ([9, 1, 2, 10, 7, 2], "1:2,7,9:10"),
+    ],
+)
+def test_format_uid_set(uids, expected):
+    assert format_uid_set(uids) == expected
+
+
+def test_parse_folder_list():
+    assert parse_folder_list(" INBOX, Kallelser ,INBOX,,") == ["INBOX", "Kallelser"]
+    assert parse_folder_list("") == ["INBOX"]
+
+
+@pytest.mark.parametrize(
+    ("name", "expected"),
+    [
+        ("INBOX", '"INBOX"'),
+        ("Skickat & arkiv", '"Skickat &- arkiv"'),
+        ("Kallelser/Vård", '"Kallelser/V&AOU-rd"'),
+        ('a"b\\c', '"a\\"b\\\\c"'),
+    ],
+)
+def test_quote_mailbox(name, expected):
+    assert quote_mailbox(name) == expected
+
+
+@pytest.mark.parametrize(
+    ("head", "expected"),
+    [
+        (b"1 (UID 5 BODY[HEADER] {42}", b"BODY[HEADER]"),
+        (b"1 (UID 5 BODY[2] {10}", b"BODY[2]"),
+        (b"1 (UID 5 BODY[2]<0> {10}", b"BODY[2]"),
+        (b"1 (UID 5 BODY[1.MIME] {80}", b"BODY[1.MIME]"),
+        (b"1 (UID 5 BODY[HEADER.FIELDS (FROM SUBJECT)] {20}", b"BODY[HEADER.FIELDS (FROM SUBJECT)]"),
+        (b"1 (UID 5 RFC822 {100}", b"RFC822"),
+        # Literal inuti BODYSTRUCTURE: inget BODY-namn, så den läggs in som sträng
+        (b'1 (UID 5 BODYSTRUCTURE ("APPLICATION" "PDF" ("NAME" {12}', b'"NAME"'),
+    ],
+)
+def test_literal_name(head, expected):
+    assert _literal_name(head) == expected
+
+
+def test_parse_fetch_response_groups_per_uid():
+    parsed = parse_fetch_response(FETCH_OVERVIEW)
+
+    assert sorted(parsed) == [101, 102]
+    assert parsed[101]["literals"] == {"BODY[HEADER]": HEADER_1}
+    assert parsed[102]["literals"] == {"BODY[HEADER]": HEADER_2}
+    assert b"RFC822.SIZE 5123" in parsed[101]["meta"]
+    assert HEADER_1 not in parsed[101]["meta"]
+
+
+def test_parse_fetch_response_partial_body():
+    data = [(b"3 (UID 103 BODY[2]<0> {4}", b"JVBE"), b")"]
+    assert parse_fetch_response(data)[103]["literals"] == {"BODY[2]": b"JVBE"}
+
+
+def test_parse_fetch_response_literal_inside_bodystructure():
+    # T.ex. Gmail skickar filnamn med 8-bitarstecken som literal mitt i BODYSTRUCTURE
+    name = "räkning \"mars\".pdf".encode()
+    data = [
+        (
+            b'4 (UID 104 BODYSTRUCTURE (("TEXT" "PLAIN" NIL NIL NIL "7BIT" 10 1 NIL NIL NIL NIL)'
+            b'("APPLICATION" "PDF" ("NAME" {%d}' % len(name),
+            name,
+        ),
+        b') NIL NIL "BASE64" 2000 NIL NIL NIL NIL) "MIXED" NIL NIL NIL NIL))',
+    ]
+    message = parse_fetch_response(data)[104]
+    assert message["literals"] == {}
+
+    parts = list(iter_body_parts(parse_bodystructure(message["meta"])))
+    assert [p["filename"] for p in parts] == [None, 'räkning "mars".pdf']
+
+
+def test_parse_fetch_response_ignores_none_and_unknown():
+    assert parse_fetch_response([None]) == {}
+    assert parse_fetch_response([b"5 (FLAGS (\\Seen))"]) == {}
+
+
+def test_parse_bodystructure_missing_or_broken():
+    assert parse_bodystructure(b"1 (UID 1 RFC822.SIZE 10)") is None
+    assert parse_bodystructure(b'1 (UID 1 BODYSTRUCTURE ("TEXT" "PLAIN"') is None
+
+
+def test_iter_body_parts_multipart():
+    parsed = parse_fetch_response(FETCH_OVERVIEW)
+    parts = list(iter_body_parts(parse_bodystructure(parsed[101]["meta"])))
+
+    assert [(p["section"], p["type"], p["filename"]) for p in parts] == [
+        ("1", "text/plain", None),
+        ("2", "application/pdf", "kallelse.pdf"),
+    ]
+    assert parts[0]["encoding"] == "quoted-printable"
+    assert parts[1]["size"] == 4000
+    assert not any(p["top_level"] for p in parts)
+
+
+def test_iter_body_parts_single_part():
+    parsed = parse_fetch_response(FETCH_OVERVIEW)
+    parts = list(iter_body_parts(parse_bodystructure(parsed[102]["meta"])))
+
+    assert len(parts) == 1
+    assert parts[0]["top_level"]
+    assert parts[0]["type"] == "text/plain"
+    assert parts[0]["params"] == {"charset": "utf-8"}
+
+
+def test_iter_body_parts_nested_and_forwarded():
+    parts = _parts(
+        b'((("TEXT" "PLAIN" NIL NIL NIL "7BIT" 10 1 NIL NIL NIL NIL)'
+        b'("TEXT" "HTML" NIL NIL NIL "7BIT" 20 1 NIL NIL NIL NIL) "ALTERNATIVE" NIL NIL NIL NIL)'
+        b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 500 (NIL "Fwd" NIL NIL NIL NIL NIL NIL NIL NIL) '
+        b'(("TEXT" "PLAIN" NIL NIL NIL "7BIT" 30 2 NIL NIL NIL NIL)'
+        b'("APPLICATION" "PDF" ("NAME" "a.pdf") NIL NIL "BASE64" 90 NIL NIL NIL NIL) "MIXED" NIL NIL NIL NIL) '
+        b'12 NIL NIL NIL NIL) "MIXED" NIL NIL NIL NIL)'
+    )
+    assert [(p["section"], p["type"]) for p in parts] == [
+        ("1.1", "text/plain"),
+        ("1.2", "text/html"),
+        ("2.1", "text/plain"),
+        ("2.2", "application/pdf"),
+    ]
+    assert parts[3]["filename"] == "a.pdf"
+
+
+@pytest.mark.parametrize(
+    ("params", "disposition", "expected"),
+    [
+        (b'("NAME" "vanlig.pdf")', b"NIL", "vanlig.pdf"),
+        (b"NIL", b'("ATTACHMENT" ("FILENAME" "bilaga.pdf"))', "bilaga.pdf"),
+        # Disposition går före name
+        (b'("NAME" "namn.pdf")', b'("ATTACHMENT" ("FILENAME" "fil.pdf"))', "fil.pdf"),
+        # RFC 2231: utökat värde
+        (b"NIL", b"(\"ATTACHMENT\" (\"FILENAME*\" \"utf-8''Kallelse_tandl%C3%A4kare.pdf\"))",
+         "Kallelse_tandläkare.pdf"),
+        # RFC 2231: fortsättningar, utökade och vanliga blandat
+        (b"(\"NAME*0*\" \"iso-8859-1'sv'r%E4\" \"NAME*1\" \"kning.pdf\")", b"NIL", "räkning.pdf"),
+        (b'("NAME*1" "del2.pdf" "NAME*0" "del1_")', b"NIL", "del1_del2.pdf"),
+        # Utökat värde går före ett vanligt med samma namn
+        (b"(\"NAME\" \"fallback.pdf\" \"NAME*\" \"utf-8''%C3%B6.pdf\")", b"NIL", "ö.pdf"),
+        (b"NIL", b"NIL", None),
+    ],
+)
+def test_filename_parameters(params, disposition, expected):
+    parts = _parts(
+        b'(("TEXT" "PLAIN" NIL NIL NIL "7BIT" 10 1 NIL NIL NIL NIL)'
+        b'("APPLICATION" "PDF" ' + params + b' NIL NIL "BASE64" 100 NIL ' + disposition + b" NIL NIL)"
+        b' "MIXED" NIL NIL NIL NIL)'
+    )
+    assert parts[1]["filename"] == expected